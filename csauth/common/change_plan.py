@@ -0,0 +1,132 @@
+
+""" Change plans: the writes a loader would make, computed without writing.
+    A change names the ldap_helpers function which makes the write
+    followed by its keyword arguments, eg.
+
+        {"action": "sync_user_password", "cn": "jdoe", "userPassword": "{CRYPT}..."}
+
+    A plan is saved as JSON, which can be applied later as is,
+    and as LDIF (rendered by an ldap3 LDIF connection) for review.
+"""
+
+import datetime as dt
+import json
+from functools import partial
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Tuple,
+)
+
+from ldap3 import Connection as LDAPConnection, LDIF
+
+from common import ldap_helpers as ldap
+from common.file_wrapper import OutputFileWrapper
+
+
+PLAN_VERSION = 1
+
+ADD_POSIX_USER = 'add_posix_user'
+SYNC_USER_PASSWORD = 'sync_user_password'
+ADD_POSIX_GROUP = 'add_posix_group'
+SET_POSIX_GROUP_MEMBERS = 'set_posix_group_members'
+
+# Users are written before groups.
+USER_ACTIONS = (ADD_POSIX_USER, SYNC_USER_PASSWORD)
+GROUP_ACTIONS = (ADD_POSIX_GROUP, SET_POSIX_GROUP_MEMBERS)
+
+
+class InvalidChangePlanError(ValueError):
+    pass
+
+
+def add_posix_user(cn: str, attrs: Dict) -> Dict:
+    """ attrs['userPassword'] is the hashed password as a str.
+    """
+    return {'action': ADD_POSIX_USER, 'cn': cn, 'attrs': attrs}
+
+
+def sync_user_password(cn: str, userPassword: str) -> Dict:
+    return {'action': SYNC_USER_PASSWORD, 'cn': cn, 'userPassword': userPassword}
+
+
+def add_posix_group(cn: str, attrs: Dict) -> Dict:
+    return {'action': ADD_POSIX_GROUP, 'cn': cn, 'attrs': attrs}
+
+
+def set_posix_group_members(cn: str, memberUids: List[str]) -> Dict:
+    return {'action': SET_POSIX_GROUP_MEMBERS, 'cn': cn, 'memberUids': memberUids}
+
+
+def get_send(change: Dict) -> partial:
+    """ The send operation (see ldap_pipeline) which makes a change.
+        Adds are optimistic, the plan was made against a snapshot.
+    """
+    action = change['action']
+    if action == ADD_POSIX_USER:
+        attrs = dict(change['attrs'])
+        attrs['userPassword'] = attrs['userPassword'].encode('utf-8')
+        return partial(ldap.add_posix_user, cn=change['cn'], attrs=attrs, optimistic=True)
+    if action == SYNC_USER_PASSWORD:
+        return partial(
+            ldap.sync_user_password,
+            cn=change['cn'],
+            userPassword=change['userPassword'].encode('utf-8'),
+        )
+    if action == ADD_POSIX_GROUP:
+        return partial(ldap.add_posix_group, cn=change['cn'], attrs=change['attrs'], optimistic=True)
+    if action == SET_POSIX_GROUP_MEMBERS:
+        return partial(ldap.set_posix_group_members, cn=change['cn'], memberUids=change['memberUids'])
+    raise InvalidChangePlanError(f'unknown change action "{action}"')
+
+
+def write_plan(
+    report_name: str,
+    changes: List[Dict],
+    inputs: Dict[str, str],
+) -> Tuple[str, str]:
+    """ Write the plan as JSON and LDIF output files.
+        Returns (json path, ldif path).
+    """
+    counts = {action: 0 for action in USER_ACTIONS + GROUP_ACTIONS}
+    for change in changes:
+        counts[change['action']] += 1
+
+    json_output = OutputFileWrapper(report_name, 'json')
+    with open(*json_output.write_args) as f:
+        json.dump({
+            'version': PLAN_VERSION,
+            'created': dt.datetime.now().isoformat(),
+            'inputs': inputs,
+            'counts': counts,
+            'changes': changes,
+        }, f, indent=1)
+
+    ldif_output = OutputFileWrapper(report_name, 'ldif')
+    with open(*ldif_output.write_args) as f:
+        _write_ldif(f, changes)
+
+    return json_output.full_path, ldif_output.full_path
+
+
+def _write_ldif(fp, changes: Iterable[Dict]) -> None:
+    # The LDIF client strategy writes each operation to the stream
+    # instead of sending it.
+    conn = LDAPConnection(None, client_strategy=LDIF)
+    conn.stream = fp
+    conn.open()
+    for change in changes:
+        get_send(change)(conn)
+    fp.write('\n')
+
+
+def read_plan(path: str) -> Dict:
+    with open(path) as f:
+        try:
+            plan = json.load(f)
+        except json.JSONDecodeError as e:
+            raise InvalidChangePlanError(f'{path} is not a change plan: {e}')
+    if not isinstance(plan, dict) or plan.get('version') != PLAN_VERSION:
+        raise InvalidChangePlanError(f'{path} is not a version {PLAN_VERSION} change plan')
+    return plan
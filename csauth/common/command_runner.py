@@ -1,11 +1,35 @@
 
 """ CommandRunner is a simple wrapper
     for running system commands.
+
+    SubprocessRunner runs commands with subprocess instead of os.system.
+    Output is read through a pipe into a spooled buffer, it is only
+    written to a TMP_DIR file once it grows past SPOOL_MAX_SIZE.
+    Commands can be given a timeout, run_many runs independent
+    commands concurrently with bounded parallelism.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import os
+import shutil
+import signal
+import subprocess
+from tempfile import SpooledTemporaryFile
+import threading
+from typing import (
+    Iterable,
+    List,
+    Optional,
+)
 
 from common.file_wrapper import TMPFileWrapper
+from settings import TMP_DIR
+
+
+# Output held in memory before spilling to a TMP_DIR file.
+SPOOL_MAX_SIZE = 1024 * 1024
+
+RUN_MANY_MAX_WORKERS = 8
 
 
 class CommandRunnerError(Exception):
@@ -14,6 +38,9 @@ class CommandRunnerError(Exception):
 class NonZeroExitCodeError(CommandRunnerError):
     pass
 
+class CommandTimeoutError(CommandRunnerError):
+    pass
+
 
 class CommandRunner:
 
@@ -78,6 +105,9 @@ class CommandRunner:
         self._out_file_wrapper.remove()
         self._output_available = False
 
+    def _saved_output(self):
+        return self._out_file_wrapper
+
     def _validate_can_interact_with_saved_result(self) -> None:
         if not self._completed:
             raise CommandRunnerError(
@@ -87,9 +117,132 @@ class CommandRunner:
             raise CommandRunnerError(
                 "cannot access command result. Command did not save output."
             )
-        if not self._out_file_wrapper:
+        if not self._saved_output():
             raise NotImplementedError
         if not self._output_available:
             raise CommandRunnerError(
                 "cannot access command result. File already deleted"
             )
+
+
+class SubprocessRunner(CommandRunner):
+
+    def __init__(self,
+        command: str,
+        run_now=True,
+        raise_for_non_zero_exit_codes=True,
+        get_output=True,
+        timeout: Optional[float] = None,
+    ):
+        self._timeout = timeout
+        self._timed_out = False
+        self._spool = None
+        super().__init__(
+            command,
+            run_now=run_now,
+            raise_for_non_zero_exit_codes=raise_for_non_zero_exit_codes,
+            get_output=get_output,
+        )
+
+    @property
+    def exit_code(self) -> Optional[int]:
+        return self._exit_code
+
+    @property
+    def timed_out(self) -> bool:
+        return self._timed_out
+
+    def run_command(self):
+        if self._completed:
+            raise CommandRunnerError(
+                "Command has already completed."
+            )
+        # The command gets its own process group so a timeout
+        # also kills the processes started by the shell.
+        process = subprocess.Popen(
+            self._command,
+            shell=True,
+            stdout=subprocess.PIPE if self._get_output else None,
+            stderr=subprocess.STDOUT if self._get_output else None,
+            start_new_session=True,
+        )
+        reader = None
+        if self._get_output:
+            # Output is copied on a thread so the wait below can time out.
+            self._spool = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, dir=TMP_DIR)
+            reader = threading.Thread(target=self._copy_output, args=(process.stdout,))
+            reader.start()
+        try:
+            self._exit_code = process.wait(timeout=self._timeout)
+        except subprocess.TimeoutExpired:
+            self._kill(process)
+            self._exit_code = process.wait()
+        if reader is not None:
+            reader.join()
+            self._output_available = True
+        self._completed = True
+
+        if self._raise_for_non_zero_exit_codes:
+            self.raise_for_exit_code()
+
+    def _copy_output(self, stdout) -> None:
+        with stdout:
+            shutil.copyfileobj(stdout, self._spool)
+
+    def _kill(self, process: subprocess.Popen) -> None:
+        # A process which has not been reaped still holds its pid,
+        # so the process group id can not have been reused.
+        if process.poll() is not None:
+            return
+        self._timed_out = True
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def raise_for_exit_code(self):
+        if self._timed_out:
+            result = self.read_result() if self._output_available else None
+            raise CommandTimeoutError(
+                f'timed out after {self._timeout}s for command "{self._command}" -> "{result}"'
+            )
+        super().raise_for_exit_code()
+
+    def read_result(self) -> str:
+        self._validate_can_interact_with_saved_result()
+        self._spool.seek(0)
+        return self._spool.read().decode('utf-8', errors='replace')
+
+    def delete_results(self) -> None:
+        self._validate_can_interact_with_saved_result()
+        self._spool.close()
+        self._output_available = False
+
+    def _saved_output(self):
+        return self._spool
+
+
+def run_many(
+    commands: Iterable[str],
+    max_workers: int = RUN_MANY_MAX_WORKERS,
+    timeout: Optional[float] = None,
+    get_output=True,
+) -> List[SubprocessRunner]:
+    """ Run independent commands concurrently, at most max_workers at a time.
+        Returns a completed runner per command, in the order given.
+        Exit codes are not raised, call raise_for_exit_code() on each runner.
+    """
+    runners = [
+        SubprocessRunner(
+            command,
+            run_now=False,
+            raise_for_non_zero_exit_codes=False,
+            get_output=get_output,
+            timeout=timeout,
+        )
+        for command in commands
+    ]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # list() re-raises the 1st error (ie. the command could not be started).
+        list(executor.map(SubprocessRunner.run_command, runners))
+    return runners
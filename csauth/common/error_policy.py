@@ -0,0 +1,126 @@
+
+""" What a loader does when an LDAP operation fails.
+
+    prompt      ask on the terminal whether to continue (default).
+    continue    keep importing.
+    abort       stop importing.
+    retry:N     resend the operation up to N more times, then keep importing.
+
+    Rows which still fail are appended to a rejects .tsv file
+    (see OutputFileWrapper) followed by the LDAP result, so only
+    those rows need to be fed to the loader again.
+"""
+
+import csv
+from logging import Logger
+import threading
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+from common.file_wrapper import OutputFileWrapper
+
+
+# Actions returned by ErrorPolicy.on_error
+CONTINUE = 'continue'
+ABORT = 'abort'
+RETRY = 'retry'
+PROMPT = 'prompt'
+
+ERROR_POLICY_CHOICES = (PROMPT, CONTINUE, ABORT, RETRY + ':N')
+
+
+class InvalidErrorPolicyError(ValueError):
+    pass
+
+
+def parse_error_policy(value: str) -> Tuple[str, int]:
+    """ Parse an --on-error value into (action, retries).
+    """
+    action, _sep, retries = value.strip().lower().partition(':')
+    if action in (PROMPT, CONTINUE, ABORT) and not retries:
+        return action, 0
+    if action == RETRY and retries.isdigit() and int(retries) > 0:
+        return action, int(retries)
+    raise InvalidErrorPolicyError(
+        f'invalid error policy "{value}", expected one of {", ".join(ERROR_POLICY_CHOICES)}'
+    )
+
+
+# Workers share the terminal, only 1 of them may prompt at a time.
+_PROMPT_LOCK = threading.Lock()
+
+
+class ErrorPolicy:
+
+    def __init__(
+        self,
+        logger: Logger,
+        policy: str,
+        rejects_report_name: str,
+    ):
+        self._logger = logger
+        self._action, self._retries = parse_error_policy(policy)
+        self._rejects_report_name = rejects_report_name
+        self._rejects_output = None
+        self._rejects_fp = None
+        self._rejects_writer = None
+        self._lock = threading.Lock()
+
+    @property
+    def rejects_path(self) -> Optional[str]:
+        return self._rejects_output.full_path if self._rejects_output else None
+
+    def on_error(self, row: List[str], result: Dict, attempts: int) -> str:
+        """ Decide what to do about a failed operation.
+            Returns CONTINUE, ABORT, or RETRY.
+        """
+        if self._action == RETRY and attempts <= self._retries:
+            return RETRY
+
+        self.reject(row, result)
+        if self._action == PROMPT:
+            return CONTINUE if self._prompt_to_continue() else ABORT
+        if self._action == ABORT:
+            return ABORT
+        return CONTINUE
+
+    def reject(self, row: List[str], result: Dict) -> None:
+        with self._lock:
+            if self._rejects_writer is None:
+                # The rejects file is only created once there is a reject.
+                self._rejects_output = OutputFileWrapper(self._rejects_report_name, 'tsv')
+                self._rejects_fp = open(*self._rejects_output.write_args)
+                self._rejects_writer = csv.writer(self._rejects_fp, delimiter='\t')
+                self._logger.info(f'writing rejected rows to {self._rejects_output.full_path}')
+            self._rejects_writer.writerow(list(row) + [
+                result.get('result', ''),
+                result.get('description', ''),
+                result.get('message', ''),
+            ])
+
+    def close(self) -> None:
+        with self._lock:
+            if self._rejects_fp is not None:
+                self._rejects_fp.close()
+                self._rejects_fp = None
+                self._rejects_writer = None
+
+    def _prompt_to_continue(self) -> bool:
+        with _PROMPT_LOCK:
+            should_continue = input("press y to continue importing: ")
+        if should_continue.lower().strip() == 'y':
+            self._logger.debug("continuing...")
+            return True
+        else:
+            self._logger.debug("exiting...")
+            return False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
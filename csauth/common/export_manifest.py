@@ -0,0 +1,94 @@
+
+""" Per-row content digests of an export, used for delta exports.
+    A manifest is a .tsv file (see OutputFileWrapper) with 1 row per
+    exported row: kind (eg. posixUser), name (1st column), digest.
+
+    Given the manifest of an earlier export, only rows which were added
+    or changed since are passed on. Rows which were removed are listed
+    in a <kind>-removed .tsv report.
+"""
+
+from collections import Counter
+import csv
+import hashlib
+from logging import Logger
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+)
+
+from common.file_wrapper import OutputFileWrapper
+
+
+def row_digest(row: List[str]) -> str:
+    return hashlib.blake2b('\t'.join(row).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def read_manifest(path: str) -> Dict[str, Dict[str, str]]:
+    """ Map of {kind => {name => digest, ...}, ...}
+    """
+    manifest = {}
+    with open(path) as f:
+        for kind, name, digest in csv.reader(f, delimiter='\t'):
+            manifest.setdefault(kind, {})[name] = digest
+    return manifest
+
+
+class ExportManifest:
+
+    def __init__(self, previous_manifest_path: Optional[str] = None):
+        self._previous = (
+            read_manifest(previous_manifest_path)
+            if previous_manifest_path
+            else None
+        )
+        self.output = OutputFileWrapper('unix-manifest', 'tsv')
+        self.removed: Dict[str, List[str]] = {}
+        self.summary = Counter()
+
+    @property
+    def is_delta(self) -> bool:
+        return self._previous is not None
+
+    def track(self, kind: str, rows: Iterable[List[str]]) -> Iterator[List[str]]:
+        """ Record the digest of every row. For a delta export
+            only rows which were added or changed are yielded.
+        """
+        previous = self._previous.pop(kind, {}) if self.is_delta else None
+        with open(*self.output.write_args) as fp:
+            writer = csv.writer(fp, delimiter='\t')
+            for row in rows:
+                name = row[0]
+                digest = row_digest(row)
+                writer.writerow([kind, name, digest])
+                if previous is None:
+                    yield row
+                    continue
+
+                previous_digest = previous.pop(name, None)
+                if previous_digest is None:
+                    self.summary[f'{kind}_added'] += 1
+                    yield row
+                elif previous_digest != digest:
+                    self.summary[f'{kind}_changed'] += 1
+                    yield row
+                else:
+                    self.summary[f'{kind}_unchanged'] += 1
+
+        if previous is not None:
+            # Whatever was not seen again has been removed.
+            self.removed[kind] = sorted(previous)
+            if previous:
+                self.summary[f'{kind}_removed'] += len(previous)
+
+    def write_removed_reports(self, logger: Logger) -> None:
+        for kind, names in self.removed.items():
+            if not names:
+                continue
+            report = OutputFileWrapper(kind + '-removed', 'tsv')
+            with report as fp:
+                csv.writer(fp, delimiter='\t').writerows([name] for name in names)
+            logger.info(f"removed {kind} rows written to {report.full_path}")
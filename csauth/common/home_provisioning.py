@@ -0,0 +1,161 @@
+
+""" Provision home directories for new users: mkdir, copy skel, chmod, chown, and quota.
+    The steps of a user run in order, users are provisioned concurrently
+    with at most workers users in progress (the NFS home server is the bottleneck).
+
+    Each user gets a result row:
+
+        tsv columns: user-name home-directory status failed-step detail
+
+    status is one of provisioned, exists, or failed. A failed user does
+    not stop the other users. Steps are safe to rerun: an existing home
+    directory (exists) is not created and skel is not copied into it,
+    but its mode, owner, and quota are applied again, so a home left
+    half done by an earlier run is completed.
+
+    Home directories are normalized and must be below the home base
+    (ie. /home/../etc fails), so mkdir and chown stay in the home base.
+
+    With a dry run root, home directories are created below the root
+    (ie. /home/jdoe => ROOT/home/jdoe, a home which normalizes to a path
+    outside the root fails) and skel is copied, chown and setquota are
+    only logged. This allows testing without NFS or root.
+"""
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import csv
+from logging import Logger
+import os
+import shlex
+from typing import (
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from common.command_runner import CommandRunnerError, SubprocessRunner
+from common.file_wrapper import OutputFileWrapper
+
+
+DEFAULT_HOME_BASE = '/home'
+DEFAULT_SKEL_DIR = '/etc/skel'
+PROVISION_WORKERS = 16
+STEP_TIMEOUT_SECONDS = 120
+
+PROVISIONED = 'provisioned'
+EXISTS = 'exists'
+FAILED = 'failed'
+
+
+class HomeProvisioner:
+
+    def __init__(
+        self,
+        logger: Logger,
+        skel_dir: str = DEFAULT_SKEL_DIR,
+        quota: Optional[Tuple[str, int, int]] = None,
+        dry_run_root: Optional[str] = None,
+        home_base: str = DEFAULT_HOME_BASE,
+    ):
+        """ quota is (filesystem, soft block limit, hard block limit).
+        """
+        self._logger = logger
+        self._skel_dir = skel_dir
+        self._quota = quota
+        self._dry_run_root = dry_run_root
+        self._home_base = os.path.normpath(home_base)
+
+    def _steps(
+        self,
+        uid: str,
+        gid: str,
+        home: str,
+        exists: bool,
+    ) -> List[Tuple[str, str, bool]]:
+        """ [(step name, command, runs in a dry run), ...]
+            mkdir and skel only run for a new home directory.
+        """
+        steps = []
+        if not exists:
+            steps.append(('mkdir', f'mkdir -p {shlex.quote(home)}', True))
+        if not exists and os.path.isdir(self._skel_dir):
+            steps.append((
+                'skel', f'cp -a {shlex.quote(self._skel_dir)}/. {shlex.quote(home)}/', True,
+            ))
+        # Set after skel, cp -a copies the mode of the skel directory.
+        steps.append(('chmod', f'chmod 700 {shlex.quote(home)}', True))
+        steps.append(('chown', f'chown -R {int(uid)}:{int(gid)} {shlex.quote(home)}', False))
+        if self._quota is not None:
+            filesystem, soft, hard = self._quota
+            # By uid, a new user name may not resolve (NSS) yet.
+            steps.append((
+                'quota',
+                f'setquota -u {int(uid)} {int(soft)} {int(hard)} 0 0 {shlex.quote(filesystem)}',
+                False,
+            ))
+        return steps
+
+    def provision(self, user: List[str]) -> List[str]:
+        """ Provision the home directory of a PosixUser row, returns its result row.
+        """
+        username, uid, gid = user[:3]
+        home = user[5]
+        if not os.path.isabs(home):
+            return [username, home, FAILED, 'mkdir', 'home directory is not an absolute path']
+        home = os.path.normpath(home)
+        if home == self._home_base or os.path.commonpath([self._home_base, home]) != self._home_base:
+            return [username, user[5], FAILED, 'mkdir', f'home directory is not below {self._home_base}']
+        if self._dry_run_root is not None:
+            home = os.path.join(os.path.abspath(self._dry_run_root), home.lstrip('/'))
+
+        exists = os.path.exists(home)
+        if exists:
+            self._logger.info(
+                f"home directory of {username} already exists {home}, applying mode, owner, and quota"
+            )
+        for step, command, runs_in_dry_run in self._steps(uid, gid, home, exists):
+            if self._dry_run_root is not None and not runs_in_dry_run:
+                self._logger.debug(f"dry run, not running: {command}")
+                continue
+            runner = SubprocessRunner(
+                command,
+                run_now=False,
+                raise_for_non_zero_exit_codes=False,
+                timeout=STEP_TIMEOUT_SECONDS,
+            )
+            runner.run_command()
+            try:
+                runner.raise_for_exit_code()
+            except CommandRunnerError as e:
+                self._logger.error(f"failed to provision home directory of {username}: {e}")
+                return [username, home, FAILED, step, str(e)]
+            finally:
+                runner.delete_results()
+        if exists:
+            return [username, home, EXISTS, '', '']
+        self._logger.info(f"provisioned home directory of {username} {home}")
+        return [username, home, PROVISIONED, '', '']
+
+    def provision_many(
+        self,
+        users: Iterable[List[str]],
+        workers: int = PROVISION_WORKERS,
+    ) -> List[List[str]]:
+        """ Provision users concurrently, returns their result rows in order.
+        """
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self.provision, users))
+
+
+def write_provisioning_report(logger: Logger, results: List[List[str]]) -> Counter:
+    """ Write the result rows to a home-provisioning report, returns the count per status.
+    """
+    report = OutputFileWrapper('home-provisioning', 'tsv')
+    with report as fp:
+        writer = csv.writer(fp, delimiter='\t')
+        #tsv columns: user-name home-directory status failed-step detail
+        writer.writerows(results)
+    logger.info(f"home directory results written to {report.full_path}")
+    return Counter(f'home_directories_{status}' for _username, _home, status, *_ in results)
@@ -0,0 +1,136 @@
+
+""" Allocate free uidNumbers and gidNumbers without a scan per new user.
+
+    The used ids are passed in by callers which already hold a snapshot of
+    the users and groups, or read once (ldap_helpers.get_used_ids, only the
+    id attributes are returned). They are kept in an IdMap: a bytearray with 1 byte per id
+    between FIRST_ID and LAST_ID. Free ids are found with bytearray.find,
+    ie. a block of ids costs 1 C-level search rather than a python loop per id.
+
+    Concurrent runs are kept apart by a counter entry (cn=idCounter) holding
+    the next free uidNumber and gidNumber. Ids are only handed out at or
+    above the counter, a block is reserved by moving the counter past it
+    with an atomic test-and-set modify (delete the value read, add the new
+    value). A run which loses the race re-reads the counter and tries again
+    above the new value.
+"""
+
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from ldap3 import Connection as LDAPConnection
+
+from common import ldap_helpers as ldap
+
+
+FIRST_ID = 1000
+LAST_ID = 59999
+
+UID_NUMBER = 'uidNumber'
+GID_NUMBER = 'gidNumber'
+
+# Times a reservation is retried after losing the race for the counter.
+RESERVE_ATTEMPTS = 10
+
+_FREE = 0
+_USED = 1
+
+
+class IdAllocatorError(Exception):
+    pass
+
+class IdsExhaustedError(IdAllocatorError):
+    pass
+
+class IdReservationError(IdAllocatorError):
+    pass
+
+
+class IdMap:
+    """ Used ids between first_id and last_id (inclusive), 1 byte per id.
+    """
+
+    def __init__(self, used: Iterable[int], first_id: int = FIRST_ID, last_id: int = LAST_ID):
+        self.first_id = first_id
+        self._map = bytearray(last_id - first_id + 1)
+        for used_id in used:
+            if first_id <= used_id <= last_id:
+                self._map[used_id - first_id] = _USED
+
+    def find(self, count: int, floor: int, contiguous: bool = False) -> List[int]:
+        """ The count lowest free ids >= floor, in 1 contiguous block if asked.
+            The ids are not marked as used, see mark().
+        """
+        start = max(floor - self.first_id, 0)
+        if contiguous:
+            ix = self._map.find(bytes(count), start)
+            if ix == -1:
+                raise IdsExhaustedError(f'no block of {count} free ids above {floor}')
+            return list(range(self.first_id + ix, self.first_id + ix + count))
+
+        ids = []
+        ix = start
+        while len(ids) < count:
+            ix = self._map.find(_FREE, ix)
+            if ix == -1:
+                raise IdsExhaustedError(f'fewer than {count} free ids above {floor}')
+            ids.append(self.first_id + ix)
+            ix += 1
+        return ids
+
+    def mark(self, ids: Iterable[int]) -> None:
+        for used_id in ids:
+            self._map[used_id - self.first_id] = _USED
+
+
+class IdAllocator:
+
+    def __init__(
+        self,
+        conn: LDAPConnection,
+        first_id: int = FIRST_ID,
+        last_id: int = LAST_ID,
+        used_ids: Optional[Tuple[Set[int], Set[int]]] = None,
+    ):
+        """ used_ids is (used uidNumbers, used gidNumbers), read from the directory if not given.
+        """
+        self._conn = conn
+        self._first_id = first_id
+        self._counter = self._read_counter()
+        used_uids, used_gids = used_ids if used_ids is not None else ldap.get_used_ids(conn)
+        self._maps: Dict[str, IdMap] = {
+            UID_NUMBER: IdMap(used_uids, first_id, last_id),
+            GID_NUMBER: IdMap(used_gids, first_id, last_id),
+        }
+
+    def _read_counter(self) -> Dict[str, int]:
+        counter = ldap.get_id_counter(self._conn)
+        if counter is None:
+            # Another run may create it first, either way it is read back.
+            ldap.add_id_counter(self._conn, self._first_id)
+            counter = ldap.get_id_counter(self._conn)
+        return counter
+
+    def reserve(self, attribute: str, count: int, contiguous: bool = False) -> List[int]:
+        """ Reserve count free ids of attribute (uidNumber or gidNumber).
+        """
+        if count == 0:
+            return []
+        for _attempt in range(RESERVE_ATTEMPTS):
+            floor = max(self._counter[attribute], self._first_id)
+            ids = self._maps[attribute].find(count, floor, contiguous)
+            next_free = ids[-1] + 1
+            if ldap.advance_id_counter(self._conn, attribute, self._counter[attribute], next_free):
+                self._counter[attribute] = next_free
+                self._maps[attribute].mark(ids)
+                return ids
+            self._counter = self._read_counter()
+        raise IdReservationError(
+            f'{attribute} counter kept changing, gave up after {RESERVE_ATTEMPTS} attempts'
+        )
@@ -0,0 +1,104 @@
+
+""" Append-only progress journal for resumable imports.
+    The journal for an input file lives in TMP_DIR and is named after
+    the sha256 digest of the file's contents. The number of every row
+    which has been committed is appended to it.
+
+    Inputs which are not files (eg. in-process streams) get a NullJournal.
+"""
+
+import hashlib
+import os
+import os.path
+import threading
+from typing import (
+    Iterable,
+    Iterator,
+    Set,
+    Tuple,
+)
+
+from settings import TMP_DIR
+
+
+_READ_BLOCK_SIZE = 1024 * 1024
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_READ_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ImportJournal:
+
+    def __init__(self, input_path: str, resume: bool = False, key: str = ''):
+        """ key tells apart journals of the same file, eg. of different row ranges.
+        """
+        self.full_path = os.path.join(
+            TMP_DIR, file_digest(input_path) + key + '.journal',
+        )
+        self.committed = self._read_committed() if resume else set()
+        self._lock = threading.Lock()
+        # Line buffered, each committed row is written out right away.
+        self._fp = open(self.full_path, 'a' if resume else 'w', buffering=1)
+
+    def _read_committed(self) -> Set[int]:
+        if not os.path.exists(self.full_path):
+            return set()
+        with open(self.full_path) as f:
+            # A partially written last line is ignored.
+            return {int(line) for line in f if line.endswith('\n')}
+
+    def commit(self, row_number: int) -> None:
+        with self._lock:
+            self._fp.write(f'{row_number}\n')
+
+    def skip_committed(
+        self,
+        numbered_rows: Iterable[Tuple[int, list]],
+    ) -> Iterator[Tuple[int, list]]:
+        for row_number, row in numbered_rows:
+            if row_number not in self.committed:
+                yield row_number, row
+
+    def close(self) -> None:
+        self._fp.close()
+
+    def remove(self) -> None:
+        self.close()
+        os.remove(self.full_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if not self._fp.closed:
+            self.close()
+
+
+class NullJournal:
+    """ Journal for inputs which can not be resumed, commits are dropped.
+    """
+    full_path = None
+    committed = frozenset()
+
+    def commit(self, row_number: int) -> None:
+        pass
+
+    def skip_committed(
+        self,
+        numbered_rows: Iterable[Tuple[int, list]],
+    ) -> Iterable[Tuple[int, list]]:
+        return numbered_rows
+
+    def remove(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
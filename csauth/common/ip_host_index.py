@@ -0,0 +1,178 @@
+
+""" Local, persisted index of the ipHost entries in ou=hosts.
+    LDAP can not range-query ipHostNumber, so lookups by address and
+    subnet listings are answered from this index instead:
+
+        - a map of alias => addresses, and a reverse map of address => aliases.
+        - a binary prefix trie per address family, a CIDR range is the
+          sub trie found by walking the network's prefix bits.
+
+    The built index (both maps and the tries) is saved as JSON with the
+    newest modifyTimestamp seen, and loaded as is without being rebuilt.
+    A refresh only reads the entries modified since then, plus the
+    cn of every entry (no attributes) to drop hosts which were deleted.
+    An index saved after a refresh is built, even when ou=hosts is empty.
+"""
+
+from collections import defaultdict
+from datetime import datetime, timezone
+import ipaddress
+import json
+import os
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from settings import TMP_DIR
+
+
+INDEX_VERSION = 2
+DEFAULT_INDEX_PATH = os.path.join(TMP_DIR, 'ip-hosts.index.json')
+
+# Trie nodes are [0 child, 1 child, aliases held at this node]
+_ZERO, _ONE, _ALIASES = range(3)
+
+
+def _generalized_time(value) -> str:
+    """ LDAP GeneralizedTime string of a modifyTimestamp (a datetime once parsed by ldap3).
+    """
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc).strftime('%Y%m%d%H%M%SZ')
+    return str(value)
+
+
+class PrefixTrie:
+    """ Binary trie over the bits of the addresses of 1 address family.
+    """
+
+    def __init__(self, max_prefixlen: int, root: Optional[list] = None):
+        self.max_prefixlen = max_prefixlen
+        self._root = root if root is not None else [None, None, []]
+
+    def to_json(self) -> list:
+        return [self.max_prefixlen, self._root]
+
+    def _bits(self, address_int: int, prefixlen: int) -> Iterator[int]:
+        for shift in range(self.max_prefixlen - 1, self.max_prefixlen - 1 - prefixlen, -1):
+            yield (address_int >> shift) & 1
+
+    def insert(self, address_int: int, alias: str) -> None:
+        node = self._root
+        for bit in self._bits(address_int, self.max_prefixlen):
+            if node[bit] is None:
+                node[bit] = [None, None, []]
+            node = node[bit]
+        node[_ALIASES].append(alias)
+
+    def iter_network(
+        self,
+        network_int: int,
+        prefixlen: int,
+    ) -> Iterator[Tuple[int, str]]:
+        """ Yield (address int, alias) for every address in the network, in address order.
+        """
+        node = self._root
+        for bit in self._bits(network_int, prefixlen):
+            node = node[bit]
+            if node is None:
+                return
+        # depth first, 0 before 1, holding (node, depth, address bits so far)
+        stack = [(node, prefixlen, network_int >> (self.max_prefixlen - prefixlen))]
+        while stack:
+            node, depth, bits = stack.pop()
+            if depth == self.max_prefixlen:
+                yield from ((bits, alias) for alias in node[_ALIASES])
+                continue
+            for bit in (_ONE, _ZERO):
+                if node[bit] is not None:
+                    stack.append((node[bit], depth + 1, (bits << 1) | bit))
+
+
+class IPHostIndex:
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH):
+        self.path = path
+        self.hosts: Dict[str, List[str]] = {}
+        self.modified_since: Optional[str] = None
+        # False until the index has been refreshed from ou=hosts.
+        self.built = False
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get('version') == INDEX_VERSION:
+                self.hosts = saved['hosts']
+                self.modified_since = saved['modified_since']
+                self.built = True
+                self._aliases_by_ip = saved['aliases_by_ip']
+                self._tries = {}
+                for version, (max_prefixlen, root) in saved['tries'].items():
+                    self._tries[int(version)] = PrefixTrie(max_prefixlen, root)
+                return
+        self._build()
+
+    def _build(self) -> None:
+        aliases_by_ip = defaultdict(list)
+        self._tries = {4: PrefixTrie(32), 6: PrefixTrie(128)}
+        for alias, ips in self.hosts.items():
+            for ip in ips:
+                try:
+                    address = ipaddress.ip_address(ip)
+                except ValueError:
+                    continue
+                aliases_by_ip[str(address)].append(alias)
+                self._tries[address.version].insert(int(address), alias)
+        self._aliases_by_ip: Dict[str, List[str]] = dict(aliases_by_ip)
+
+    def update(
+        self,
+        modified_hosts: Dict[str, Dict],
+        current_aliases: Optional[set] = None,
+    ) -> Tuple[int, int]:
+        """ Apply a refresh: modified (or all) ipHost entries, and the cn
+            of every entry when only modified entries were read.
+            Returns (updated count, removed count).
+        """
+        removed = 0
+        if current_aliases is not None:
+            for alias in set(self.hosts) - current_aliases:
+                del self.hosts[alias]
+                removed += 1
+        else:
+            removed = len(set(self.hosts) - set(modified_hosts))
+            self.hosts = {}
+            self.modified_since = None
+        for alias, entry in modified_hosts.items():
+            ips = entry.get('ipHostNumber', [])
+            self.hosts[alias] = [ips] if isinstance(ips, str) else list(ips)
+            if 'modifyTimestamp' in entry:
+                timestamp = _generalized_time(entry['modifyTimestamp'])
+                self.modified_since = max(self.modified_since or timestamp, timestamp)
+        self._build()
+        self.built = True
+        return len(modified_hosts), removed
+
+    def save(self) -> None:
+        with open(self.path, 'w') as f:
+            json.dump({
+                'version': INDEX_VERSION,
+                'modified_since': self.modified_since,
+                'hosts': self.hosts,
+                'aliases_by_ip': self._aliases_by_ip,
+                'tries': {version: trie.to_json() for version, trie in self._tries.items()},
+            }, f)
+
+    def aliases_of(self, ip: str) -> List[str]:
+        return self._aliases_by_ip.get(str(ipaddress.ip_address(ip)), [])
+
+    def iter_network(self, cidr: str) -> Iterator[Tuple[str, str]]:
+        """ Yield (address, alias) for every indexed address in the CIDR range.
+        """
+        network = ipaddress.ip_network(cidr, strict=False)
+        trie = self._tries[network.version]
+        address_type = type(network.network_address)
+        for address_int, alias in trie.iter_network(int(network.network_address), network.prefixlen):
+            yield str(address_type(address_int)), alias
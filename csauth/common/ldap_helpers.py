@@ -1,16 +1,27 @@
 
 """ This contains methods to
         > Connect to the LDAP server.
+        > Pool and reuse bound connections.
         > Manage .ldif files.
         > Perform basic CRUD operations against the LDAP server.
 """
 
+import atexit
+from contextlib import contextmanager
+import functools
+import queue
 import re
 import ssl
+import threading
+import time
 from typing import (
+    Iterator,
     Optional,
     Dict,
     List,
+    Set,
+    Tuple,
+    Type,
 )
 
 from ldap3 import (
@@ -18,9 +29,22 @@ from ldap3 import (
     Connection as LDAPConnection,
     Tls,
     ALL_ATTRIBUTES,
+    BASE,
+    MODIFY_ADD,
+    MODIFY_DELETE,
     MODIFY_REPLACE,
+    NO_ATTRIBUTES,
+    SUBTREE,
+    SYNC,
 )
 from ldap3.abstract.entry import Entry as LDAPEntry
+from ldap3.core.exceptions import LDAPException
+from ldap3.core.results import (
+    RESULT_ENTRY_ALREADY_EXISTS,
+    RESULT_NO_SUCH_ATTRIBUTE,
+)
+from ldap3.core.tls import check_hostname
+from ldap3.utils.dn import parse_dn
 
 from applocals import (
     LDAP_SERVER_HOST,
@@ -50,6 +74,23 @@ POSIX_GROUP_CLASS_LIST = [
 IP_HOST_CLASS_LIST = [
     'device', 'ipHost', 'top',
 ]
+# The id counter holds the next free uidNumber and gidNumber (see id_allocator).
+ID_COUNTER_CLASS_LIST = [
+    'device', 'extensibleObject', 'top',
+]
+ID_COUNTER_CN = 'idCounter'
+
+# Number of entries requested per page when reading a whole subtree.
+SNAPSHOT_PAGE_SIZE = 500
+
+# Max number of idle connections a ConnectionPool holds on to.
+POOL_MAX_IDLE = 16
+# Idle pooled connections older than this are pinged before reuse.
+POOL_PING_AFTER_SECONDS = 30
+# Seconds to wait for the ping of an asynchronous connection.
+POOL_PING_TIMEOUT_SECONDS = 10
+# "Who am I?" extended operation (RFC 4532), used as the ping.
+WHO_AM_I_OID = '1.3.6.1.4.1.4203.1.11.3'
 
 # Errors.
 class LDAPCRUDError(Exception):
@@ -79,6 +120,88 @@ LDAP_CLEARTEXT_URI_PROTOCOL = 'ldap://'
 LDAP_SSL_URI_PROTOCOL = 'ldaps://'
 
 # LDAP client factories # # #
+class _CachedTls(Tls):
+    """ Tls that builds 1 SSLContext from its settings (as Tls.wrap_socket
+        does for each socket) and reuses it for every socket.
+        The last TLS session is offered to the server when a new socket
+        is wrapped so the handshake can be resumed instead of negotiated
+        from scratch.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self._ssl_context = None
+        self._session = None
+
+    def _get_ssl_context(self) -> ssl.SSLContext:
+        """ Built from the same Tls attributes as ldap3's Tls.wrap_socket.
+        """
+        with self._lock:
+            if self._ssl_context is None:
+                if self.version is None:
+                    ssl_context = ssl.create_default_context(
+                        purpose=ssl.Purpose.SERVER_AUTH,
+                        cafile=self.ca_certs_file,
+                        capath=self.ca_certs_path,
+                        cadata=self.ca_certs_data,
+                    )
+                else:
+                    ssl_context = ssl.SSLContext(self.version)
+                    if self.ca_certs_file or self.ca_certs_path or self.ca_certs_data:
+                        ssl_context.load_verify_locations(
+                            self.ca_certs_file, self.ca_certs_path, self.ca_certs_data,
+                        )
+                    elif self.validate != ssl.CERT_NONE:
+                        ssl_context.load_default_certs(ssl.Purpose.SERVER_AUTH)
+                if self.certificate_file:
+                    ssl_context.load_cert_chain(
+                        self.certificate_file,
+                        keyfile=self.private_key_file,
+                        password=self.private_key_password,
+                    )
+                ssl_context.check_hostname = False
+                ssl_context.verify_mode = self.validate
+                for option in self.ssl_options:
+                    ssl_context.options |= option
+                if self.ciphers:
+                    ssl_context.set_ciphers(self.ciphers)
+                self._ssl_context = ssl_context
+            return self._ssl_context
+
+    def remember_session(self, conn: LDAPConnection) -> None:
+        """ Save the session of a connection's socket for resumption.
+            TLS 1.3 session tickets arrive after the handshake,
+            so this is also called when a pooled connection is returned.
+        """
+        session = getattr(conn.socket, 'session', None)
+        if session is not None:
+            self._session = session
+
+    def wrap_socket(self, connection, do_handshake=False):
+        wrapped_socket = self._get_ssl_context().wrap_socket(
+            connection.socket,
+            server_side=False,
+            do_handshake_on_connect=do_handshake,
+            server_hostname=self.sni,
+            session=self._session,
+        )
+        if do_handshake and self.validate != ssl.CERT_NONE:
+            check_hostname(wrapped_socket, connection.server.host, self.valid_names)
+        connection.socket = wrapped_socket
+        if do_handshake:
+            self.remember_session(connection)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_tls() -> _CachedTls:
+    return _CachedTls(
+        ca_certs_file=LDAP_SERVER_CA_CERT,
+        local_certificate_file=LDAP_CLIENT_TLS_CERT,
+        local_private_key_file=LDAP_CLIENT_TLS_KEY,
+        validate=ssl.CERT_REQUIRED,
+    )
+
 def new_server(
     host_name: Optional[str] = None,
     use_ssl: bool = None,
@@ -93,12 +216,7 @@ def new_server(
         return LDAPServer(
             LDAP_SSL_URI_PROTOCOL + ldap_host,
             port=636,
-            tls=Tls(
-                ca_certs_file=LDAP_SERVER_CA_CERT,
-                local_certificate_file=LDAP_CLIENT_TLS_CERT,
-                local_private_key_file=LDAP_CLIENT_TLS_KEY,
-                validate=ssl.CERT_REQUIRED,
-            ),
+            tls=_get_tls(),
         )
     else:
         return LDAPServer(LDAP_CLEARTEXT_URI_PROTOCOL + ldap_host)
@@ -109,8 +227,10 @@ def new_connection(
         admin_pwd: Optional[str] = None,
         auto_bind: bool = True,
         use_ssl: Optional[bool] = None,
+        client_strategy: str = SYNC,
 ) -> LDAPConnection:
     ''' Factory for creating a new Connection instance.
+        Pass client_strategy=ASYNC to pipeline requests (see ldap_pipeline).
     '''
     if server is not None and use_ssl is not None:
         raise ValueError("invalid arg combination passed")
@@ -121,9 +241,101 @@ def new_connection(
         admin_dn if admin_dn else LDAP_ADMIN_DN,
         admin_pwd if admin_pwd else security_helpers.b64decode(LDAP_ADMIN_PASSWORD_BASE64),
         auto_bind=auto_bind,
+        client_strategy=client_strategy,
     )
 
 
+class ConnectionPool:
+    """ Keeps bound connections alive so they can be reused.
+        Connections are health checked before being handed out.
+
+        with pool.checkout() as conn:
+            ...
+    """
+
+    def __init__(self, max_idle: int = POOL_MAX_IDLE, **connection_kwargs):
+        self._max_idle = max_idle
+        self._connection_kwargs = connection_kwargs
+        # LIFO so the most recently used connection is handed out first.
+        self._idle = queue.LifoQueue()
+
+    @contextmanager
+    def checkout(self) -> Iterator[LDAPConnection]:
+        conn = self._acquire()
+        try:
+            yield conn
+        except Exception:
+            # The connection may be in an unknown state.
+            _unbind_quietly(conn)
+            raise
+        else:
+            self._release(conn)
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn, _released_at = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            _unbind_quietly(conn)
+
+    def _acquire(self) -> LDAPConnection:
+        while True:
+            try:
+                conn, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                return new_connection(**self._connection_kwargs)
+            if _connection_is_healthy(conn, time.monotonic() - released_at):
+                return conn
+            _unbind_quietly(conn)
+
+    def _release(self, conn: LDAPConnection) -> None:
+        if not conn.bound or conn.closed:
+            return
+        if isinstance(conn.server.tls, _CachedTls):
+            conn.server.tls.remember_session(conn)
+        if self._idle.qsize() >= self._max_idle:
+            _unbind_quietly(conn)
+            return
+        self._idle.put((conn, time.monotonic()))
+
+
+def _connection_is_healthy(conn: LDAPConnection, idle_seconds: float) -> bool:
+    if not conn.bound or conn.closed:
+        return False
+    if idle_seconds < POOL_PING_AFTER_SECONDS:
+        return True
+    try:
+        if conn.strategy.sync:
+            return conn.extend.standard.who_am_i() is not None
+        # Asynchronous connections return a message id, the ping's result is collected.
+        message_id = conn.extended(WHO_AM_I_OID)
+        _response, result = conn.get_response(message_id, timeout=POOL_PING_TIMEOUT_SECONDS)
+        return result.get('description') == 'success'
+    except LDAPException:
+        return False
+
+def _unbind_quietly(conn: LDAPConnection) -> None:
+    try:
+        conn.unbind()
+    except LDAPException:
+        pass
+
+
+_connection_pools = {}
+_connection_pools_lock = threading.Lock()
+
+def get_connection_pool(client_strategy: str = SYNC) -> ConnectionPool:
+    """ Get the process wide connection pool for a client strategy.
+    """
+    with _connection_pools_lock:
+        if client_strategy not in _connection_pools:
+            pool = ConnectionPool(client_strategy=client_strategy)
+            atexit.register(pool.close)
+            _connection_pools[client_strategy] = pool
+        return _connection_pools[client_strategy]
+
+
 # distinguished/common name helpers # # #
 def _add_base_domain_components_to_dn(dn: str) -> str:
     """ Check if a distinguished name is missing base dc parts.
@@ -160,6 +372,23 @@ def _get_ip_host_dn(cn: str) -> str:
         f'cn={cn},ou=hosts,ou=linuxlab'
     )
 
+def _get_posix_users_base_dn() -> str:
+    return _add_base_domain_components_to_dn('ou=people,ou=linuxlab')
+
+def _get_posix_groups_base_dn() -> str:
+    return _add_base_domain_components_to_dn('ou=groups,ou=linuxlab')
+
+def _get_ip_hosts_base_dn() -> str:
+    return _add_base_domain_components_to_dn('ou=hosts,ou=linuxlab')
+
+def _get_id_counter_dn() -> str:
+    return _add_base_domain_components_to_dn(f'cn={ID_COUNTER_CN},ou=linuxlab')
+
+def _get_cn_from_dn(dn: str) -> str:
+    """ given a distinguished name, return the value of its leading rdn.
+    """
+    return parse_dn(dn)[0][1]
+
 # Low Level LDAP CRUD methods
 
 def _dn_exists(conn: LDAPConnection, dn: str, class_filter=None) -> bool:
@@ -195,7 +424,11 @@ def ip_host_exists(conn: LDAPConnection, cn: str) -> bool:
 def _ldap_entry_to_dict(entry: LDAPEntry) -> Dict:
     """ Convert an ldap entry to a python dict.
     """
-    entry_dict = entry.entry_attributes_as_dict
+    return _ldap_attributes_to_dict(entry.entry_attributes_as_dict)
+
+def _ldap_attributes_to_dict(entry_dict: Dict) -> Dict:
+    """ Convert a dict of {attribute => [values, ...]} to a python dict.
+    """
     out = {}
     for k in entry_dict.keys():
         if not isinstance(entry_dict[k], list):
@@ -219,9 +452,177 @@ def _ldap_entry_to_dict(entry: LDAPEntry) -> Dict:
             out[k] = entry_dict[k]
     return out
 
-def validate_response_is_success(resp: Dict):
+def _paged_search_index(
+    conn: LDAPConnection,
+    search_base: str,
+    search_filter: str,
+    attributes=ALL_ATTRIBUTES,
+) -> Dict[str, Dict]:
+    """ Read every entry below search_base with a paged subtree search.
+        Returns a map of {cn => entry dict, ...}
+    """
+    index = {}
+    responses = conn.extend.standard.paged_search(
+        search_base,
+        search_filter,
+        search_scope=SUBTREE,
+        attributes=attributes,
+        paged_size=SNAPSHOT_PAGE_SIZE,
+        generator=True,
+    )
+    for response in responses:
+        if response.get('type') != 'searchResEntry':
+            continue
+        # single valued attributes are not wrapped in a list by ldap3.
+        attributes = {
+            k: v if isinstance(v, list) else [v]
+            for k, v in response['attributes'].items()
+        }
+        index[_get_cn_from_dn(response['dn'])] = _ldap_attributes_to_dict(attributes)
+    return index
+
+def get_posix_user_index(conn: LDAPConnection) -> Dict[str, Dict]:
+    """ Read all posix users from ou=people in a single paged search.
+    """
+    return _paged_search_index(
+        conn,
+        _get_posix_users_base_dn(),
+        POSIX_USER_SEARCH_FILTER,
+    )
+
+def get_posix_group_index(conn: LDAPConnection) -> Dict[str, Dict]:
+    """ Read all posix groups from ou=groups in a single paged search.
+    """
+    return _paged_search_index(
+        conn,
+        _get_posix_groups_base_dn(),
+        POSIX_GROUP_SEARCH_FILTER,
+    )
+
+def get_ip_host_index(
+    conn: LDAPConnection,
+    modified_since: Optional[str] = None,
+) -> Dict[str, Dict]:
+    """ Read all ip hosts (or those modified since a GeneralizedTime)
+        from ou=hosts in a single paged search, with their modifyTimestamp.
+    """
+    search_filter = IP_HOST_SEARCH_FILTER
+    if modified_since:
+        search_filter = f'(&{IP_HOST_SEARCH_FILTER}(modifyTimestamp>={modified_since}))'
+    return _paged_search_index(
+        conn,
+        _get_ip_hosts_base_dn(),
+        search_filter,
+        attributes=[ALL_ATTRIBUTES, 'modifyTimestamp'],
+    )
+
+def get_ip_host_cns(conn: LDAPConnection) -> Set[str]:
+    """ The cn of every ip host in ou=hosts, no attributes are read.
+    """
+    return set(_paged_search_index(
+        conn,
+        _get_ip_hosts_base_dn(),
+        IP_HOST_SEARCH_FILTER,
+        attributes=NO_ATTRIBUTES,
+    ))
+
+def get_used_ids(conn: LDAPConnection) -> Tuple[Set[int], Set[int]]:
+    """ (uidNumbers, gidNumbers) of every posix user and group, read in
+        a single paged search of ou=linuxlab which returns only the ids.
+        Primary gids of users count as used gidNumbers.
+    """
+    used_uids = set()
+    used_gids = set()
+    responses = conn.extend.standard.paged_search(
+        _add_base_domain_components_to_dn('ou=linuxlab'),
+        f'(|{POSIX_USER_SEARCH_FILTER}{POSIX_GROUP_SEARCH_FILTER})',
+        search_scope=SUBTREE,
+        attributes=['uidNumber', 'gidNumber'],
+        paged_size=SNAPSHOT_PAGE_SIZE,
+        generator=True,
+    )
+    for response in responses:
+        if response.get('type') != 'searchResEntry':
+            continue
+        attributes = response['attributes']
+        if attributes.get('uidNumber'):
+            used_uids.add(int(attributes['uidNumber']))
+        if attributes.get('gidNumber'):
+            used_gids.add(int(attributes['gidNumber']))
+    return used_uids, used_gids
+
+def get_id_counter(conn: LDAPConnection) -> Optional[Dict[str, int]]:
+    """ {'uidNumber' => next uid, 'gidNumber' => next gid}, None if there is no counter entry.
+    """
+    found = conn.search(
+        _get_id_counter_dn(),
+        ALL_CLASSES_SEARCH_FILTER,
+        search_scope=BASE,
+        attributes=['uidNumber', 'gidNumber'],
+    )
+    if not found:
+        return None
+    entry = conn.entries[0]
+    return {
+        'uidNumber': int(entry.uidNumber.value),
+        'gidNumber': int(entry.gidNumber.value),
+    }
+
+def add_id_counter(conn: LDAPConnection, first_id: int) -> bool:
+    """ Create the counter entry, False if another run created it first.
+    """
+    conn.add(
+        _get_id_counter_dn(),
+        ID_COUNTER_CLASS_LIST,
+        {'cn': ID_COUNTER_CN, 'uidNumber': first_id, 'gidNumber': first_id},
+    )
+    if conn.result.get('result') == RESULT_ENTRY_ALREADY_EXISTS:
+        return False
+    validate_response_is_success(conn.result)
+    return True
+
+def advance_id_counter(
+    conn: LDAPConnection,
+    attribute: str,
+    current: int,
+    next_free: int,
+) -> bool:
+    """ Atomic test-and-set: the current value is deleted and next_free is
+        added in 1 modify. The modify fails with noSuchAttribute (False is
+        returned) if another run moved the counter off current first.
+    """
+    conn.modify(_get_id_counter_dn(), {
+        attribute: [
+            (MODIFY_DELETE, [str(current)]),
+            (MODIFY_ADD, [str(next_free)]),
+        ],
+    })
+    if conn.result.get('result') == RESULT_NO_SUCH_ATTRIBUTE:
+        return False
+    validate_response_is_success(conn.result)
+    return True
+
+def _get_operation_result(conn: LDAPConnection, return_value):
+    """ Synchronous connections hold the result of the last operation.
+        Asynchronous connections return a message id which is used
+        to collect the result later.
+    """
+    if conn.strategy.sync:
+        return conn.result
+    return return_value
+
+def validate_response_is_success(
+    resp: Dict,
+    already_exists_error: Type[LDAPCRUDError] = LDAPCRUDError,
+):
+    """ Raise an LDAPCRUDError if resp is not a success.
+        Optimistic adds pass the matching *AlreadyExistsError
+        which is raised for entryAlreadyExists results.
+    """
     if resp.get('description') == 'success':
         return
+    if resp.get('result') == RESULT_ENTRY_ALREADY_EXISTS:
+        raise already_exists_error
     raise LDAPCRUDError
 
 def get_posix_user(
@@ -258,34 +659,37 @@ def add_posix_user(
     conn: LDAPConnection,
     cn: str,
     attrs: Dict,
+    optimistic: bool = False,
 ):
-    if posix_user_exists(conn, cn):
+    """ Optimistic adds skip the existence check and send the add directly.
+        The same goes for add_posix_group and add_ip_host.
+    """
+    if not optimistic and posix_user_exists(conn, cn):
         raise PosixUserAlreadyExistsError
 
     dn = _get_posix_user_dn(cn)
-    conn.add(
+    return _get_operation_result(conn, conn.add(
         dn,
         POSIX_USER_CLASS_LIST,
         attrs,
-    )
-    return conn.result
+    ))
 
 
 def add_posix_group(
     conn: LDAPConnection,
     cn: str,
     attrs: Dict,
+    optimistic: bool = False,
 ):
-    if posix_group_exists(conn, cn):
+    if not optimistic and posix_group_exists(conn, cn):
         raise PosixGroupAlreadyExistsError
 
     dn = _get_posix_group_dn(cn)
-    conn.add(
+    return _get_operation_result(conn, conn.add(
         dn,
         POSIX_GROUP_CLASS_LIST,
         attrs,
-    )
-    return conn.result
+    ))
 
 
 def set_posix_group_members(
@@ -297,8 +701,7 @@ def set_posix_group_members(
     changes = {
         'memberUid': [(MODIFY_REPLACE, memberUids,)],
     }
-    conn.modify(dn, changes)
-    return conn.result
+    return _get_operation_result(conn, conn.modify(dn, changes))
 
 
 def sync_user_password(
@@ -310,24 +713,34 @@ def sync_user_password(
     changes = {
         'userPassword': [(MODIFY_REPLACE, [userPassword],)],
     }
-    conn.modify(dn, changes)
-    return conn.result
+    return _get_operation_result(conn, conn.modify(dn, changes))
 
 def add_ip_host(
     conn: LDAPConnection,
     cn: str,
-    ipv4: str
+    ip: str,
+    optimistic: bool = False,
 ):
-    if ip_host_exists(conn, cn):
+    if not optimistic and ip_host_exists(conn, cn):
         raise IPHostAlreadyExistsError
     dn = _get_ip_host_dn(cn)
-    entry = create_ip_host_entry(cn, ipv4)
-    conn.add(
+    entry = create_ip_host_entry(cn, ip)
+    return _get_operation_result(conn, conn.add(
         dn,
         IP_HOST_CLASS_LIST,
         entry,
-    )
-    return conn.result
+    ))
+
+def set_ip_host_number(
+    conn: LDAPConnection,
+    cn: str,
+    ipHostNumber: str,
+):
+    dn = _get_ip_host_dn(cn)
+    changes = {
+        'ipHostNumber': [(MODIFY_REPLACE, [ipHostNumber],)],
+    }
+    return _get_operation_result(conn, conn.modify(dn, changes))
 
 # LDAP entry attribute factories # # #
 def create_posix_user_entry_dict(
@@ -366,8 +779,8 @@ def create_posix_group_entry_dict(
         entry['memberUid'] = members
     return entry
 
-def create_ip_host_entry(cn: str, ipv4: str) -> Dict:
+def create_ip_host_entry(cn: str, ip: str) -> Dict:
     return {
         'cn': cn,
-        'ipHostNumber': ipv4,
+        'ipHostNumber': ip,
     }
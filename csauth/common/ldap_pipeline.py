@@ -0,0 +1,317 @@
+
+""" Pipelined and parallel LDAP writes.
+    OperationWindow keeps up to N write operations in flight on one
+    connection opened with the ASYNC client strategy, and collects
+    their results by message id in the order they were sent.
+
+    run_in_workers hands chunks of rows to a pool of threads as they are read,
+    each writing over its own bound connection checked out of a
+    ldap_helpers.ConnectionPool.
+
+    Failed operations are handled by an error_policy.ErrorPolicy which can
+    have the window resend them.
+
+    import_rows streams a .tsv file (or in-process rows) through run_in_workers,
+    recording committed rows in an import_journal.ImportJournal so an
+    interrupted import can be resumed.
+"""
+
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from logging import Logger
+import queue
+import threading
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Type,
+    Union,
+)
+
+from ldap3 import (
+    Connection as LDAPConnection,
+    ASYNC,
+    SYNC,
+)
+
+from common import ldap_helpers as ldap
+from common.constants import SKIP_FLAG
+from common.error_policy import (
+    ABORT,
+    CONTINUE,
+    RETRY,
+    ErrorPolicy,
+)
+from common.import_journal import ImportJournal, NullJournal
+from common import row_store
+from common.script_logger import ROW
+from common import tsv_stream
+
+
+# Max number of chunks waiting for each worker.
+QUEUED_CHUNKS_PER_WORKER = 2
+# How often a blocked reader checks that workers are still running.
+QUEUE_POLL_SECONDS = 1
+
+# Put on the chunk queue once per worker after the last chunk.
+_NO_MORE_CHUNKS = object()
+
+# Sends an operation using an ldap_helpers write method,
+# eg. partial(ldap.sync_user_password, cn=cn, userPassword=pw)
+SendOperation = Callable[[LDAPConnection], Union[int, Dict]]
+
+# Called with the LDAP result of an operation.
+# Returns CONTINUE, ABORT (no more operations are submitted) or RETRY.
+ResultCallback = Callable[[Dict], str]
+
+
+class OperationWindow:
+
+    def __init__(
+        self,
+        conn: LDAPConnection,
+        size: int,
+        stop_event: Optional[threading.Event] = None,
+    ):
+        if size < 1:
+            raise ValueError("window size must be at least 1")
+        self.conn = conn
+        # Synchronous connections only ever have 1 operation in flight.
+        self._size = size if not conn.strategy.sync else 1
+        self._in_flight = deque()
+        # Shared between windows so 1 worker can stop the others.
+        self._stop_event = stop_event if stop_event else threading.Event()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop_event.is_set()
+
+    def submit(
+        self,
+        send: SendOperation,
+        on_result: ResultCallback,
+    ) -> None:
+        """ Send an operation.
+            Synchronous connections return a result which is handled now.
+            Asynchronous connections return a message id which is
+            handled once the window is full or drained.
+        """
+        response = send(self.conn)
+        if self.conn.strategy.sync:
+            self._handle(send, response, on_result)
+            return
+        self._in_flight.append((response, send, on_result))
+        while len(self._in_flight) >= self._size:
+            self._collect_oldest()
+
+    def drain(self) -> None:
+        while self._in_flight:
+            self._collect_oldest()
+
+    def _collect_oldest(self) -> None:
+        message_id, send, on_result = self._in_flight.popleft()
+        _response, result = self.conn.get_response(message_id)
+        self._handle(send, result, on_result)
+
+    def _handle(
+        self,
+        send: SendOperation,
+        result: Dict,
+        on_result: ResultCallback,
+    ) -> None:
+        action = on_result(result)
+        if action == RETRY:
+            self.submit(send, on_result)
+        elif action == ABORT:
+            self._stop_event.set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.drain()
+
+
+def run_in_workers(
+    chunks: Iterable[List],
+    worker_count: int,
+    window_size: int,
+    load_rows: Callable[[OperationWindow, List, Counter], None],
+    stop_event: Optional[threading.Event] = None,
+) -> Counter:
+    """ Hand chunks of rows to worker_count threads as they are read.
+        Each worker writes over its own bound connection and OperationWindow,
+        and keeps its own summary. Worker summaries are merged and returned.
+        At most a few chunks per worker are queued at any time.
+    """
+    if worker_count < 1:
+        raise ValueError("worker count must be at least 1")
+    stop_event = stop_event if stop_event else threading.Event()
+    chunk_queue = queue.Queue(maxsize=worker_count * QUEUED_CHUNKS_PER_WORKER)
+
+    def _work() -> Counter:
+        worker_summary = Counter()
+        chunk = chunk_queue.get()
+        if chunk is _NO_MORE_CHUNKS:
+            return worker_summary
+        pool = ldap.get_connection_pool(
+            ASYNC if window_size > 1 else SYNC
+        )
+        try:
+            with pool.checkout() as conn, OperationWindow(conn, window_size, stop_event) as window:
+                while chunk is not _NO_MORE_CHUNKS:
+                    # Keep taking chunks once stopped so the reader is not blocked.
+                    if not window.stopped:
+                        load_rows(window, chunk, worker_summary)
+                    chunk = chunk_queue.get()
+        except Exception:
+            stop_event.set()
+            raise
+        return worker_summary
+
+    with ThreadPoolExecutor(max_workers=worker_count) as executor:
+        futures = [executor.submit(_work) for _ in range(worker_count)]
+
+        def _put(item) -> None:
+            while True:
+                try:
+                    chunk_queue.put(item, timeout=QUEUE_POLL_SECONDS)
+                    return
+                except queue.Full:
+                    if all(f.done() for f in futures):
+                        return
+
+        try:
+            for chunk in chunks:
+                if stop_event.is_set():
+                    break
+                _put(chunk)
+        finally:
+            for _ in futures:
+                _put(_NO_MORE_CHUNKS)
+
+        summary = Counter()
+        for future in futures:
+            summary.update(future.result())
+    return summary
+
+
+def result_handler(
+    logger: Logger,
+    summary: Counter,
+    error_policy: ErrorPolicy,
+    row: List[str],
+    success_key: str,
+    success_message: str,
+    error_key: str,
+    error_message: str,
+    already_exists_error: Optional[Type[ldap.LDAPCRUDError]] = None,
+    on_already_exists: Optional[Callable[[], None]] = None,
+    on_success: Optional[Callable[[], None]] = None,
+    message_args: Optional[Dict] = None,
+) -> ResultCallback:
+    """ Factory for callbacks which log an operation result
+        and count it in the task summary.
+        The messages are %(name)s templates filled from message_args
+        when they are logged (see script_logger).
+        Optimistic adds can pass already_exists_error and on_already_exists
+        to handle an entryAlreadyExists result instead of treating it as an error.
+        on_success is called once the operation succeeds (eg. to journal the row).
+    """
+    attempts = 0
+    args = (message_args,) if message_args else ()
+
+    def _on_result(result: Dict) -> str:
+        nonlocal attempts
+        attempts += 1
+        try:
+            ldap.validate_response_is_success(
+                result,
+                already_exists_error if already_exists_error else ldap.LDAPCRUDError,
+            )
+        except ldap.LDAPCRUDError as e:
+            if already_exists_error and on_already_exists and isinstance(e, already_exists_error):
+                on_already_exists()
+                return CONTINUE
+            logger.error(error_message, *args)
+            logger.error('%s', result)
+            action = error_policy.on_error(row, result, attempts)
+            if action == RETRY:
+                logger.info('retrying (attempt %d)', attempts + 1)
+                summary['retries'] += 1
+            else:
+                summary[error_key] += 1
+            return action
+        else:
+            logger.info(success_message, *args, extra=ROW)
+            summary[success_key] += 1
+            if on_success is not None:
+                on_success()
+            return CONTINUE
+    return _on_result
+
+
+def import_rows(
+    logger: Logger,
+    summary: Counter,
+    source: tsv_stream.RowSource,
+    rows_read_key: str,
+    rejects_report_name: str,
+    load_rows: Callable[[ErrorPolicy, ImportJournal, OperationWindow, List, Counter], None],
+    worker_count: int,
+    window_size: int,
+    on_error: str,
+    resume: bool = False,
+    stop_event: Optional[threading.Event] = None,
+) -> bool:
+    """ Stream the rows of a source (see tsv_stream) to load_rows in worker threads.
+        Rows are numbered from 1 and handed out as (row_number, row) pairs,
+        load_rows commits a row to the journal once it has been written.
+        When resuming a .tsv file, rows committed by an earlier run are skipped.
+        The journal is removed once every row has been committed.
+        Returns False if the import was stopped.
+    """
+    if source == SKIP_FLAG:
+        return True
+    stop_event = stop_event if stop_event else threading.Event()
+    if isinstance(source, str):
+        logger.debug('reading ' + source)
+        path, row_range = row_store.parse_source(source)
+        journal = ImportJournal(
+            path,
+            resume,
+            '-{}-{}'.format(*row_range) if row_range else '',
+        )
+    else:
+        journal = NullJournal()
+    with (
+        journal,
+        ErrorPolicy(logger, on_error, rejects_report_name) as error_policy,
+    ):
+        if journal.committed:
+            logger.info(f"resuming import, skipping {len(journal.committed)} committed rows")
+        summary.update(run_in_workers(
+            tsv_stream.iter_chunks(journal.skip_committed(enumerate(
+                tsv_stream.count_rows(
+                    tsv_stream.iter_rows(source),
+                    summary,
+                    rows_read_key,
+                ),
+                start=1,
+            ))),
+            worker_count,
+            window_size,
+            partial(load_rows, error_policy, journal),
+            stop_event,
+        ))
+        if stop_event.is_set():
+            if journal.full_path:
+                logger.info(f"import stopped, it can be resumed with --resume ({journal.full_path})")
+            return False
+        if error_policy.rejects_path is None:
+            journal.remove()
+    return True
@@ -0,0 +1,19 @@
+
+""" Read the lines of unix source files (passwd, shadow, group)
+    straight from disk. Nothing is copied to TMP_DIR, and the file
+    is never held in memory as a whole.
+"""
+
+from typing import Iterator
+
+
+# Read buffer size, large reads keep the number of read syscalls low.
+READ_BUFFER_SIZE = 1024 * 1024
+
+
+def iter_lines(path: str, buffer_size: int = READ_BUFFER_SIZE) -> Iterator[str]:
+    """ Yield the lines of a file without their line endings.
+    """
+    with open(path, buffering=buffer_size, newline='\n') as f:
+        for line in f:
+            yield line.rstrip('\n')
@@ -0,0 +1,174 @@
+
+""" Indexed interchange format, an alternative to .tsv files.
+    A row store is a SQLite database (.sqlite) holding numbered rows
+    indexed by name (the 1st column, or the alias of etc-hosts rows). Unlike a .tsv file it allows:
+
+        - random access, the row for a name is found without a scan.
+        - row counts without a scan.
+        - reading a range of rows, so a file can be split across loaders.
+
+    A range of a row store is passed to a loader as PATH:START-STOP
+    (row numbers start at 1, STOP is included), see ranges().
+"""
+
+from contextlib import contextmanager
+import csv
+import json
+import os
+import re
+import sqlite3
+from typing import (
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+import urllib.parse
+
+from common.file_wrapper import BaseFileWrapper
+
+
+ROW_STORE_EXTENSION = 'sqlite'
+OUTPUT_FORMATS = ('tsv', ROW_STORE_EXTENSION)
+
+# Rows inserted per statement when writing.
+WRITE_BATCH_SIZE = 1000
+
+_RANGE_SOURCE_PATTERN = re.compile(r'^(.+\.' + ROW_STORE_EXTENSION + r'):(\d+)-(\d+)$')
+
+
+class RowStoreError(Exception):
+    pass
+
+
+def is_row_store(source: str) -> bool:
+    return (
+        source.endswith('.' + ROW_STORE_EXTENSION)
+        or _RANGE_SOURCE_PATTERN.match(source) is not None
+    )
+
+
+def parse_source(source: str) -> Tuple[str, Optional[Tuple[int, int]]]:
+    """ Split PATH or PATH:START-STOP into (path, (start, stop) or None).
+    """
+    match = _RANGE_SOURCE_PATTERN.match(source)
+    if match is None:
+        return source, None
+    path, start, stop = match.groups()
+    if int(start) < 1 or int(stop) < int(start):
+        raise RowStoreError(f'invalid row range in "{source}"')
+    return path, (int(start), int(stop))
+
+
+class RowStore:
+    """ Opened read only unless writable=True, a reader never creates or changes the file.
+        Rows are written with the value of their key_column as the name they are found by.
+    """
+
+    def __init__(self, path: str, writable: bool = False, key_column: int = 0):
+        self.path = path
+        self._writable = writable
+        self._key_column = key_column
+        if writable:
+            self._conn = sqlite3.connect(path)
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS rows ('
+                + 'row_number INTEGER PRIMARY KEY, name TEXT NOT NULL, row TEXT NOT NULL)'
+            )
+        else:
+            self._conn = self._connect_read_only(path)
+        self._batch = []
+
+    @staticmethod
+    def _connect_read_only(path: str) -> sqlite3.Connection:
+        if not os.path.isfile(path):
+            raise RowStoreError(f'row store "{path}" does not exist')
+        conn = sqlite3.connect(f'file:{urllib.parse.quote(os.path.abspath(path))}?mode=ro', uri=True)
+        try:
+            found = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rows'"
+            ).fetchone()
+        except sqlite3.DatabaseError as e:
+            conn.close()
+            raise RowStoreError(f'"{path}" is not a row store: {e}')
+        if found is None:
+            conn.close()
+            raise RowStoreError(f'"{path}" is not a row store, it has no rows table')
+        return conn
+
+    def writerow(self, row: List[str]) -> None:
+        self._batch.append((row[self._key_column], json.dumps(row)))
+        if len(self._batch) >= WRITE_BATCH_SIZE:
+            self._flush()
+
+    def writerows(self, rows: Iterable[List[str]]) -> None:
+        for row in rows:
+            self.writerow(row)
+
+    def _flush(self) -> None:
+        self._conn.executemany('INSERT INTO rows (name, row) VALUES (?, ?)', self._batch)
+        self._batch = []
+
+    def count(self) -> int:
+        # Rows are numbered 1..N, the max is read from the primary key index.
+        return self._conn.execute('SELECT coalesce(max(row_number), 0) FROM rows').fetchone()[0]
+
+    def get(self, name: str) -> Optional[List[str]]:
+        found = self._conn.execute(
+            'SELECT row FROM rows WHERE name = ? ORDER BY row_number LIMIT 1', (name,),
+        ).fetchone()
+        return json.loads(found[0]) if found else None
+
+    def iter_rows(self, start: int = 1, stop: Optional[int] = None) -> Iterator[List[str]]:
+        cursor = self._conn.execute(
+            'SELECT row FROM rows WHERE row_number >= ? AND row_number <= ? ORDER BY row_number',
+            (start, stop if stop is not None else self.count()),
+        )
+        for (row,) in cursor:
+            yield json.loads(row)
+
+    def ranges(self, parts: int) -> List[Tuple[int, int]]:
+        """ Split the rows into at most parts contiguous (start, stop) ranges.
+        """
+        count = self.count()
+        size = -(-count // parts) if count else 0
+        return [
+            (start, min(start + size - 1, count))
+            for start in range(1, count + 1, size or 1)
+        ]
+
+    def close(self) -> None:
+        if self._writable:
+            if self._batch:
+                self._flush()
+            self._conn.execute('CREATE INDEX IF NOT EXISTS rows_name ON rows (name)')
+            self._conn.commit()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def iter_source_rows(source: str) -> Iterator[List[str]]:
+    """ Yield the rows of PATH or PATH:START-STOP.
+    """
+    path, row_range = parse_source(source)
+    with RowStore(path) as store:
+        yield from store.iter_rows(*(row_range or ()))
+
+
+@contextmanager
+def open_writer(output: BaseFileWrapper, key_column: int = 0):
+    """ Row writer for an output file, a row store for .sqlite files
+        (rows are found by their key_column) and a csv writer otherwise.
+    """
+    if is_row_store(output.full_path):
+        with RowStore(output.full_path, writable=True, key_column=key_column) as store:
+            yield store
+    else:
+        with output as fp:
+            yield csv.writer(fp, delimiter='\t')
@@ -1,7 +1,23 @@
 """ Factories for creating logging.Logger instances.
-"""
 
+    Handlers are only set up the 1st time a logger is asked for,
+    asking again returns the same logger without stacking handlers.
+    Asking again for a task logger with other options is a ValueError.
+
+    Task loggers can be queued: the logger gets a single QueueHandler
+    and the console, .log and .report handlers run on a background
+    QueueListener thread. Records are passed on unformatted, messages
+    are only built by the listener (log with %-style args, not f-strings).
 
+    With quiet_rows, per-row messages (logged with extra=ROW) below
+    WARNING are not written, they are counted by message. Tasks write
+    the totals with log_row_totals before their summary, totals not
+    written by then are written at exit. Warnings, errors, and
+    summaries are kept.
+"""
+
+import atexit
+from collections import Counter
 import datetime as dt
 import logging
 from logging import (
@@ -9,10 +25,65 @@ from logging import (
     StreamHandler,      # For live environemnt
     FileHandler,        # "   "    "
 )
+from logging.handlers import QueueHandler, QueueListener
 import os.path
+import queue
+import threading
+from typing import Dict, Tuple
 
 import settings
 
+
+# Pass as extra= for messages logged once per row, see quiet_rows.
+ROW = {'row': True}
+
+# (queued, quiet_rows) of the task loggers which have been set up, by name.
+_task_logger_options: Dict[str, Tuple[bool, bool]] = {}
+
+
+class _LazyQueueHandler(QueueHandler):
+    """ Enqueue records as they are, the listener thread formats them.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class _RowAggregator(logging.Filter):
+    """ Drop per-row records below WARNING, counting them by message.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, 'row', False) and record.levelno < logging.WARNING:
+            with self._lock:
+                self.counts[record.msg] += 1
+            return False
+        return True
+
+    def log_totals(self, logger: logging.Logger) -> None:
+        """ Write the totals counted so far and start counting again.
+        """
+        with self._lock:
+            counts, self.counts = self.counts, Counter()
+        if counts:
+            logger.info('\n* * * * Row Messages * * * *\n' + '\n'.join(
+                f'{count}x  {message}' for message, count in counts.most_common()
+            ))
+
+def log_row_totals(logger: logging.Logger) -> None:
+    """ Write the per-row message totals of a quiet_rows task logger,
+        tasks call this before logging their summary.
+        Does nothing for other loggers.
+    """
+    for log_filter in logger.filters:
+        if isinstance(log_filter, _RowAggregator):
+            log_filter.log_totals(logger)
+
 def _get_logging_formatter(include_name=True) -> logging.Formatter:
     return logging.Formatter(
         '%(asctime)s %(name)s %(levelname)s %(message)s'
@@ -28,6 +99,8 @@ def _get_report_formatter() -> logging.Formatter:
 
 def get_console_logger(logger_name: str = None) -> logging.Logger:
     logger = logging.getLogger(logger_name if logger_name else __name__)
+    if logger.handlers:
+        return logger
     logger.setLevel(logging.DEBUG)
     handler = NullHandler() if settings.IS_TEST else StreamHandler()
     handler.setLevel(logging.DEBUG)
@@ -36,8 +109,21 @@ def get_console_logger(logger_name: str = None) -> logging.Logger:
     logger.debug("debug console logger instantiated")
     return logger
 
-def get_task_logger(logger_name: str) -> logging.Logger:
+def get_task_logger(
+    logger_name: str,
+    queued: bool = False,
+    quiet_rows: bool = False,
+) -> logging.Logger:
     logger = logging.getLogger(logger_name)
+    options = (queued, quiet_rows)
+    if logger.handlers:
+        if _task_logger_options.get(logger_name, options) != options:
+            raise ValueError(
+                f"task logger {logger_name} was set up with (queued, quiet_rows)="
+                f"{_task_logger_options[logger_name]}, not {options}"
+            )
+        return logger
+    _task_logger_options[logger_name] = options
     logger.setLevel(logging.DEBUG)
 
     # Console logging
@@ -72,8 +158,24 @@ def get_task_logger(logger_name: str) -> logging.Logger:
     report_file_handler.setFormatter(_get_report_formatter())
     logger.addHandler(report_file_handler)
 
+    if queued:
+        handlers = list(logger.handlers)
+        for handler in handlers:
+            logger.removeHandler(handler)
+        log_queue = queue.SimpleQueue()
+        logger.addHandler(_LazyQueueHandler(log_queue))
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        # atexit runs in reverse order, the queue is drained after any unwritten row totals.
+        atexit.register(listener.stop)
+
+    if quiet_rows:
+        row_aggregator = _RowAggregator()
+        logger.addFilter(row_aggregator)
+        atexit.register(row_aggregator.log_totals, logger)
+
     logger.debug("task logger instantiated")
-    logger.debug(f"   .log file {getattr(log_file_handler, 'baseFilename', 'NONE')}")
-    logger.debug(f".report file {getattr(report_file_handler, 'baseFilename', 'NONE')}")
+    logger.debug("   .log file %s", getattr(log_file_handler, 'baseFilename', 'NONE'))
+    logger.debug(".report file %s", getattr(report_file_handler, 'baseFilename', 'NONE'))
 
     return logger
@@ -3,16 +3,25 @@
 """
 
 import base64
+from concurrent.futures import Executor, ProcessPoolExecutor
 import crypt # TODO: this is removed in future versions of python.
 import os.path
 import random
 import stat
+from typing import (
+    Iterable,
+    Iterator,
+    Optional,
+)
 
 from settings import BASE_DIR
 
 
 SR = random.SystemRandom()
 
+# Number of passwords sent to a hashing process at a time.
+HASH_CHUNK_SIZE = 8
+
 
 def b64encode(val: str) -> str:
     return base64.b64encode(val.encode()).decode()
@@ -30,6 +39,22 @@ def hash_password(plaintext_password: str) -> str:
     salt = crypt.mksalt(crypt.METHOD_SHA512, rounds=100000)
     return prefix + crypt.crypt(plaintext_password, salt)
 
+def hash_passwords(
+    plaintext_passwords: Iterable[str],
+    executor: Optional[Executor] = None,
+) -> Iterator[str]:
+    """ Hash passwords in parallel, using all cores by default.
+        Hashes are yielded in the same order as plaintext_passwords,
+        each one as soon as it (and the ones before it) are done.
+    """
+    if executor is not None:
+        yield from executor.map(
+            hash_password, plaintext_passwords, chunksize=HASH_CHUNK_SIZE)
+        return
+    with ProcessPoolExecutor() as process_pool:
+        yield from process_pool.map(
+            hash_password, plaintext_passwords, chunksize=HASH_CHUNK_SIZE)
+
 class ApplocalsError(Exception):
     pass
 
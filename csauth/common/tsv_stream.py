@@ -0,0 +1,90 @@
+
+""" Generators for streaming interchange formatted (.tsv) data.
+    Rows are read lazily and handed out in chunks so loaders can
+    start writing before the whole file has been read, and memory
+    use does not grow with the size of the file.
+
+    A row source is the path of a .tsv file, the path of a row store
+    (see row_store), or an iterable of rows produced in-process
+    (eg. by unix_to_ldap).
+"""
+
+from collections import Counter
+import csv
+from itertools import islice
+from typing import (
+    Iterable,
+    Iterator,
+    List,
+    Union,
+)
+
+from common.constants import SKIP_FLAG
+from common.file_wrapper import BaseFileWrapper
+from common import row_store
+
+
+# Number of rows handed to a loader worker at a time.
+DEFAULT_CHUNK_SIZE = 500
+
+RowSource = Union[str, Iterable[List[str]]]
+
+
+def iter_tsv_rows(path: str) -> Iterator[List[str]]:
+    """ Yield the rows of a .tsv file. SKIP_FLAG yields no rows.
+    """
+    if path == SKIP_FLAG:
+        return
+    with open(path) as f:
+        yield from csv.reader(f, delimiter='\t')
+
+
+def iter_rows(source: RowSource) -> Iterator[List[str]]:
+    """ Yield the rows of a row source.
+    """
+    if isinstance(source, str) and row_store.is_row_store(source):
+        return row_store.iter_source_rows(source)
+    if isinstance(source, str):
+        return iter_tsv_rows(source)
+    return iter(source)
+
+
+def describe_source(source: RowSource) -> str:
+    return source if isinstance(source, str) else '<in-process rows>'
+
+
+def tee_rows(
+    rows: Iterable[List[str]],
+    output: BaseFileWrapper,
+) -> Iterator[List[str]]:
+    """ Pass rows through, writing a copy of each to a .tsv file.
+    """
+    with output as fp:
+        writer = csv.writer(fp, delimiter='\t')
+        for row in rows:
+            writer.writerow(row)
+            yield row
+
+
+def count_rows(
+    rows: Iterable[List[str]],
+    summary: Counter,
+    summary_key: str,
+) -> Iterator[List[str]]:
+    """ Pass rows through, counting them in summary.
+    """
+    for row in rows:
+        summary[summary_key] += 1
+        yield row
+
+
+def iter_chunks(
+    rows: Iterable[List[str]],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[List[List[str]]]:
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
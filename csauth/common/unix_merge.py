@@ -0,0 +1,96 @@
+
+""" Merge the users and groups exported from several hosts.
+    Rows are merged through hash indexes on username and uidNumber,
+    and on group name and gidNumber. The 1st host to export a name or
+    id wins, later rows which reuse a name with another id, or an id
+    with another name, are dropped and reported as conflicts.
+    Groups exported by several hosts with the same gid get the union of their members.
+"""
+
+from collections import Counter
+import csv
+from logging import Logger
+from typing import (
+    Dict,
+    Iterator,
+    List,
+)
+
+from common.file_wrapper import OutputFileWrapper
+
+
+class MergeIndex:
+
+    def __init__(self):
+        # username => (PosixUser row, source)
+        self._users: Dict[str, tuple] = {}
+        self._username_by_uid: Dict[str, str] = {}
+        # group name => (gid, {member: None, ...} ordered set, source)
+        self._groups: Dict[str, tuple] = {}
+        self._group_name_by_gid: Dict[str, str] = {}
+        self.conflicts: List[List[str]] = []
+        self.summary = Counter()
+
+    def add_user(self, row: List[str], source: str) -> None:
+        username, uid = row[0], row[1]
+        kept = self._users.get(username)
+        if kept is not None:
+            kept_row, kept_source = kept
+            if kept_row[1] != uid:
+                self._conflict('username', username, kept_row[1], kept_source, uid, source)
+            else:
+                self.summary['duplicate_users'] += 1
+            return
+
+        kept_username = self._username_by_uid.get(uid)
+        if kept_username is not None:
+            self._conflict(
+                'uidNumber', uid, kept_username, self._users[kept_username][1], username, source,
+            )
+            return
+
+        self._users[username] = (row, source)
+        self._username_by_uid[uid] = username
+
+    def add_group(self, row: List[str], source: str) -> None:
+        name, gid, members = row
+        kept = self._groups.get(name)
+        if kept is not None:
+            kept_gid, kept_members, kept_source = kept
+            if kept_gid != gid:
+                self._conflict('groupName', name, kept_gid, kept_source, gid, source)
+            else:
+                self.summary['merged_groups'] += 1
+                kept_members.update(dict.fromkeys(members.split(',')))
+            return
+
+        kept_name = self._group_name_by_gid.get(gid)
+        if kept_name is not None:
+            self._conflict('gidNumber', gid, kept_name, self._groups[kept_name][2], name, source)
+            return
+
+        self._groups[name] = (gid, dict.fromkeys(members.split(',')), source)
+        self._group_name_by_gid[gid] = name
+
+    def _conflict(self, *conflict: str) -> None:
+        self.summary[f'{conflict[0]}_conflicts'] += 1
+        self.conflicts.append(list(conflict))
+
+    def iter_user_rows(self) -> Iterator[List[str]]:
+        for row, _source in self._users.values():
+            yield row
+
+    def iter_group_rows(self) -> Iterator[List[str]]:
+        for name, (gid, members, _source) in self._groups.items():
+            yield [name, gid, ','.join(members)]
+
+    def write_conflict_report(self, logger: Logger) -> None:
+        logger.info(f"uid/gid conflicts: {len(self.conflicts)}")
+        if not self.conflicts:
+            return
+        report = OutputFileWrapper('merge-conflicts', 'tsv')
+        with report as fp:
+            writer = csv.writer(fp, delimiter='\t')
+            #tsv columns: conflict-on, key, kept-value, kept-source, dropped-value, dropped-source
+            writer.writerows(self.conflicts)
+        logger.warning(f"conflicts written to {report.full_path}")
@@ -1,11 +1,18 @@
 
 import argparse
 import getpass
+import ipaddress
 import sys
 
 from common.constants import (
     SKIP_FLAG
 )
+from common.error_policy import (
+    ERROR_POLICY_CHOICES,
+    PROMPT,
+    parse_error_policy,
+)
+from common.row_store import OUTPUT_FORMATS
 from common.script_logger import (
     get_console_logger,
     get_task_logger
@@ -24,20 +31,54 @@ class COMMANDS:
     # export /etc/hosts interchange formatted data
     hosts_to_tsv = 'hosts_to_tsv'
 
+    # count, look up, or split the rows of a .sqlite interchange file
+    inspect_rows = 'inspect_rows'
+
     # import /etc/hosts interchange formatted data
     load_hosts_tsv = 'load_hosts_tsv'
 
+    # look up ou=hosts by address, alias, or CIDR range from a local index
+    host_index = 'host_index'
+
     # import interchange formatted data into LDAP database
     load_tsv = 'load_tsv'
 
+    # import unix users/groups into LDAP database without .tsv files
+    unix_to_ldap = 'unix_to_ldap'
+
+    # write a change plan saved by load_tsv --plan into LDAP database
+    apply_plan = 'apply_plan'
+
     # covert a string to its base64 representation
     base_64_encode = 'base_64_encode'
 
+    # time unix_to_tsv on synthetic passwd/shadow/group files
+    benchmark_unix_to_tsv = 'benchmark_unix_to_tsv'
+
+    # mkdir, copy skel, chown, and set quotas for the users of a posixUser file
+    provision_homes = 'provision_homes'
+
     # Bulk import users/groups into LDAP database,
     # setup home directories,
     # create new account notices.
     add_users = 'add_users'
 
+def error_policy_arg(value: str) -> str:
+    parse_error_policy(value)
+    return value
+
+def ip_address_arg(value: str) -> str:
+    try:
+        return str(ipaddress.ip_address(value))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid IP address: '{value}'")
+
+def cidr_arg(value: str) -> str:
+    try:
+        return str(ipaddress.ip_network(value, strict=False))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid CIDR range: '{value}'")
+
 def new_base_arg_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         prog="CS-AUTH OpenLDAP Management Command Suite",
@@ -47,6 +88,16 @@ def new_base_arg_parser() -> argparse.ArgumentParser:
         'command_name', help="Management Command to Execute.")
     return parser
 
+def add_task_logger_args(parser: argparse.ArgumentParser) -> None:
+    """ Options of the commands which log to a task logger (see get_task_logger).
+    """
+    parser.add_argument(
+        '--log-queue', action='store_true', default=False,
+        help='Write task logs from a background thread')
+    parser.add_argument(
+        '--quiet-rows', action='store_true', default=False,
+        help='Only log totals of per-row messages, warnings and errors are kept')
+
 
 # Application entry point
 if __name__ == '__main__':
@@ -67,47 +118,168 @@ if __name__ == '__main__':
         from scripts.test_python_client import main as test_python_client
         test_python_client(console)
 
+    elif base_args.command_name == COMMANDS.benchmark_unix_to_tsv:
+        from scripts.benchmark_unix_to_tsv import (
+            DEFAULT_LINE_COUNT,
+            main as benchmark_unix_to_tsv,
+        )
+
+        parser = new_base_arg_parser()
+        parser.add_argument(
+            '--lines', type=int, default=DEFAULT_LINE_COUNT,
+            help='Number of synthetic passwd lines')
+        cmd_args = parser.parse_args()
+        console.debug(f'cmd args {cmd_args}')
+        benchmark_unix_to_tsv(console, cmd_args.lines)
+
     elif base_args.command_name == COMMANDS.unix_to_tsv:
-        from scripts.unix_to_tsv import main as unix_to_tsv
+        from scripts.unix_to_tsv import (
+            find_sources,
+            main as unix_to_tsv,
+        )
 
         parser = new_base_arg_parser()
-        parser.add_argument('passwd_file', help="The unix passwd file to import")
-        parser.add_argument('shadow_file', help="The unix shadow file to import")
-        parser.add_argument('group_file', help="The unix group file to import")
+        parser.add_argument(
+            'files', nargs='*',
+            help="The unix passwd, shadow, and group files to import, repeated once per host")
+        parser.add_argument(
+            '--sources-dir',
+            help='Import each sub directory holding passwd, shadow, and group files')
+        parser.add_argument(
+            '--workers', type=int,
+            help='Number of processes parsing hosts when importing several hosts')
+        parser.add_argument(
+            '--drop-dangling', action='store_true', default=False,
+            help='Drop group members which are not exported users')
+        parser.add_argument(
+            '--since-manifest',
+            help='Manifest of an earlier export, only write rows added or changed since')
+        parser.add_argument(
+            '--format', choices=OUTPUT_FORMATS, default='tsv',
+            help='Interchange format to write, sqlite files are indexed')
         cmd_args = parser.parse_args()
         console.debug(f'cmd args {cmd_args}')
 
+        if len(cmd_args.files) % 3:
+            parser.error('files must be passwd, shadow, and group triples')
+        sources = [tuple(cmd_args.files[i:i + 3]) for i in range(0, len(cmd_args.files), 3)]
+        if cmd_args.sources_dir:
+            sources.extend(find_sources(cmd_args.sources_dir))
+        if not sources:
+            parser.error('no passwd, shadow, and group files to import')
+
         unix_to_tsv(
             console,
-            cmd_args.passwd_file,
-            cmd_args.shadow_file,
-            cmd_args.group_file,
+            sources,
+            drop_dangling=cmd_args.drop_dangling,
+            since_manifest=cmd_args.since_manifest,
+            output_format=cmd_args.format,
+            workers=cmd_args.workers,
         )
 
     elif base_args.command_name == COMMANDS.hosts_to_tsv:
         from scripts.hosts_to_tsv import main as hosts_to_tsv
 
         parser = new_base_arg_parser()
-        parser.add_argument('hosts_file', help="The unix passwd file to import")
+        parser.add_argument(
+            'hosts_files', nargs='+',
+            help="The /etc/hosts files to import, merged into 1 output")
+        parser.add_argument(
+            '--format', choices=OUTPUT_FORMATS, default='tsv',
+            help='Interchange format to write, sqlite files are indexed')
         cmd_args = parser.parse_args()
         console.debug(f'cmd args {cmd_args}')
-        hosts_to_tsv(console, cmd_args.hosts_file)
+        hosts_to_tsv(console, cmd_args.hosts_files, output_format=cmd_args.format)
+
+    elif base_args.command_name == COMMANDS.inspect_rows:
+        from scripts.inspect_rows import main as inspect_rows
+
+        parser = new_base_arg_parser()
+        parser.add_argument('row_store', help="The .sqlite interchange file to inspect")
+        parser.add_argument('--name', help='Show the row for this name')
+        parser.add_argument(
+            '--ranges', type=int,
+            help='Print PATH:START-STOP sources splitting the rows into this many ranges')
+        cmd_args = parser.parse_args()
+        console.debug(f'cmd args {cmd_args}')
+        inspect_rows(console, cmd_args.row_store, name=cmd_args.name, ranges=cmd_args.ranges)
 
     elif base_args.command_name == COMMANDS.load_hosts_tsv:
         from scripts.load_hosts_tsv import main as load_hosts_tsv
         parser = new_base_arg_parser()
-        parser.add_argument('hosts_tsv', help="The interchange formatted data to import")
+        parser.add_argument(
+            'hosts_tsv',
+            help="The interchange formatted data to import (.tsv, .sqlite, or .sqlite:START-STOP)")
+        parser.add_argument(
+            '--window', type=int, default=1,
+            help='Number of write operations to keep in flight (pipelining)')
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of connections to split rows across')
+        parser.add_argument(
+            '--on-error', type=error_policy_arg, default=PROMPT,
+            help=f'What to do when a write fails: {"|".join(ERROR_POLICY_CHOICES)}. '
+            + 'Failed rows are written to a rejects .tsv file')
+        parser.add_argument(
+            '--resume', action='store_true', default=False,
+            help='Skip rows committed by an earlier, interrupted import of the same file')
+        parser.add_argument(
+            '--reconcile', action='store_true', default=False,
+            help='Read ou=hosts once, only add missing hosts and update changed addresses')
+        add_task_logger_args(parser)
         cmd_args = parser.parse_args()
         console.debug(f'cmd args {cmd_args}')
-        load_hosts_tsv(console, cmd_args.hosts_tsv)
+        logger = get_task_logger(
+            'load-hosts-tsv', queued=cmd_args.log_queue, quiet_rows=cmd_args.quiet_rows)
+        load_hosts_tsv(
+            logger,
+            cmd_args.hosts_tsv,
+            window_size=cmd_args.window,
+            workers=cmd_args.workers,
+            on_error=cmd_args.on_error,
+            resume=cmd_args.resume,
+            reconcile=cmd_args.reconcile,
+        )
+
+    elif base_args.command_name == COMMANDS.host_index:
+        from common.ip_host_index import DEFAULT_INDEX_PATH
+        from scripts.host_index import main as host_index
+        parser = new_base_arg_parser()
+        parser.add_argument(
+            '--index', default=DEFAULT_INDEX_PATH,
+            help='Path of the persisted index')
+        parser.add_argument(
+            '--refresh', action='store_true', default=False,
+            help='Read hosts modified since the last refresh before answering')
+        parser.add_argument(
+            '--full', action='store_true', default=False,
+            help='Rebuild the index from every host entry')
+        parser.add_argument('--ip', type=ip_address_arg, help='Print the aliases of this address')
+        parser.add_argument('--alias', help='Print the addresses of this alias')
+        parser.add_argument(
+            '--cidr', type=cidr_arg,
+            help='Print every host in this range (eg. 10.12.0.0/16)')
+        cmd_args = parser.parse_args()
+        console.debug(f'cmd args {cmd_args}')
+        host_index(
+            console,
+            cmd_args.index,
+            refresh=cmd_args.refresh,
+            full=cmd_args.full,
+            ip=cmd_args.ip,
+            cidr=cmd_args.cidr,
+            alias=cmd_args.alias,
+        )
 
     elif base_args.command_name == COMMANDS.load_tsv:
         from scripts.load_tsv import main as load_tsv
 
         security_helpers.validate_applocals_file()
         parser = new_base_arg_parser()
-        parser.add_argument('user_file', help="The user tsv file to import")
-        parser.add_argument('group_file', help="The group tsv file to import")
+        parser.add_argument(
+            'user_file', help="The user tsv file to import (or .sqlite, .sqlite:START-STOP)")
+        parser.add_argument(
+            'group_file', help="The group tsv file to import (or .sqlite, .sqlite:START-STOP)")
         parser.add_argument(
             '--password', '-p',
             help="use a given user password instead of the imported passwords",
@@ -118,6 +290,23 @@ if __name__ == '__main__':
             '--skipusers', action='store_true', help='Don\'t import users', default=False)
         parser.add_argument(
             '--skipgroups', action='store_true', help='Don\'t import groups', default=False)
+        parser.add_argument(
+            '--window', type=int, default=1,
+            help='Number of write operations to keep in flight (pipelining)')
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of connections to split rows across')
+        parser.add_argument(
+            '--on-error', type=error_policy_arg, default=PROMPT,
+            help=f'What to do when a write fails: {"|".join(ERROR_POLICY_CHOICES)}. '
+            + 'Failed rows are written to a rejects .tsv file')
+        parser.add_argument(
+            '--resume', action='store_true', default=False,
+            help='Skip rows committed by an earlier, interrupted import of the same file')
+        parser.add_argument(
+            '--plan', action='store_true', default=False,
+            help='Write nothing, save the changes as a plan (.json & .ldif) to apply later')
+        add_task_logger_args(parser)
         cmd_args = parser.parse_args()
         console.debug(f'cmd args {cmd_args}')
 
@@ -128,20 +317,214 @@ if __name__ == '__main__':
             console.debug("using imported password(s)")
             given_password = None
 
-        logger = get_task_logger('load-tsv')
+        logger = get_task_logger(
+            'load-tsv', queued=cmd_args.log_queue, quiet_rows=cmd_args.quiet_rows)
         load_tsv(
             logger,
             SKIP_FLAG if cmd_args.skipusers else cmd_args.user_file,
             SKIP_FLAG if cmd_args.skipgroups else cmd_args.group_file,
             given_password=given_password,
+            window_size=cmd_args.window,
+            workers=cmd_args.workers,
+            on_error=cmd_args.on_error,
+            resume=cmd_args.resume,
+            plan=cmd_args.plan,
+        )
+
+    elif base_args.command_name == COMMANDS.unix_to_ldap:
+        from scripts.unix_to_ldap import main as unix_to_ldap
+
+        security_helpers.validate_applocals_file()
+        parser = new_base_arg_parser()
+        parser.add_argument('passwd_file', help="The unix passwd file to import")
+        parser.add_argument('shadow_file', help="The unix shadow file to import")
+        parser.add_argument('group_file', help="The unix group file to import")
+        parser.add_argument(
+            '--window', type=int, default=1,
+            help='Number of write operations to keep in flight (pipelining)')
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of connections to split rows across')
+        parser.add_argument(
+            '--on-error', type=error_policy_arg, default=PROMPT,
+            help=f'What to do when a write fails: {"|".join(ERROR_POLICY_CHOICES)}. '
+            + 'Failed rows are written to a rejects .tsv file')
+        parser.add_argument(
+            '--drop-dangling', action='store_true', default=False,
+            help='Drop group members which are not exported users')
+        parser.add_argument(
+            '--tee', action='store_true', default=False,
+            help='Also write the rows to .tsv files for auditing')
+        parser.add_argument(
+            '--plan', action='store_true', default=False,
+            help='Write nothing, save the changes as a plan (.json & .ldif) to apply later')
+        add_task_logger_args(parser)
+        cmd_args = parser.parse_args()
+        console.debug(f'cmd args {cmd_args}')
+
+        logger = get_task_logger(
+            'unix-to-ldap', queued=cmd_args.log_queue, quiet_rows=cmd_args.quiet_rows)
+        unix_to_ldap(
+            logger,
+            cmd_args.passwd_file,
+            cmd_args.shadow_file,
+            cmd_args.group_file,
+            window_size=cmd_args.window,
+            workers=cmd_args.workers,
+            on_error=cmd_args.on_error,
+            drop_dangling=cmd_args.drop_dangling,
+            tee=cmd_args.tee,
+            plan=cmd_args.plan,
+        )
+
+    elif base_args.command_name == COMMANDS.apply_plan:
+        from scripts.load_tsv import apply_plan
+
+        security_helpers.validate_applocals_file()
+        parser = new_base_arg_parser()
+        parser.add_argument('plan_file', help="The .json plan saved by load_tsv --plan")
+        parser.add_argument(
+            '--window', type=int, default=1,
+            help='Number of write operations to keep in flight (pipelining)')
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of connections to split changes across')
+        parser.add_argument(
+            '--on-error', type=error_policy_arg, default=PROMPT,
+            help=f'What to do when a write fails: {"|".join(ERROR_POLICY_CHOICES)}. '
+            + 'Failed changes are written to a rejects .tsv file')
+        parser.add_argument(
+            '--resume', action='store_true', default=False,
+            help='Skip changes committed by an earlier, interrupted run of the same plan')
+        add_task_logger_args(parser)
+        cmd_args = parser.parse_args()
+        console.debug(f'cmd args {cmd_args}')
+
+        logger = get_task_logger(
+            'apply-plan', queued=cmd_args.log_queue, quiet_rows=cmd_args.quiet_rows)
+        apply_plan(
+            logger,
+            cmd_args.plan_file,
+            window_size=cmd_args.window,
+            workers=cmd_args.workers,
+            on_error=cmd_args.on_error,
+            resume=cmd_args.resume,
         )
 
     # Day to day management scripts
+    elif base_args.command_name == COMMANDS.provision_homes:
+        from common.home_provisioning import (
+            DEFAULT_HOME_BASE,
+            DEFAULT_SKEL_DIR,
+            PROVISION_WORKERS,
+        )
+        from scripts.provision_homes import main as provision_homes
+
+        parser = new_base_arg_parser()
+        parser.add_argument(
+            'user_file', help="The user tsv file to provision (or .sqlite, .sqlite:START-STOP)")
+        parser.add_argument(
+            '--skel', default=DEFAULT_SKEL_DIR,
+            help='Directory copied into each new home directory')
+        parser.add_argument(
+            '--quota', nargs=3, metavar=('FILESYSTEM', 'SOFT', 'HARD'),
+            help='Block quota to set on each user (setquota)')
+        parser.add_argument(
+            '--dry-run-root',
+            help='Create home directories below this local directory, chown and quota are skipped')
+        parser.add_argument(
+            '--workers', type=int, default=PROVISION_WORKERS,
+            help='Number of users provisioned concurrently')
+        parser.add_argument(
+            '--home-base', default=DEFAULT_HOME_BASE,
+            help='Directory the home directories must be below')
+        add_task_logger_args(parser)
+        cmd_args = parser.parse_args()
+        console.debug(f'cmd args {cmd_args}')
+        logger = get_task_logger(
+            'provision-homes', queued=cmd_args.log_queue, quiet_rows=cmd_args.quiet_rows)
+        provision_homes(
+            logger,
+            cmd_args.user_file,
+            skel_dir=cmd_args.skel,
+            quota=(
+                (cmd_args.quota[0], int(cmd_args.quota[1]), int(cmd_args.quota[2]))
+                if cmd_args.quota else None
+            ),
+            dry_run_root=cmd_args.dry_run_root,
+            workers=cmd_args.workers,
+            home_base=cmd_args.home_base,
+        )
+
     elif base_args.command_name == COMMANDS.add_users:
+        from common.home_provisioning import DEFAULT_SKEL_DIR, PROVISION_WORKERS
+        from common.id_allocator import FIRST_ID
+        from scripts.add_users import (
+            DEFAULT_HOME_BASE,
+            main as add_users,
+        )
+
         security_helpers.validate_applocals_file()
         parser = new_base_arg_parser()
-        parser.parse_args()
-        logger = get_task_logger('add-users')
+        parser.add_argument(
+            'roster_file', help="The roster tsv file of users to add (user-name, full-name, [login-shell])")
+        parser.add_argument(
+            '--window', type=int, default=1,
+            help='Number of write operations to keep in flight (pipelining)')
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of connections to split rows across')
+        parser.add_argument(
+            '--on-error', type=error_policy_arg, default=PROMPT,
+            help=f'What to do when a write fails: {"|".join(ERROR_POLICY_CHOICES)}. '
+            + 'Failed rows are written to a rejects .tsv file')
+        parser.add_argument(
+            '--first-id', type=int, default=FIRST_ID,
+            help='Lowest uidNumber/gidNumber to allocate')
+        parser.add_argument(
+            '--contiguous-ids', action='store_true', default=False,
+            help='Reserve 1 unbroken block of uidNumbers/gidNumbers')
+        parser.add_argument(
+            '--home-base', default=DEFAULT_HOME_BASE,
+            help='Directory holding the new home directories')
+        parser.add_argument(
+            '--no-homes', action='store_true', default=False,
+            help='Do not provision home directories')
+        parser.add_argument(
+            '--skel', default=DEFAULT_SKEL_DIR,
+            help='Directory copied into each new home directory')
+        parser.add_argument(
+            '--quota', nargs=3, metavar=('FILESYSTEM', 'SOFT', 'HARD'),
+            help='Block quota to set on each user (setquota)')
+        parser.add_argument(
+            '--dry-run-root',
+            help='Create home directories below this local directory, chown and quota are skipped')
+        parser.add_argument(
+            '--provision-workers', type=int, default=PROVISION_WORKERS,
+            help='Number of users provisioned concurrently')
+        add_task_logger_args(parser)
+        cmd_args = parser.parse_args()
+        console.debug(f'cmd args {cmd_args}')
+        logger = get_task_logger(
+            'add-users', queued=cmd_args.log_queue, quiet_rows=cmd_args.quiet_rows)
+        add_users(
+            logger,
+            cmd_args.roster_file,
+            window_size=cmd_args.window,
+            workers=cmd_args.workers,
+            on_error=cmd_args.on_error,
+            first_id=cmd_args.first_id,
+            contiguous_ids=cmd_args.contiguous_ids,
+            home_base=cmd_args.home_base,
+            provision_homes=not cmd_args.no_homes,
+            skel_dir=cmd_args.skel,
+            quota=(
+                (cmd_args.quota[0], int(cmd_args.quota[1]), int(cmd_args.quota[2]))
+                if cmd_args.quota else None
+            ),
+            dry_run_root=cmd_args.dry_run_root,
+            provision_workers=cmd_args.provision_workers,
+        )
 
     else:
         console.error(f"Unknown command name: {base_args.command_name}")
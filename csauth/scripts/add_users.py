@@ -0,0 +1,243 @@
+
+""" Bulk add new users (ie. a semester's intake of students) from a roster.
+
+    .tsv ROSTER file:
+
+        tsv columns: user-name full-name [login-shell]
+
+    1. Existing users and groups are read once (see load_tsv.read_snapshot),
+       roster users whose name is taken are skipped.
+    2. uidNumbers and gidNumbers are reserved in 1 batch (see id_allocator),
+       the used ids are taken from the snapshot of step 1.
+       Each user gets a private group of the same name.
+    3. New passwords are generated and hashed in a process pool. Users are
+       written pipelined with the load_tsv write logic as hashes come in.
+    4. Each account is written to a new-accounts report (readable by the
+       owner only) once it has been added, these are the new account notices.
+       Accounts which could not be written are in posixUser-rejects, they
+       get no notice, private group, or home directory.
+    5. Home directories of the added users are provisioned (see home_provisioning).
+"""
+
+from collections import Counter
+from concurrent.futures import Executor, ProcessPoolExecutor
+import csv
+from logging import Logger
+import os
+import re
+import threading
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from common.error_policy import PROMPT
+from common.file_wrapper import OutputFileWrapper
+from common.home_provisioning import (
+    DEFAULT_HOME_BASE,
+    DEFAULT_SKEL_DIR,
+    PROVISION_WORKERS,
+    HomeProvisioner,
+    write_provisioning_report,
+)
+from common.id_allocator import (
+    FIRST_ID,
+    GID_NUMBER,
+    UID_NUMBER,
+    IdAllocator,
+)
+from common import ldap_helpers as ldap
+from common.script_logger import log_row_totals
+from common import security_helpers
+from common import tsv_stream
+from scripts.load_tsv import (
+    main as load_tsv,
+    read_snapshot,
+)
+
+
+DEFAULT_LOGIN_SHELL = '/bin/bash'
+
+_USERNAME_PATTERN = re.compile(r'^[a-z_][a-z0-9_-]{0,31}$')
+
+
+def _read_roster(
+    logger: Logger,
+    roster_source: tsv_stream.RowSource,
+    existing_users: Dict[str, Dict],
+    existing_groups: Dict[str, Dict],
+    summary: Counter,
+) -> List[List[str]]:
+    """ Roster rows of the users to add, as [user-name, full-name, login-shell].
+    """
+    new_users = []
+    seen = set()
+    for row in tsv_stream.iter_rows(roster_source):
+        summary['roster_rows_read'] += 1
+        if len(row) < 2 or not _USERNAME_PATTERN.match(row[0]):
+            logger.warning(f"skipping roster row. invalid user name: {row}")
+            summary['skipped_roster_rows <invalid>'] += 1
+            continue
+        username = row[0]
+        if username in seen:
+            logger.warning(f"skipping roster row. {username} is listed twice")
+            summary['skipped_roster_rows <duplicate>'] += 1
+            continue
+        seen.add(username)
+        if username in existing_users or username in existing_groups:
+            logger.info(f"not adding user {username} cn already exists")
+            summary['skipped_roster_rows <already exists>'] += 1
+            continue
+        new_users.append([username, row[1], row[2] if len(row) > 2 and row[2] else DEFAULT_LOGIN_SHELL])
+    return new_users
+
+
+def _used_ids(
+    existing_users: Dict[str, Dict],
+    existing_groups: Dict[str, Dict],
+) -> Tuple[Set[int], Set[int]]:
+    """ (uidNumbers, gidNumbers) of the snapshot. Primary gids of users count as used gidNumbers.
+    """
+    used_uids = set()
+    used_gids = set()
+    for entry in existing_users.values():
+        if entry.get('uidNumber'):
+            used_uids.add(int(entry['uidNumber']))
+        if entry.get('gidNumber'):
+            used_gids.add(int(entry['gidNumber']))
+    for entry in existing_groups.values():
+        if entry.get('gidNumber'):
+            used_gids.add(int(entry['gidNumber']))
+    return used_uids, used_gids
+
+
+def _reserve_ids(
+    logger: Logger,
+    count: int,
+    first_id: int,
+    contiguous: bool,
+    used_ids: Tuple[Set[int], Set[int]],
+) -> Tuple[List[int], List[int]]:
+    """ (uidNumbers, gidNumbers) reserved for count new users.
+    """
+    with ldap.get_connection_pool().checkout() as conn:
+        allocator = IdAllocator(conn, first_id, used_ids=used_ids)
+        uids = allocator.reserve(UID_NUMBER, count, contiguous)
+        gids = allocator.reserve(GID_NUMBER, count, contiguous)
+    if count:
+        logger.info(f"reserved uidNumbers {uids[0]}-{uids[-1]} and gidNumbers {gids[0]}-{gids[-1]}")
+    return uids, gids
+
+
+class _AccountNotices:
+    """ Writes the new account notice of a user once the user has been added.
+        on_user_added is called from the loader's worker threads.
+    """
+
+    def __init__(self, notices: csv.writer):
+        self._notices = notices
+        self._pending: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+        self.added: Set[str] = set()
+
+    def iter_hashed_user_rows(
+        self,
+        user_rows: List[List[str]],
+        hash_executor: Executor,
+    ) -> Iterator[List[str]]:
+        """ Yield the PosixUser rows with new password hashes, as the hashes are made.
+        """
+        passwords = [security_helpers.new_plaintext_password() for _ in user_rows]
+        hashes = security_helpers.hash_passwords(passwords, hash_executor)
+        for user, password, hashed_password in zip(user_rows, passwords, hashes):
+            username, uid, gid, _hash, fullname, home, _login_shell = user
+            with self._lock:
+                #tsv columns: user-name uid gid plaintext-password full-name home-directory
+                self._pending[username] = [username, uid, gid, password, fullname, home]
+            yield user[:3] + [hashed_password] + user[4:]
+
+    def on_user_added(self, username: str) -> None:
+        with self._lock:
+            self._notices.writerow(self._pending.pop(username))
+            self.added.add(username)
+
+
+def main(
+    logger: Logger,
+    roster_source: tsv_stream.RowSource,
+    window_size: int = 1,
+    workers: int = 1,
+    on_error: str = PROMPT,
+    first_id: int = FIRST_ID,
+    contiguous_ids: bool = False,
+    home_base: str = DEFAULT_HOME_BASE,
+    provision_homes: bool = True,
+    skel_dir: str = DEFAULT_SKEL_DIR,
+    quota: Optional[Tuple[str, int, int]] = None,
+    dry_run_root: Optional[str] = None,
+    provision_workers: int = PROVISION_WORKERS,
+) -> None:
+    logger.debug("add_users::main()")
+    summary = Counter()
+
+    existing_users, existing_groups = read_snapshot(logger)
+    new_users = _read_roster(logger, roster_source, existing_users, existing_groups, summary)
+    logger.info(f"adding {len(new_users)} new users")
+
+    uids, gids = _reserve_ids(
+        logger,
+        len(new_users),
+        first_id,
+        contiguous_ids,
+        _used_ids(existing_users, existing_groups),
+    )
+
+    #tsv columns: user-name uid guid hashed-password user-details home-directory login-shell
+    user_rows = [
+        [username, str(uid), str(gid), '', fullname, os.path.join(home_base, username), login_shell]
+        for (username, fullname, login_shell), uid, gid in zip(new_users, uids, gids)
+    ]
+    private_groups = [[username, str(gid), username] for (username, *_), gid in zip(new_users, gids)]
+
+    notices_output = OutputFileWrapper('new-accounts', 'tsv')
+    os.chmod(notices_output.full_path, 0o600)
+    # New password hashes are CPU bound, they are made in a process pool.
+    hash_executor = ProcessPoolExecutor()
+    try:
+        with notices_output as fp:
+            notices = _AccountNotices(csv.writer(fp, delimiter='\t'))
+            load_tsv(
+                logger,
+                notices.iter_hashed_user_rows(user_rows, hash_executor),
+                # Groups are read once every user has been written,
+                # only the users which were added get a private group.
+                (group for group in private_groups if group[0] in notices.added),
+                window_size=window_size,
+                workers=workers,
+                on_error=on_error,
+                snapshot=(existing_users, existing_groups),
+                on_user_added=notices.on_user_added,
+            )
+    finally:
+        hash_executor.shutdown(cancel_futures=True)
+    logger.info(f"new account notices written to {notices_output.full_path}")
+    summary['users_added'] = len(notices.added)
+    summary['users_not_added'] = len(user_rows) - len(notices.added)
+
+    if provision_homes:
+        provisioner = HomeProvisioner(logger, skel_dir, quota, dry_run_root, home_base)
+        summary.update(write_provisioning_report(
+            logger,
+            provisioner.provision_many(
+                (user for user in user_rows if user[0] in notices.added),
+                provision_workers,
+            ),
+        ))
+
+    log_row_totals(logger)
+    logger.info('\n* * * * Summary * * * *\n' + '\n'.join(f'{k}:  {summary[k]}' for k in summary))
+    logger.debug("bye")
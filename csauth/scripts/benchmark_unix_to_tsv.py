@@ -0,0 +1,71 @@
+
+""" Throughput benchmark for the unix_to_tsv pipeline.
+    Synthetic passwd, shadow, and group files are written to TMP_DIR,
+    converted, timed, and deleted.
+"""
+
+from collections import Counter
+from logging import Logger
+import resource
+import time
+
+from common.file_wrapper import TMPFileWrapper
+from common.line_reader import iter_lines
+from scripts.unix_to_tsv import _build_output
+
+
+DEFAULT_LINE_COUNT = 1_000_000
+
+# Accounts per synthetic group.
+_GROUP_SIZE = 50
+
+
+def _write_synthetic_sources(
+    line_count: int,
+    passwd_file: TMPFileWrapper,
+    shadow_file: TMPFileWrapper,
+    group_file: TMPFileWrapper,
+) -> None:
+    with passwd_file as passwd_fp, shadow_file as shadow_fp, group_file as group_fp:
+        for ix in range(line_count):
+            uid = 1000 + ix
+            name = f'user{uid}'
+            passwd_fp.write(f'{name}:x:{uid}:{uid}:User {uid}:/home/{name}:/bin/bash\n')
+            shadow_fp.write(f'{name}:$6$salt{ix}$hash{ix}:19000:0:99999:7:::\n')
+            if ix % _GROUP_SIZE == 0:
+                members = ','.join(f'user{1000 + m}' for m in range(ix, min(ix + _GROUP_SIZE, line_count)))
+                group_fp.write(f'group{uid}:x:{uid}:{members}\n')
+
+
+def main(logger: Logger, line_count: int = DEFAULT_LINE_COUNT) -> None:
+    summary = Counter()
+    sources = (TMPFileWrapper(), TMPFileWrapper(), TMPFileWrapper())
+    outputs = (TMPFileWrapper(), TMPFileWrapper())
+    try:
+        logger.info(f"writing {line_count} synthetic passwd/shadow lines...")
+        _write_synthetic_sources(line_count, *sources)
+        passwd_file, shadow_file, group_file = sources
+        rss_before_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        logger.info("converting...")
+        start = time.perf_counter()
+        _build_output(
+            logger,
+            *outputs,
+            iter_lines(passwd_file.full_path),
+            iter_lines(shadow_file.full_path),
+            iter_lines(group_file.full_path),
+        )
+        elapsed = time.perf_counter() - start
+
+        summary['passwd_lines'] = line_count
+        summary['seconds'] = round(elapsed, 3)
+        summary['passwd_lines_per_second'] = int(line_count / elapsed)
+        summary['max_rss_kb_before'] = rss_before_kb
+        summary['max_rss_kb_after'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    finally:
+        for wrapper in sources + outputs:
+            wrapper.remove()
+
+    logger.info('\n* * * * Summary * * * *\n' + '\n'.join(f'{k}:  {summary[k]}' for k in summary))
+    logger.debug("bye")
@@ -0,0 +1,57 @@
+
+""" Look up lab hosts by address, alias, or CIDR range from a local index
+    of ou=hosts (see ip_host_index) instead of searching LDAP each time.
+
+    The index is built by the 1st run and refreshed incrementally with
+    refresh=True (full=True re-reads every entry). ip and cidr must be
+    valid (see main.py), they are not checked here.
+"""
+
+from logging import Logger
+import time
+from typing import Optional
+
+from common.ip_host_index import DEFAULT_INDEX_PATH, IPHostIndex
+from common import ldap_helpers as ldap
+
+
+def refresh_index(logger: Logger, index: IPHostIndex, full: bool = False) -> None:
+    incremental = index.modified_since is not None and not full
+    with ldap.get_connection_pool().checkout() as conn:
+        logger.debug("connected to ldap server @" + conn.server.host)
+        if incremental:
+            logger.info(f"reading hosts modified since {index.modified_since}")
+            modified_hosts = ldap.get_ip_host_index(conn, index.modified_since)
+            current_aliases = ldap.get_ip_host_cns(conn)
+        else:
+            logger.info("reading all hosts")
+            modified_hosts = ldap.get_ip_host_index(conn)
+            current_aliases = None
+    updated, removed = index.update(modified_hosts, current_aliases)
+    index.save()
+    logger.info(f"index refreshed: {updated} hosts updated, {removed} removed ({index.path})")
+
+
+def main(
+    logger: Logger,
+    index_path: str = DEFAULT_INDEX_PATH,
+    refresh: bool = False,
+    full: bool = False,
+    ip: Optional[str] = None,
+    cidr: Optional[str] = None,
+    alias: Optional[str] = None,
+) -> None:
+    index = IPHostIndex(index_path)
+    if refresh or full or not index.built:
+        refresh_index(logger, index, full)
+    logger.info(f"{len(index.hosts)} hosts indexed")
+
+    started = time.perf_counter()
+    if ip is not None:
+        print(f"{ip}\t{','.join(index.aliases_of(ip))}")
+    if alias is not None:
+        print(f"{alias}\t{','.join(index.hosts.get(alias, []))}")
+    if cidr is not None:
+        for address, host_alias in index.iter_network(cidr):
+            print(f"{address}\t{host_alias}")
+    logger.debug(f"lookups took {(time.perf_counter() - started) * 1e6:.0f}us")
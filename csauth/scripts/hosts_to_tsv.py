@@ -1,38 +1,120 @@
 
+""" Export /etc/hosts files into an interchange format (.tsv file)
+
+        tsv columns: ip-address fqdn alias
+
+    Host files are streamed line by line, fields are split on any
+    whitespace and both IPv4 and IPv6 addresses are accepted.
+    Several host files can be merged into 1 output, an index of
+    alias => ip address is kept while parsing so each alias is written once:
+    repeated lines are dropped, and an alias given another address is
+    dropped and written to a hosts-conflicts report (the 1st address wins).
+"""
+
 from collections import Counter
 import csv
+import ipaddress
 from logging import Logger
-import re
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
 
 from common.file_wrapper import OutputFileWrapper
+from common.line_reader import iter_lines
+from common import row_store
 
 
-def clean_part(part: str) -> str:
-    if ' ' in part.strip():
-        return part.strip().split(' ')[0]
-    return part
+# Row stores of hosts are indexed by alias (tsv columns: ip-address fqdn alias).
+ALIAS_COLUMN = 2
 
-def main(logger: Logger, hosts_file: str):
-    ipv4_patt = re.compile(r'^(?:[0-9]{1,3}\.){3}[0-9]{1,3}$')
-    summary = Counter()
 
-    host_lines = []
-    with open(hosts_file) as f:
-        for line in f:
-            host_lines.append(line)
-            summary['inputted_lines'] += 1
+def parse_host_line(line: str) -> Optional[List[str]]:
+    """ [ip-address, fqdn, alias] of an /etc/hosts line, None if the line has no host.
+        Addresses are normalized (ie. IPv6 is compressed) so they can be compared.
+    """
+    parts = line.split('#', 1)[0].split()
+    if len(parts) < 3:
+        return None
+    try:
+        address = ipaddress.ip_address(parts[0])
+    except ValueError:
+        return None
+    return [str(address), parts[1], parts[2]]
+
+
+class HostIndex:
+    """ Index of alias => (ip-address, source) for the rows written so far.
+    """
+
+    def __init__(self):
+        self._hosts: Dict[str, Tuple[str, str]] = {}
+        self.conflicts: List[List[str]] = []
+
+    def add(self, row: List[str], source: str) -> Optional[str]:
+        """ Returns None if the row is new, otherwise 'duplicate' or 'conflict'.
+        """
+        ip, _fqdn, alias = row
+        kept = self._hosts.get(alias)
+        if kept is None:
+            self._hosts[alias] = (ip, source)
+            return None
+        kept_ip, kept_source = kept
+        if kept_ip == ip:
+            return 'duplicate'
+        self.conflicts.append([alias, kept_ip, kept_source, ip, source])
+        return 'conflict'
 
-    hosts_output = OutputFileWrapper('etc-hosts', 'tsv')
-    with hosts_output as f:
-        writer = csv.writer(f, delimiter='\t')
-        for line in host_lines:
-            parts = [clean_part(p) for p in line.strip('\n').split('\t') if p.strip() != '']
-            if len(parts) >= 3 and ipv4_patt.match(parts[0]) and parts[2] != "#":
-                logger.debug(f'writing to output: {parts[:3]}')
-                writer.writerow(parts[:3])
-                summary['outputted_lines'] += 1
-            else:
+
+def iter_host_rows(
+    logger: Logger,
+    hosts_files: Iterable[str],
+    index: HostIndex,
+    summary: Counter,
+) -> Iterator[List[str]]:
+    for hosts_file in hosts_files:
+        for line in iter_lines(hosts_file):
+            summary['inputted_lines'] += 1
+            row = parse_host_line(line)
+            if row is None:
                 summary['skipped_lines'] += 1
+                continue
+            found = index.add(row, hosts_file)
+            if found == 'duplicate':
+                summary['duplicate_aliases'] += 1
+                continue
+            if found == 'conflict':
+                logger.warning(f'alias {row[2]} has another address, skipping {row}')
+                summary['conflicting_aliases'] += 1
+                continue
+            logger.debug(f'writing to output: {row}')
+            summary['outputted_lines'] += 1
+            yield row
+
+
+def write_conflicts_report(logger: Logger, index: HostIndex) -> None:
+    if not index.conflicts:
+        return
+    report = OutputFileWrapper('hosts-conflicts', 'tsv')
+    with report as fp:
+        writer = csv.writer(fp, delimiter='\t')
+        #tsv columns: alias, kept-ip-address, kept-source, dropped-ip-address, dropped-source
+        writer.writerows(index.conflicts)
+    logger.warning(f"alias conflicts written to {report.full_path}")
+
+
+def main(logger: Logger, hosts_files: List[str], output_format: str = 'tsv'):
+    summary = Counter()
+    index = HostIndex()
+
+    hosts_output = OutputFileWrapper('etc-hosts', output_format)
+    with row_store.open_writer(hosts_output, key_column=ALIAS_COLUMN) as writer:
+        writer.writerows(iter_host_rows(logger, hosts_files, index, summary))
 
+    write_conflicts_report(logger, index)
     logger.info('\n* * * * Summary * * * *\n' + '\n'.join(f'{k}:  {summary[k]}' for k in summary))
     logger.debug("bye")
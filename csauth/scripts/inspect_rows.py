@@ -0,0 +1,26 @@
+
+""" Inspect a row store (see row_store) without scanning it:
+    count its rows, look up a row by name, or split it into
+    ranges which can be passed to several loaders at once.
+"""
+
+from logging import Logger
+from typing import Optional
+
+from common.row_store import RowStore
+
+
+def main(
+    logger: Logger,
+    row_store_path: str,
+    name: Optional[str] = None,
+    ranges: Optional[int] = None,
+) -> None:
+    with RowStore(row_store_path) as store:
+        logger.info(f"rows: {store.count()}")
+        if name is not None:
+            row = store.get(name)
+            logger.info(f"{name}: {row}" if row is not None else f"{name}: not found")
+        if ranges:
+            for start, stop in store.ranges(ranges):
+                print(f'{row_store_path}:{start}-{stop}')
@@ -1,52 +1,221 @@
 
-from collections import Counter
+""" Load /etc/hosts interchange formatted data (see hosts_to_tsv) into LDAP database.
+
+    By default each row is added optimistically, hosts which already
+    exist come back as entryAlreadyExists and are left as they are.
+
+    With reconcile=True the ipHost entries of ou=hosts are read once
+    (paged search) and diffed against the rows by alias and by ipHostNumber:
+    only missing hosts are added, and hosts whose address changed are modified.
+    A host added or moved to an address already held by another host is
+    an ip collision. It is still written, and listed in a hosts-ip-collisions report:
+
+        tsv columns: alias ip-address held-by-aliases action
+"""
+
+from collections import Counter, defaultdict
 import csv
+from functools import partial
+import ipaddress
 from logging import Logger
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
 
+from common.error_policy import ErrorPolicy, PROMPT
+from common.file_wrapper import OutputFileWrapper
+from common.import_journal import ImportJournal
 from common import ldap_helpers as ldap
+from common.ldap_pipeline import (
+    OperationWindow,
+    import_rows,
+    result_handler,
+)
+from common.script_logger import ROW, log_row_totals
 
-def main(logger: Logger, hosts_tsv_file: str):
+
+def main(
+    logger: Logger,
+    hosts_tsv_file: str,
+    window_size: int = 1,
+    workers: int = 1,
+    on_error: str = PROMPT,
+    resume: bool = False,
+    reconcile: bool = False,
+):
     summary = Counter()
 
-    with open(hosts_tsv_file) as f:
-        hosts_tsv_rows = list(csv.reader(f, delimiter='\t'))
+    existing_hosts = None
+    aliases_by_ip = None
+    # Appended to by the worker threads.
+    collisions: List[List[str]] = []
+    if reconcile:
+        with ldap.get_connection_pool().checkout() as conn:
+            logger.debug("connected to ldap server @" + conn.server.host)
+            existing_hosts = ldap.get_ip_host_index(conn)
+        logger.info(f"found {len(existing_hosts)} existing hosts")
+        aliases_by_ip = _index_aliases_by_ip(existing_hosts)
 
-    logger.info(f"found {len(hosts_tsv_rows)} host rows to import")
+    import_rows(
+        logger,
+        summary,
+        hosts_tsv_file,
+        'host_rows_read',
+        'ipHost-rejects',
+        partial(_load_hosts, logger, existing_hosts, aliases_by_ip, collisions),
+        workers,
+        window_size,
+        on_error,
+        resume,
+    )
+    write_collisions_report(logger, collisions)
 
-    with ldap.new_connection() as conn:
+    log_row_totals(logger)
+    logger.info('\n* * * * Summary * * * *\n' + '\n'.join(f'{k}:  {summary[k]}' for k in summary))
+    logger.debug("bye")
 
-        for row in hosts_tsv_rows:
-            (
-                ipv4,
-                _fqdn,
-                alias,
-            ) = row
 
-            cn = alias
-            if ldap.ip_host_exists(conn, cn):
-                logger.debug(f'ipHost already exists in database {alias} {ipv4}')
-                summary['skipping_host_already_added'] += 1
-                continue
+def _normalize_ip(ip: str) -> str:
+    try:
+        return str(ipaddress.ip_address(ip))
+    except ValueError:
+        return ip
 
-            response = ldap.add_ip_host(conn, cn, ipv4)
-            try:
-                ldap.validate_response_is_success(response)
-            except ldap.LDAPCRUDError:
-                logger.error(f'failed to add host {alias} {ipv4}')
-                logger.error(f'{response}')
-                summary['add_host_errors'] += 1
-
-                should_continue = input("press y to continue importing: ")
-                if should_continue.lower().strip() == 'y':
-                    logger.debug("continuing...")
-                    continue
-                else:
-                    logger.debug("exiting...")
-                    break
-            else:
-                logger.info(f'{alias} {ipv4} has been added')
-                summary['hosts_added'] += 1
 
+def _host_ips(existing_host: Dict) -> List[str]:
+    ips = existing_host.get('ipHostNumber', [])
+    return [_normalize_ip(ip) for ip in ([ips] if isinstance(ips, str) else ips)]
 
-    logger.info('\n* * * * Summary * * * *\n' + '\n'.join(f'{k}:  {summary[k]}' for k in summary))
-    logger.debug("bye")
+
+def _index_aliases_by_ip(existing_hosts: Dict[str, Dict]) -> Dict[str, List[str]]:
+    aliases_by_ip = defaultdict(list)
+    for alias, existing_host in existing_hosts.items():
+        for ip in _host_ips(existing_host):
+            aliases_by_ip[ip].append(alias)
+    return aliases_by_ip
+
+
+def _plan_host(existing_host: Optional[Dict], ip: str) -> Optional[str]:
+    """ 'add' or 'modify' for a row, None when the existing host is up to date.
+    """
+    if existing_host is None:
+        return 'add'
+    if _normalize_ip(ip) in _host_ips(existing_host):
+        return None
+    return 'modify'
+
+
+def write_collisions_report(logger: Logger, collisions: List[List[str]]) -> None:
+    if not collisions:
+        return
+    report = OutputFileWrapper('hosts-ip-collisions', 'tsv')
+    with report as fp:
+        writer = csv.writer(fp, delimiter='\t')
+        #tsv columns: alias ip-address held-by-aliases action
+        writer.writerows(collisions)
+    logger.warning(f"ip collisions written to {report.full_path}")
+
+
+def _check_collision(
+    logger: Logger,
+    aliases_by_ip: Dict[str, List[str]],
+    collisions: List[List[str]],
+    summary: Counter,
+    alias: str,
+    ip: str,
+    action: str,
+) -> None:
+    """ Record an ip collision if ip is held by a host other than alias.
+    """
+    held_by = [a for a in aliases_by_ip.get(_normalize_ip(ip), []) if a != alias]
+    if held_by:
+        logger.info('%s of host %s is also held by %s', ip, alias, held_by, extra=ROW)
+        collisions.append([alias, ip, ','.join(held_by), action])
+        summary['hosts_with_ip_collision'] += 1
+
+
+def _on_host_already_exists(
+    logger: Logger,
+    summary: Counter,
+    commit: Callable[[], None],
+    alias: str,
+    ip: str,
+) -> None:
+    logger.debug('ipHost already exists in database %s %s', alias, ip, extra=ROW)
+    summary['skipping_host_already_added'] += 1
+    commit()
+
+
+def _load_hosts(
+    logger: Logger,
+    existing_hosts: Optional[Dict[str, Dict]],
+    aliases_by_ip: Optional[Dict[str, List[str]]],
+    collisions: List[List[str]],
+    error_policy: ErrorPolicy,
+    journal: ImportJournal,
+    window: OperationWindow,
+    hosts_tsv_rows: List[Tuple[int, List[str]]],
+    summary: Counter,
+) -> None:
+    for row_number, row in hosts_tsv_rows:
+        if window.stopped:
+            break
+        # Rows from a rejects file have the LDAP result appended.
+        row = row[:3]
+        (
+            ip,
+            _fqdn,
+            alias,
+        ) = row
+        commit = partial(journal.commit, row_number)
+
+        if existing_hosts is not None:
+            action = _plan_host(existing_hosts.get(alias), ip)
+            if action is None:
+                _on_host_already_exists(logger, summary, commit, alias, ip)
+                continue
+            _check_collision(logger, aliases_by_ip, collisions, summary, alias, ip, action)
+            if action == 'modify':
+                logger.info('updating address of host %s to %s', alias, ip, extra=ROW)
+                window.submit(
+                    partial(ldap.set_ip_host_number, cn=alias, ipHostNumber=ip),
+                    result_handler(
+                        logger,
+                        summary,
+                        error_policy,
+                        row,
+                        'hosts_address_updated',
+                        '%(alias)s %(ip)s has been updated',
+                        'update_host_errors',
+                        'failed to update host %(alias)s %(ip)s',
+                        on_success=commit,
+                        message_args={'alias': alias, 'ip': ip},
+                    ),
+                )
+                continue
+
+        # Add optimistically, existing hosts come back as entryAlreadyExists.
+        cn = alias
+        window.submit(
+            partial(ldap.add_ip_host, cn=cn, ip=ip, optimistic=True),
+            result_handler(
+                logger,
+                summary,
+                error_policy,
+                row,
+                'hosts_added',
+                '%(alias)s %(ip)s has been added',
+                'add_host_errors',
+                'failed to add host %(alias)s %(ip)s',
+                already_exists_error=ldap.IPHostAlreadyExistsError,
+                on_already_exists=partial(
+                    _on_host_already_exists, logger, summary, commit, alias, ip,
+                ),
+                on_success=commit,
+                message_args={'alias': alias, 'ip': ip},
+            ),
+        )
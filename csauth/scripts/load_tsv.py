@@ -2,18 +2,82 @@
 """ Load interchange formatted data into LDAP database.
     This script accepts 2x .tsv files as inputs.
     These 2x input files are generated by the unix_to_tsv script.
+    Rows can also be streamed in-process instead (see unix_to_ldap).
+
+    Existing users and groups are read once (paged search) into
+    in-memory indexes keyed by cn. Adds, password changes, and
+    membership changes are computed against those indexes so the
+    only requests sent afterwards are the writes that are needed.
+
+    Writes can be pipelined: with a window size > 1 they are sent over
+    asynchronous connections with up to window size requests in flight.
+    Rows can be split across several workers, each with its own connection.
+    Group rows are only written after every user row has been written.
+    The .tsv files are streamed in chunks, writing starts with the 1st chunk.
+
+    Failed writes are handled according to the error policy (see error_policy),
+    rejected rows are written to posixUser-rejects/posixGroup-rejects .tsv files.
+
+    Committed rows are journaled (see import_journal), an interrupted
+    import can be resumed without resending the rows already written.
+
+    With plan=True nothing is written, the changes are saved as a
+    change plan (see change_plan) instead. apply_plan writes a saved plan.
 """
 
 from collections import Counter
-import csv
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
+from itertools import repeat
+import json
 from logging import Logger
-from typing import List
+import threading
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
 
+from common import change_plan
 from common.constants import (
     SKIP_FLAG
 )
+from common.error_policy import ErrorPolicy, PROMPT
+from common.import_journal import ImportJournal
 from common import ldap_helpers as ldap
+from common.ldap_pipeline import (
+    OperationWindow,
+    import_rows,
+    result_handler,
+    run_in_workers,
+)
+from common.script_logger import ROW, log_row_totals
 from common import security_helpers
+from common import tsv_stream
+
+
+# action => (success key, success message, error key, error message)
+_CHANGE_RESULTS = {
+    change_plan.ADD_POSIX_USER: (
+        'users_added', '%(label)s has been added',
+        'user_errors', 'failed to add user %(cn)s',
+    ),
+    change_plan.SYNC_USER_PASSWORD: (
+        'users_password_updated', '%(label)s password has been updated',
+        'user_password_update_errors', 'failed to edit user password for %(label)s',
+    ),
+    change_plan.ADD_POSIX_GROUP: (
+        'groups_added', '%(label)s has been added',
+        'group_errors', 'failed to add group %(cn)s',
+    ),
+    change_plan.SET_POSIX_GROUP_MEMBERS: (
+        'group_modified', '%(label)s has been modified',
+        'group_errors', 'failed to modify group %(cn)s',
+    ),
+}
 
 
 def _deduplicate_list(l: List[str]) -> List[str]:
@@ -22,204 +86,556 @@ def _deduplicate_list(l: List[str]) -> List[str]:
 
 def main(
         logger: Logger,
-        posix_user_tsv_path: str,
-        posix_group_tsv_path: str,
+        posix_user_source: tsv_stream.RowSource,
+        posix_group_source: tsv_stream.RowSource,
         given_password: str = None,
+        window_size: int = 1,
+        workers: int = 1,
+        on_error: str = PROMPT,
+        resume: bool = False,
+        plan: bool = False,
+        snapshot: Optional[Tuple[Dict[str, Dict], Dict[str, Dict]]] = None,
+        on_user_added: Optional[Callable[[str], None]] = None,
 ) -> None:
+    """ snapshot is (existing users, existing groups) when the caller
+        already read them (see read_snapshot), otherwise they are read here.
+        on_user_added is called with the user name of each user added
+        (from a worker thread), not for users which were rejected.
+    """
     logger.debug("load_tsv::main()")
     summary = Counter()
 
+    if snapshot is None:
+        snapshot = read_snapshot(
+            logger,
+            users=posix_user_source != SKIP_FLAG,
+            groups=posix_group_source != SKIP_FLAG,
+        )
+    existing_users, existing_groups = snapshot
 
-    # Read interchange formatted data from .tsv files into memory
-    logger.debug('reading ' + posix_user_tsv_path)
-    if posix_user_tsv_path != SKIP_FLAG:
-        with open(posix_user_tsv_path) as f:
-            user_tsv_rows = list(csv.reader(f, delimiter='\t'))
-    else:
-        user_tsv_rows = []
-    logger.info(f"found {len(user_tsv_rows)} user rows to import")
-
+    # New password hashes are CPU bound, they are made in a process pool.
+    hash_executor = ProcessPoolExecutor() if given_password else None
+    try:
+        if plan:
+            _write_plan(
+                logger,
+                summary,
+                posix_user_source,
+                posix_group_source,
+                existing_users,
+                existing_groups,
+                given_password,
+                hash_executor,
+            )
+        else:
+            _load(
+                logger,
+                summary,
+                posix_user_source,
+                posix_group_source,
+                existing_users,
+                existing_groups,
+                given_password,
+                hash_executor,
+                window_size,
+                workers,
+                on_error,
+                resume,
+                on_user_added,
+            )
+    finally:
+        if hash_executor is not None:
+            hash_executor.shutdown(cancel_futures=True)
 
-    logger.debug('reading ' + posix_group_tsv_path)
-    if posix_group_tsv_path != SKIP_FLAG:
-        with open(posix_group_tsv_path) as f:
-            group_tsv_rows = list(csv.reader(f, delimiter='\t'))
-    else:
-        group_tsv_rows = []
-    logger.info(f"found {len(group_tsv_rows)} group rows to import")
+    log_row_totals(logger)
+    logger.info('\n* * * * Summary * * * *\n' + '\n'.join(f'{k}:  {summary[k]}' for k in summary))
+    logger.debug("bye")
 
 
-    with ldap.new_connection() as conn:
+def read_snapshot(
+    logger: Logger,
+    users: bool = True,
+    groups: bool = True,
+) -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+    """ Snapshot existing directory data: the users and groups indexed by cn.
+    """
+    with ldap.get_connection_pool().checkout() as conn:
         logger.debug("connected to ldap server @" + conn.server.host)
+        existing_users = ldap.get_posix_user_index(conn) if users else {}
+        logger.info(f"found {len(existing_users)} existing users")
+        existing_groups = ldap.get_posix_group_index(conn) if groups else {}
+        logger.info(f"found {len(existing_groups)} existing groups")
+    return existing_users, existing_groups
+
+
+def apply_plan(
+    logger: Logger,
+    plan_path: str,
+    window_size: int = 1,
+    workers: int = 1,
+    on_error: str = PROMPT,
+    resume: bool = False,
+) -> None:
+    """ Write the changes of a saved change plan, users before groups.
+        Rejected changes are written to a plan-rejects .tsv file as JSON.
+    """
+    logger.debug("load_tsv::apply_plan()")
+    summary = Counter()
+    plan = change_plan.read_plan(plan_path)
+    logger.info(f"applying plan created {plan['created']} from {plan['inputs']}")
+    numbered_changes = list(enumerate(plan['changes'], start=1))
 
-        if len(user_tsv_rows):
-            logger.debug("adding users")
+    stop_event = threading.Event()
+    with (
+        ImportJournal(plan_path, resume) as journal,
+        ErrorPolicy(logger, on_error, 'plan-rejects') as error_policy,
+    ):
+        if journal.committed:
+            logger.info(f"resuming plan, skipping {len(journal.committed)} committed changes")
+        for actions in (change_plan.USER_ACTIONS, change_plan.GROUP_ACTIONS):
+            summary.update(run_in_workers(
+                tsv_stream.iter_chunks(journal.skip_committed(
+                    (row_number, change)
+                    for row_number, change in numbered_changes
+                    if change['action'] in actions
+                )),
+                workers,
+                window_size,
+                partial(_apply_changes, logger, error_policy, journal),
+                stop_event,
+            ))
+            if stop_event.is_set():
+                logger.info(f"plan stopped, it can be resumed with --resume ({journal.full_path})")
+                break
+        else:
+            if error_policy.rejects_path is None:
+                journal.remove()
+
+    log_row_totals(logger)
+    logger.info('\n* * * * Summary * * * *\n' + '\n'.join(f'{k}:  {summary[k]}' for k in summary))
+    logger.debug("bye")
+
+
+def _load(
+    logger: Logger,
+    summary: Counter,
+    posix_user_source: tsv_stream.RowSource,
+    posix_group_source: tsv_stream.RowSource,
+    existing_users: Dict[str, Dict],
+    existing_groups: Dict[str, Dict],
+    given_password: Optional[str],
+    hash_executor: Optional[Executor],
+    window_size: int,
+    workers: int,
+    on_error: str,
+    resume: bool,
+    on_user_added: Optional[Callable[[str], None]] = None,
+) -> None:
+    logger.debug(
+        f"writing with {workers} worker(s), "
+        + f"each with a window of {window_size} operation(s)"
+    )
+    stop_event = threading.Event()
+    users_loaded = import_rows(
+        logger,
+        summary,
+        posix_user_source,
+        'user_rows_read',
+        'posixUser-rejects',
+        partial(
+            _load_users,
+            logger,
+            existing_users,
+            given_password,
+            hash_executor,
+            on_user_added,
+        ),
+        workers,
+        window_size,
+        on_error,
+        resume,
+        stop_event,
+    )
+    # All user writes must complete before groups are written.
+    if users_loaded:
+        import_rows(
+            logger,
+            summary,
+            posix_group_source,
+            'group_rows_read',
+            'posixGroup-rejects',
+            partial(_load_groups, logger, existing_groups),
+            workers,
+            window_size,
+            on_error,
+            resume,
+            stop_event,
+        )
+
+
+def _write_plan(
+    logger: Logger,
+    summary: Counter,
+    posix_user_source: tsv_stream.RowSource,
+    posix_group_source: tsv_stream.RowSource,
+    existing_users: Dict[str, Dict],
+    existing_groups: Dict[str, Dict],
+    given_password: Optional[str],
+    hash_executor: Optional[Executor],
+) -> None:
+    changes = []
+    for user_tsv_rows in tsv_stream.iter_chunks(tsv_stream.count_rows(
+        tsv_stream.iter_rows(posix_user_source),
+        summary,
+        'user_rows_read',
+    )):
+        user_passwords = _iter_user_passwords(given_password, hash_executor, user_tsv_rows)
         for user in user_tsv_rows:
-            (
-                username,
-                uidNumber,
-                gidNumber,
-                hashedPw,
-                fullname,
-                homeDirectory,
-                loginShell,
-            ) = user
-
-            if ldap.posix_user_exists(conn, username):
-                logger.info(
-                    f"not adding user {username}({uidNumber}) cn already exists"
-                )
-                summary['skipped_user_add <already exists>'] += 1
-
-                # sync password
-                existing_user = ldap.get_posix_user(conn, username)
-                if given_password or (existing_user['userPassword'] != hashedPw.encode('utf-8')):
-                    response = ldap.sync_user_password(
-                        conn,
-                        username,
-                        (
-                            security_helpers.hash_password(given_password)
-                            if given_password
-                            else hashedPw
-                        ).encode('utf-8'),
-                    )
-                    try:
-                        ldap.validate_response_is_success(response)
-                    except ldap.LDAPCRUDError:
-                        logger.error(f'failed to edit user password for {username}({existing_user["uidNumber"]})')
-                        logger.error(f'{response}')
-                        summary['user_password_update_errors'] += 1
-
-                        should_continue = input("press y to continue importing: ")
-                        if should_continue.lower().strip() == 'y':
-                            logger.debug("continuing...")
-                            continue
-                        else:
-                            logger.debug("exiting...")
-                            break
-                    else:
-                        logger.info(f'{username}({uidNumber}) password has been updated')
-                        summary['users_password_updated'] += 1
-
-                continue
-
-            # Username does not exist: add user.
-            userPassword = (
-                security_helpers.hash_password(given_password)
-                if given_password
-                else hashedPw
+            user = user[:7]
+            change = _plan_user(
+                existing_users.get(user[0]),
+                user,
+                next(user_passwords),
+                bool(given_password),
             )
-            entry = ldap.create_posix_user_entry_dict(
+            if change is not None:
+                changes.append(change)
+
+    for group in tsv_stream.count_rows(
+        tsv_stream.iter_rows(posix_group_source),
+        summary,
+        'group_rows_read',
+    ):
+        change = _plan_group(existing_groups.get(group[0]), group[:3])
+        if change is not None:
+            changes.append(change)
+
+    summary.update('planned ' + change['action'] for change in changes)
+    json_path, ldif_path = change_plan.write_plan(
+        'load-tsv-plan',
+        changes,
+        {
+            'posix_user_tsv': tsv_stream.describe_source(posix_user_source),
+            'posix_group_tsv': tsv_stream.describe_source(posix_group_source),
+        },
+    )
+    logger.info(f"nothing has been written, plan saved to {json_path} and {ldif_path}")
+
+
+def _iter_user_passwords(
+    given_password: Optional[str],
+    hash_executor: Optional[Executor],
+    user_tsv_rows: List[List[str]],
+) -> Iterator[str]:
+    """ The password to set for each user row: a new hash of the
+        given password, otherwise the imported hash.
+    """
+    if given_password:
+        return security_helpers.hash_passwords(
+            repeat(given_password, len(user_tsv_rows)),
+            hash_executor,
+        )
+    return (user[3] for user in user_tsv_rows)
+
+
+def _plan_user(
+    existing_user: Optional[Dict],
+    user: List[str],
+    userPassword: str,
+    new_password: bool,
+) -> Optional[Dict]:
+    (
+        username,
+        uidNumber,
+        gidNumber,
+        hashedPw,
+        fullname,
+        homeDirectory,
+        loginShell,
+    ) = user
+    if existing_user is None:
+        return change_plan.add_posix_user(
+            username,
+            ldap.create_posix_user_entry_dict(
                 username,
                 uidNumber,
                 gidNumber,
                 fullname,
                 homeDirectory,
-                userPassword.encode('utf-8'),
+                userPassword,
                 loginShell,
-            )
-            response = ldap.add_posix_user(conn, username, entry)
-            try:
-                ldap.validate_response_is_success(response)
-            except ldap.LDAPCRUDError:
-                logger.error(f'failed to add user {username}')
-                logger.error(f'{response}')
-                summary['user_errors'] += 1
-
-                should_continue = input("press y to continue importing: ")
-                if should_continue.lower().strip() == 'y':
-                    logger.debug("continuing...")
-                    continue
-                else:
-                    logger.debug("exiting...")
-                    break
-            else:
-                logger.info(f'{username}({uidNumber}) has been added')
-                summary['users_added'] += 1
-
-
-        if len(group_tsv_rows):
-            logger.debug("adding groups")
-        for group in group_tsv_rows:
-            (
-                name,
-                gid,
-                members,
-            ) = group
-
-
-            if ldap.posix_group_exists(conn, name):
-                logger.info(
-                    f"not adding group {name}({gid}) cn already exists."
-                    + "Checking membership..."
-                )
-                summary['skipped_group_add <already exists>'] += 1
-
-                existing_group = ldap.get_posix_group(conn, name)
-                existing_members = set(existing_group.get('memberUid', []))
-                target_members = set(members.split(','))
-                changes_needed = len(
-                    target_members.symmetric_difference(existing_members)
-                ) > 0
-                if changes_needed:
-                    logger.info(
-                        f"updating members of group {name}({existing_group['gidNumber']})"
-                    )
-                    response = ldap.set_posix_group_members(
-                        conn, name, list(target_members),
-                    )
-                    try:
-                        ldap.validate_response_is_success(response)
-                    except ldap.LDAPCRUDError:
-                        logger.error(f'failed to modify group {name}')
-                        logger.error(f'{response}')
-                        summary['group_errors'] += 1
-
-                        should_continue = input("press y to continue importing: ")
-                        if should_continue.lower().strip() == 'y':
-                            logger.debug("continuing...")
-                            continue
-                        else:
-                            logger.debug("exiting...")
-                            break
-                    else:
-                        logger.info(f'{name}({gid}) has been added')
-                        summary['group_modified'] += 1
-                else:
-                    summary['skipped_group_modify <already up to date>'] += 1
-                    logger.debug("no membership changes needed")
-
-                continue
-
-            # create group if it doesn't exist
-            logger.info(f"adding group {name}({gid}) with members {members}")
-            entry = ldap.create_posix_group_entry_dict(
+            ),
+        )
+    if new_password or (existing_user['userPassword'] != hashedPw.encode('utf-8')):
+        return change_plan.sync_user_password(username, userPassword)
+    return None
+
+
+def _plan_group(
+    existing_group: Optional[Dict],
+    group: List[str],
+) -> Optional[Dict]:
+    (
+        name,
+        gid,
+        members,
+    ) = group
+    if existing_group is None:
+        return change_plan.add_posix_group(
+            name,
+            ldap.create_posix_group_entry_dict(
                 name,
                 int(gid),
                 _deduplicate_list(members.split(',')),
+            ),
+        )
+    existing_members = set(existing_group.get('memberUid', []))
+    target_members = set(members.split(','))
+    if target_members.symmetric_difference(existing_members):
+        return change_plan.set_posix_group_members(name, list(target_members))
+    return None
+
+
+def _call_all(*callbacks: Callable[[], None]) -> None:
+    for callback in callbacks:
+        callback()
+
+
+def _submit_change(
+    logger: Logger,
+    error_policy: ErrorPolicy,
+    summary: Counter,
+    window: OperationWindow,
+    row: List[str],
+    commit: Callable[[], None],
+    change: Dict,
+    label: str,
+    on_added: Optional[Callable[[], None]] = None,
+) -> None:
+    """ on_added is called after commit when an add succeeds,
+        it is not passed on to the change made when the entry already exists.
+    """
+    action = change['action']
+    success_key, success_message, error_key, error_message = _CHANGE_RESULTS[action]
+    already_exists_error = None
+    on_already_exists = None
+    if action == change_plan.ADD_POSIX_USER:
+        already_exists_error = ldap.PosixUserAlreadyExistsError
+        on_already_exists = _on_user_already_exists
+    elif action == change_plan.ADD_POSIX_GROUP:
+        already_exists_error = ldap.PosixGroupAlreadyExistsError
+        on_already_exists = _on_group_already_exists
+    if on_already_exists is not None:
+        on_already_exists = partial(
+            on_already_exists,
+            logger,
+            error_policy,
+            summary,
+            window,
+            row,
+            commit,
+            change,
+            label,
+        )
+    on_success = commit if on_added is None else partial(_call_all, commit, on_added)
+
+    window.submit(
+        change_plan.get_send(change),
+        result_handler(
+            logger,
+            summary,
+            error_policy,
+            row,
+            success_key,
+            success_message,
+            error_key,
+            error_message,
+            already_exists_error=already_exists_error,
+            on_already_exists=on_already_exists,
+            on_success=on_success,
+            message_args={'label': label, 'cn': change['cn']},
+        ),
+    )
+
+
+def _on_user_already_exists(
+    logger: Logger,
+    error_policy: ErrorPolicy,
+    summary: Counter,
+    window: OperationWindow,
+    row: List[str],
+    commit: Callable[[], None],
+    change: Dict,
+    label: str,
+) -> None:
+    # The user was added after the snapshot was read (or is listed twice).
+    logger.info("not adding user %s cn already exists", label, extra=ROW)
+    summary['skipped_user_add <already exists>'] += 1
+    _submit_change(
+        logger,
+        error_policy,
+        summary,
+        window,
+        row,
+        commit,
+        change_plan.sync_user_password(change['cn'], change['attrs']['userPassword']),
+        label,
+    )
+
+
+def _on_group_already_exists(
+    logger: Logger,
+    error_policy: ErrorPolicy,
+    summary: Counter,
+    window: OperationWindow,
+    row: List[str],
+    commit: Callable[[], None],
+    change: Dict,
+    label: str,
+) -> None:
+    # The group was added after the snapshot was read (or is listed twice).
+    logger.info("not adding group %s cn already exists. Setting membership...", label, extra=ROW)
+    summary['skipped_group_add <already exists>'] += 1
+    _submit_change(
+        logger,
+        error_policy,
+        summary,
+        window,
+        row,
+        commit,
+        change_plan.set_posix_group_members(change['cn'], change['attrs'].get('memberUid', [])),
+        label,
+    )
+
+
+def _load_users(
+    logger: Logger,
+    existing_users: Dict[str, Dict],
+    given_password: Optional[str],
+    hash_executor: Optional[Executor],
+    on_user_added: Optional[Callable[[str], None]],
+    error_policy: ErrorPolicy,
+    journal: ImportJournal,
+    window: OperationWindow,
+    user_tsv_rows: List[Tuple[int, List[str]]],
+    summary: Counter,
+) -> None:
+    if len(user_tsv_rows):
+        logger.debug("adding users")
+    user_passwords = _iter_user_passwords(
+        given_password,
+        hash_executor,
+        [user for _row_number, user in user_tsv_rows],
+    )
+    for row_number, user in user_tsv_rows:
+        if window.stopped:
+            break
+        # Rows from a rejects file have the LDAP result appended.
+        user = user[:7]
+        username, uidNumber = user[:2]
+        commit = partial(journal.commit, row_number)
+
+        existing_user = existing_users.get(username)
+        if existing_user is not None:
+            logger.info(
+                "not adding user %s(%s) cn already exists", username, uidNumber, extra=ROW,
             )
-            response = ldap.add_posix_group(
-                conn,
-                name,
-                entry,
+            summary['skipped_user_add <already exists>'] += 1
+
+        change = _plan_user(existing_user, user, next(user_passwords), bool(given_password))
+        if change is None:
+            commit()
+            continue
+        _submit_change(
+            logger,
+            error_policy,
+            summary,
+            window,
+            user,
+            commit,
+            change,
+            f'{username}({uidNumber})',
+            on_added=(
+                partial(on_user_added, username)
+                if on_user_added and change['action'] == change_plan.ADD_POSIX_USER
+                else None
+            ),
+        )
+
+
+def _load_groups(
+    logger: Logger,
+    existing_groups: Dict[str, Dict],
+    error_policy: ErrorPolicy,
+    journal: ImportJournal,
+    window: OperationWindow,
+    group_tsv_rows: List[Tuple[int, List[str]]],
+    summary: Counter,
+) -> None:
+    if len(group_tsv_rows):
+        logger.debug("adding groups")
+    for row_number, group in group_tsv_rows:
+        if window.stopped:
+            break
+        # Rows from a rejects file have the LDAP result appended.
+        group = group[:3]
+        (
+            name,
+            gid,
+            members,
+        ) = group
+        commit = partial(journal.commit, row_number)
+
+        existing_group = existing_groups.get(name)
+        if existing_group is not None:
+            logger.info(
+                "not adding group %s(%s) cn already exists. Checking membership...",
+                name, gid, extra=ROW,
             )
-            try:
-                ldap.validate_response_is_success(response)
-            except ldap.LDAPCRUDError:
-                logger.error(f'failed to add group {name}')
-                logger.error(f'{response}')
-                summary['group_errors'] += 1
-
-                should_continue = input("press y to continue importing: ")
-                if should_continue.lower().strip() == 'y':
-                    logger.debug("continuing...")
-                    continue
-                else:
-                    logger.debug("exiting...")
-                    break
-            else:
-                logger.info(f'{name}({gid}) has been added')
-                summary['groups_added'] += 1
+            summary['skipped_group_add <already exists>'] += 1
 
-    logger.info('\n* * * * Summary * * * *\n' + '\n'.join(f'{k}:  {summary[k]}' for k in summary))
-    logger.debug("bye")
+        change = _plan_group(existing_group, group)
+        if change is None:
+            summary['skipped_group_modify <already up to date>'] += 1
+            logger.debug("no membership changes needed", extra=ROW)
+            commit()
+            continue
+        if existing_group is not None:
+            logger.info(
+                "updating members of group %s(%s)", name, existing_group['gidNumber'], extra=ROW,
+            )
+        else:
+            logger.info("adding group %s(%s) with members %s", name, gid, members, extra=ROW)
+        _submit_change(
+            logger,
+            error_policy,
+            summary,
+            window,
+            group,
+            commit,
+            change,
+            f'{name}({gid})',
+        )
+
+
+def _apply_changes(
+    logger: Logger,
+    error_policy: ErrorPolicy,
+    journal: ImportJournal,
+    window: OperationWindow,
+    numbered_changes: List[Tuple[int, Dict]],
+    summary: Counter,
+) -> None:
+    for row_number, change in numbered_changes:
+        if window.stopped:
+            break
+        _submit_change(
+            logger,
+            error_policy,
+            summary,
+            window,
+            [json.dumps(change)],
+            partial(journal.commit, row_number),
+            change,
+            change['cn'],
+        )
@@ -0,0 +1,43 @@
+
+""" Provision home directories (see home_provisioning) for the users
+    of a posixUser interchange file, ie. users which were loaded
+    with load_tsv. add_users runs the same stage for new users.
+"""
+
+from logging import Logger
+from typing import (
+    Optional,
+    Tuple,
+)
+
+from common.home_provisioning import (
+    DEFAULT_HOME_BASE,
+    DEFAULT_SKEL_DIR,
+    PROVISION_WORKERS,
+    HomeProvisioner,
+    write_provisioning_report,
+)
+from common.script_logger import log_row_totals
+from common import tsv_stream
+
+
+def main(
+    logger: Logger,
+    posix_user_source: tsv_stream.RowSource,
+    skel_dir: str = DEFAULT_SKEL_DIR,
+    quota: Optional[Tuple[str, int, int]] = None,
+    dry_run_root: Optional[str] = None,
+    workers: int = PROVISION_WORKERS,
+    home_base: str = DEFAULT_HOME_BASE,
+) -> None:
+    logger.debug("provision_homes::main()")
+    if dry_run_root is not None:
+        logger.info(f"dry run, home directories are created below {dry_run_root}")
+
+    provisioner = HomeProvisioner(logger, skel_dir, quota, dry_run_root, home_base)
+    results = provisioner.provision_many(tsv_stream.iter_rows(posix_user_source), workers)
+    summary = write_provisioning_report(logger, results)
+
+    log_row_totals(logger)
+    logger.info('\n* * * * Summary * * * *\n' + '\n'.join(f'{k}:  {summary[k]}' for k in summary))
+    logger.debug("bye")
@@ -0,0 +1,65 @@
+
+""" Load unix passwd, shadow, and group files straight into LDAP database.
+    Rows are parsed as in unix_to_tsv and streamed in-process into
+    the load_tsv write logic, no intermediate .tsv files are read.
+    With tee=True a copy of the rows is written to posixUser/posixGroup
+    .tsv files for auditing.
+
+    Streamed rows can not be resumed (see import_journal.NullJournal),
+    loads are idempotent so an interrupted sync can simply be run again.
+"""
+
+from logging import Logger
+
+from common.error_policy import PROMPT
+from common.file_wrapper import OutputFileWrapper
+from common.line_reader import iter_lines
+from common import tsv_stream
+from scripts.load_tsv import main as load_tsv
+from scripts.unix_to_tsv import (
+    iter_records,
+    write_dangling_references_report,
+)
+
+
+def main(
+    logger: Logger,
+    passwd_file_name: str,
+    shadow_file_name: str,
+    group_file_name: str,
+    window_size: int = 1,
+    workers: int = 1,
+    on_error: str = PROMPT,
+    drop_dangling: bool = False,
+    tee: bool = False,
+    plan: bool = False,
+) -> None:
+    logger.info("unix_to_ldap::main()")
+    logger.info("passwd file " + passwd_file_name)
+    logger.info("shadow file " + shadow_file_name)
+    logger.info("group file " + group_file_name)
+
+    user_rows, group_rows, references = iter_records(
+        logger,
+        iter_lines(passwd_file_name),
+        iter_lines(shadow_file_name),
+        iter_lines(group_file_name),
+        drop_dangling,
+    )
+    if tee:
+        posix_user_output = OutputFileWrapper('posixUser', 'tsv')
+        posix_group_output = OutputFileWrapper('posixGroup', 'tsv')
+        logger.info(f"writing a copy of the rows to {posix_user_output.full_path} and {posix_group_output.full_path}")
+        user_rows = tsv_stream.tee_rows(user_rows, posix_user_output)
+        group_rows = tsv_stream.tee_rows(group_rows, posix_group_output)
+
+    load_tsv(
+        logger,
+        user_rows,
+        group_rows,
+        window_size=window_size,
+        workers=workers,
+        on_error=on_error,
+        plan=plan,
+    )
+    write_dangling_references_report(logger, references, drop_dangling)
@@ -13,12 +13,48 @@ Consolidate unix passwd, shadow, and group
 
     These 2 files holding interchange formatted data
     can be imported into OpenLDAP using 'object_load' script.
+
+    The source files are read line by line, straight from disk, in a
+    single pass: shadow is indexed first, then passwd and group rows are
+    written out as they are read.
+
+    Group members which are not exported users, and primary gids which
+    are not exported groups, are dangling references. They are found
+    with hash-set indexes built during the same pass, written to a
+    dangling-references report, and members can be dropped.
+
+    The 2 files can also be written as row stores (see row_store).
+
+    Each export writes a manifest of row digests (see export_manifest).
+    Given the manifest of an earlier export, only rows which were added
+    or changed are written, removed rows are listed in removed reports.
+
+    Several hosts can be exported at once, given many passwd/shadow/group
+    triples or a directory holding 1 sub directory per host. Each host
+    is parsed in a worker process, then rows are merged (see unix_merge)
+    into 1 deduplicated pair of files and uid/gid conflicts are reported.
 """
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import csv
+from functools import partial
 from logging import Logger
+import os
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
 
-from common.command_runner import CommandRunner
-from common.file_wrapper import OutputFileWrapper
+from common.export_manifest import ExportManifest
+from common.file_wrapper import BaseFileWrapper, OutputFileWrapper
+from common.line_reader import iter_lines
+from common import row_store
+from common.unix_merge import MergeIndex
 from common.unix_indexes import (
     ShadowLineIXs,
     PasswdLineIXs,
@@ -33,127 +69,378 @@ GROUPS_TO_SKIP = frozenset([
     'pkcs11',
 ])
 
-def _build_output(
-    logger: Logger,
-    posix_user_output: OutputFileWrapper,
-    posix_group_output: OutputFileWrapper,
-    passwd_text: str,
-    shadow_text: str,
-    group_text: str,
-):
 
-    # create map of {username => shadow data, ....}
-    username_shadow_map = {}
+class ReferenceIndex:
+    """ Indexes of exported usernames and of the gids of exported groups.
+    """
+
+    def __init__(self):
+        self.usernames: Set[str] = set()
+        self.gids: Set[str] = set()
+        self.dangling_members: List[List[str]] = []
+        self._usernames_by_primary_gid: Dict[str, List[str]] = defaultdict(list)
+
+    def add_user(self, username: str, gid: str) -> None:
+        self.usernames.add(username)
+        self._usernames_by_primary_gid[gid].append(username)
 
-    for shadow_line in shadow_text.split("\n"):
+    def add_gid(self, gid: str) -> None:
+        self.gids.add(gid)
+
+    def check_members(self, group_name: str, members: List[str]) -> List[str]:
+        """ Record and return the members which are not exported users.
+        """
+        dangling = [m for m in members if m not in self.usernames]
+        self.dangling_members.extend([group_name, m] for m in dangling)
+        return dangling
+
+    def iter_dangling_primary_gids(self) -> Iterator[List[str]]:
+        """ Yield [username, gid] for users whose primary gid is not an exported group
+            (ie. missing from the group file, skipped, or without members).
+            Only complete once every group line has been read.
+        """
+        for gid, usernames in self._usernames_by_primary_gid.items():
+            if gid not in self.gids:
+                yield from ([username, gid] for username in usernames)
+
+
+def _index_shadow(
+    logger: Logger,
+    shadow_lines: Iterable[str],
+) -> Dict[str, str]:
+    """ Map of {username => hashed password, ...}
+        Only the hashes are kept, this is the only index held in memory.
+    """
+    username_hash_map = {}
+    for shadow_line in shadow_lines:
         shadow_line_parts = shadow_line.split(":")
         if len(shadow_line_parts) != 9:
             continue
         if not shadow_line_parts[ShadowLineIXs.HASHED_PASSWORD].startswith("$"):
             continue
-        if shadow_line_parts[ShadowLineIXs.USER_NAME] in username_shadow_map:
+        if shadow_line_parts[ShadowLineIXs.USER_NAME] in username_hash_map:
             logger.warning("found duplicate shadow entry")
             continue
-        username_shadow_map[shadow_line_parts[ShadowLineIXs.USER_NAME]] = shadow_line_parts
+        username_hash_map[shadow_line_parts[ShadowLineIXs.USER_NAME]] = (
+            shadow_line_parts[ShadowLineIXs.HASHED_PASSWORD]
+        )
+    return username_hash_map
 
-    # create a map of {username -> uid}
-    username_to_uids_map = {}
 
-    # Process passwd/shadow data into rows of PosixUsers
-    with posix_user_output as fp:
-
-        user_writer = csv.writer(fp, delimiter='\t')
-
-        for passwd_line in passwd_text.split("\n"):
-            passwd_line_parts = passwd_line.split(":")
-            if len(passwd_line_parts) != 7:
-                logger.warning(
-                    f"skipping passwd line. Unexpected number of line parts: {passwd_line_parts}"
-                )
-                continue
-
-            if passwd_line_parts[PasswdLineIXs.PLAINTEXT_PASSWORD] != 'x':
-                logger.warning(
-                    f"skipping passwd line. Unexpected plaintext password found"
-                )
-                continue
-
-            if int(passwd_line_parts[PasswdLineIXs.USER_UID]) < 1000:
-                continue
-
-            shadow_parts = username_shadow_map.get(passwd_line_parts[PasswdLineIXs.USER_NAME])
-            if shadow_parts is None:
-                logger.warning(
-                    f"skipping passwd line. could not find corresponding shadow entry"
-                )
-                continue
-
-            user_writer.writerow([
-                passwd_line_parts[PasswdLineIXs.USER_NAME],
-                passwd_line_parts[PasswdLineIXs.USER_UID],
-                passwd_line_parts[PasswdLineIXs.USER_GROUP_GUID],
-                shadow_parts[ShadowLineIXs.HASHED_PASSWORD],
-                passwd_line_parts[PasswdLineIXs.USER_DETAILS],
-                passwd_line_parts[PasswdLineIXs.HOME_DIRECTORY],
-                passwd_line_parts[PasswdLineIXs.LOGIN_SHELL],
-            ])
-
-    # Process passwd/group data into rows of PosixGroups
-    with posix_group_output as fp:
-        group_writer = csv.writer(fp, delimiter='\t')
-
-        for group_line in group_text.split("\n"):
-            group_line_parts = group_line.split(":")
-            if len(group_line_parts) != 4:
-                logger.warning(
-                    f"skipping group line. has incorrect number of parts: {group_line_parts}"
-                )
-                continue
-
-            if group_line_parts[GroupLineIXs.GROUP_NAME] in GROUPS_TO_SKIP:
-                continue
-
-            if not group_line_parts[GroupLineIXs.GROUP_MEMBERS].strip():
-                # Group has no members
-                continue
-
-            #tsv columns: group-name, group-uid, member-uids
-            group_writer.writerow([
+def _iter_user_rows(
+    logger: Logger,
+    passwd_lines: Iterable[str],
+    username_hash_map: Dict[str, str],
+    references: ReferenceIndex,
+) -> Iterator[List[str]]:
+    """ Join passwd lines against the shadow index, yielding PosixUser rows.
+    """
+    for passwd_line in passwd_lines:
+        passwd_line_parts = passwd_line.split(":")
+        if len(passwd_line_parts) != 7:
+            logger.warning(
+                f"skipping passwd line. Unexpected number of line parts: {passwd_line_parts}"
+            )
+            continue
+
+        if passwd_line_parts[PasswdLineIXs.PLAINTEXT_PASSWORD] != 'x':
+            logger.warning(
+                f"skipping passwd line. Unexpected plaintext password found"
+            )
+            continue
+
+        if int(passwd_line_parts[PasswdLineIXs.USER_UID]) < 1000:
+            continue
+
+        hashed_password = username_hash_map.get(passwd_line_parts[PasswdLineIXs.USER_NAME])
+        if hashed_password is None:
+            logger.warning(
+                f"skipping passwd line. could not find corresponding shadow entry"
+            )
+            continue
+
+        references.add_user(
+            passwd_line_parts[PasswdLineIXs.USER_NAME],
+            passwd_line_parts[PasswdLineIXs.USER_GROUP_GUID],
+        )
+        #tsv columns: user-name uid guid hashed-password user-details home-directory login-shell
+        yield [
+            passwd_line_parts[PasswdLineIXs.USER_NAME],
+            passwd_line_parts[PasswdLineIXs.USER_UID],
+            passwd_line_parts[PasswdLineIXs.USER_GROUP_GUID],
+            hashed_password,
+            passwd_line_parts[PasswdLineIXs.USER_DETAILS],
+            passwd_line_parts[PasswdLineIXs.HOME_DIRECTORY],
+            passwd_line_parts[PasswdLineIXs.LOGIN_SHELL],
+        ]
+
+
+def _iter_group_rows(
+    logger: Logger,
+    group_lines: Iterable[str],
+    references: ReferenceIndex,
+    drop_dangling: bool,
+) -> Iterator[List[str]]:
+    for group_line in group_lines:
+        group_line_parts = group_line.split(":")
+        if len(group_line_parts) != 4:
+            logger.warning(
+                f"skipping group line. has incorrect number of parts: {group_line_parts}"
+            )
+            continue
+
+        if group_line_parts[GroupLineIXs.GROUP_NAME] in GROUPS_TO_SKIP:
+            continue
+
+        if not group_line_parts[GroupLineIXs.GROUP_MEMBERS].strip():
+            # Group has no members
+            continue
+
+        #tsv columns: group-name, group-uid, member-uids
+        group_row = _check_group_row(
+            logger,
+            [
                 group_line_parts[GroupLineIXs.GROUP_NAME],
                 group_line_parts[GroupLineIXs.GROUP_GUID],
                 group_line_parts[GroupLineIXs.GROUP_MEMBERS],
-            ])
+            ],
+            references,
+            drop_dangling,
+        )
+        if group_row is not None:
+            yield group_row
+
+
+def _check_group_row(
+    logger: Logger,
+    group_row: List[str],
+    references: ReferenceIndex,
+    drop_dangling: bool,
+) -> Optional[List[str]]:
+    """ Check the members of a PosixGroup row, dropping dangling members when asked.
+        None is returned when every member was dropped. The gid of a
+        returned row is recorded as exported.
+    """
+    group_name, gid, members = group_row
+    dangling = references.check_members(group_name, members.split(','))
+    if dangling and drop_dangling:
+        members = ','.join(m for m in members.split(',') if m not in dangling)
+        if not members:
+            logger.warning(
+                f"skipping group. every member is dangling: {group_row}"
+            )
+            return None
+    references.add_gid(gid)
+    return [group_name, gid, members]
+
+
+def iter_records(
+    logger: Logger,
+    passwd_lines: Iterable[str],
+    shadow_lines: Iterable[str],
+    group_lines: Iterable[str],
+    drop_dangling: bool = False,
+) -> Tuple[Iterator[List[str]], Iterator[List[str]], ReferenceIndex]:
+    """ Index shadow, then return generators of PosixUser and PosixGroup rows.
+        The user rows must be consumed before the group rows.
+        The reference index is complete once both have been consumed.
+    """
+    username_hash_map = _index_shadow(logger, shadow_lines)
+    references = ReferenceIndex()
+    return (
+        _iter_user_rows(logger, passwd_lines, username_hash_map, references),
+        _iter_group_rows(logger, group_lines, references, drop_dangling),
+        references,
+    )
+
+
+def _build_output(
+    logger: Logger,
+    posix_user_output: BaseFileWrapper,
+    posix_group_output: BaseFileWrapper,
+    passwd_lines: Iterable[str],
+    shadow_lines: Iterable[str],
+    group_lines: Iterable[str],
+    drop_dangling: bool = False,
+    manifest: Optional[ExportManifest] = None,
+) -> ReferenceIndex:
+    """ Single pass over each input. The shadow index is built first,
+        then rows are written as the passwd and group lines are read.
+    """
+    user_rows, group_rows, references = iter_records(
+        logger, passwd_lines, shadow_lines, group_lines, drop_dangling,
+    )
+    _write_rows(posix_user_output, posix_group_output, user_rows, group_rows, manifest)
+    return references
+
+
+def _write_rows(
+    posix_user_output: BaseFileWrapper,
+    posix_group_output: BaseFileWrapper,
+    user_rows: Iterable[List[str]],
+    group_rows: Iterable[List[str]],
+    manifest: Optional[ExportManifest] = None,
+) -> None:
+    # Process passwd/shadow data into rows of PosixUsers
+    with row_store.open_writer(posix_user_output) as writer:
+        writer.writerows(
+            manifest.track('posixUser', user_rows) if manifest else user_rows
+        )
+
+    # Process group data into rows of PosixGroups
+    with row_store.open_writer(posix_group_output) as writer:
+        writer.writerows(
+            manifest.track('posixGroup', group_rows) if manifest else group_rows
+        )
+
+
+def _parse_source(
+    logger: Logger,
+    source: Tuple[str, str, str],
+) -> Tuple[List[List[str]], List[List[str]]]:
+    """ Parse one host's passwd, shadow, and group files (runs in a worker process).
+        Members are checked once every host has been merged.
+    """
+    passwd_file_name, shadow_file_name, group_file_name = source
+    user_rows, group_rows, _references = iter_records(
+        logger,
+        iter_lines(passwd_file_name),
+        iter_lines(shadow_file_name),
+        iter_lines(group_file_name),
+    )
+    # user rows are consumed 1st, see iter_records()
+    return list(user_rows), list(group_rows)
+
+
+def _merge_sources(
+    logger: Logger,
+    sources: List[Tuple[str, str, str]],
+    workers: Optional[int] = None,
+) -> MergeIndex:
+    """ Parse each host in a process pool and merge the rows in source order,
+        so the 1st source listed wins a conflict. User conflicts name the
+        passwd file of a host, group conflicts its group file.
+    """
+    merge = MergeIndex()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        parsed_sources = executor.map(partial(_parse_source, logger), sources)
+        for (passwd_file_name, _shadow, group_file_name), (user_rows, group_rows) in zip(
+            sources, parsed_sources,
+        ):
+            logger.info(
+                f"merging {len(user_rows)} users from {passwd_file_name}"
+                + f" and {len(group_rows)} groups from {group_file_name}"
+            )
+            for row in user_rows:
+                merge.add_user(row, passwd_file_name)
+            for row in group_rows:
+                merge.add_group(row, group_file_name)
+    return merge
+
+
+def _iter_merged_records(
+    logger: Logger,
+    merge: MergeIndex,
+    drop_dangling: bool,
+) -> Tuple[Iterator[List[str]], Iterator[List[str]], ReferenceIndex]:
+    """ As iter_records(), over the merged rows of every host.
+    """
+    references = ReferenceIndex()
+
+    def iter_user_rows():
+        for row in merge.iter_user_rows():
+            references.add_user(row[0], row[2])
+            yield row
+
+    def iter_group_rows():
+        for row in merge.iter_group_rows():
+            group_row = _check_group_row(logger, row, references, drop_dangling)
+            if group_row is not None:
+                yield group_row
+
+    return iter_user_rows(), iter_group_rows(), references
+
+
+def find_sources(sources_dir: str) -> List[Tuple[str, str, str]]:
+    """ (passwd, shadow, group) paths of each sub directory of sources_dir
+        holding the 3 files, sorted by directory name.
+    """
+    sources = []
+    for host_dir in sorted(os.scandir(sources_dir), key=lambda entry: entry.name):
+        paths = tuple(os.path.join(host_dir.path, name) for name in ('passwd', 'shadow', 'group'))
+        if host_dir.is_dir() and all(os.path.isfile(path) for path in paths):
+            sources.append(paths)
+    return sources
+
+
+def write_dangling_references_report(
+    logger: Logger,
+    references: ReferenceIndex,
+    drop_dangling: bool,
+) -> None:
+    dangling_primary_gids = list(references.iter_dangling_primary_gids())
+    logger.info(f"dangling group members: {len(references.dangling_members)}")
+    logger.info(f"users with a dangling primary gid: {len(dangling_primary_gids)}")
+    if not references.dangling_members and not dangling_primary_gids:
+        return
+
+    report = OutputFileWrapper('dangling-references', 'tsv')
+    with report as fp:
+        writer = csv.writer(fp, delimiter='\t')
+        #tsv columns: attribute, entry-name, missing-value, action
+        writer.writerows(
+            ['memberUid', group_name, member, 'dropped' if drop_dangling else 'kept']
+            for group_name, member in references.dangling_members
+        )
+        writer.writerows(
+            ['gidNumber', username, gid, 'kept']
+            for username, gid in dangling_primary_gids
+        )
+    logger.warning(f"dangling references written to {report.full_path}")
+
 
 def main(
     logger: Logger,
-    passwd_file_name,
-    shadow_file_name,
-    group_file_name,
+    sources: List[Tuple[str, str, str]],
+    drop_dangling: bool = False,
+    since_manifest: Optional[str] = None,
+    output_format: str = 'tsv',
+    workers: Optional[int] = None,
 ) -> None:
     logger.info("unix_to_tsv::main()")
-    logger.info("passwd file " + passwd_file_name)
-    logger.info("shadow file " + shadow_file_name)
-    logger.info("group file " + group_file_name)
-
-    posix_user_output = OutputFileWrapper('posixUser', 'tsv')
-    posix_group_output = OutputFileWrapper('posixGroup', 'tsv')
-    cat_passwd_cmd = CommandRunner(f'cat {passwd_file_name}')
-    cat_shadow_cmd = CommandRunner(f'cat {shadow_file_name}')
-    cat_group_cmd = CommandRunner(f'cat {group_file_name}')
-
-    try:
-        _build_output(
+    for passwd_file_name, shadow_file_name, group_file_name in sources:
+        logger.info("passwd file " + passwd_file_name)
+        logger.info("shadow file " + shadow_file_name)
+        logger.info("group file " + group_file_name)
+
+    if since_manifest:
+        logger.info("exporting changes since manifest " + since_manifest)
+    manifest = ExportManifest(since_manifest)
+    posix_user_output = OutputFileWrapper('posixUser', output_format)
+    posix_group_output = OutputFileWrapper('posixGroup', output_format)
+
+    if len(sources) == 1:
+        passwd_file_name, shadow_file_name, group_file_name = sources[0]
+        references = _build_output(
             logger,
             posix_user_output,
             posix_group_output,
-            cat_passwd_cmd.read_result(),
-            cat_shadow_cmd.read_result(),
-            cat_group_cmd.read_result(),
+            iter_lines(passwd_file_name),
+            iter_lines(shadow_file_name),
+            iter_lines(group_file_name),
+            drop_dangling,
+            manifest,
         )
-    except Exception:
-        raise
-    finally:
-        logger.info("deleting cat output files...")
-        cat_passwd_cmd.delete_results()
-        cat_shadow_cmd.delete_results()
-        cat_group_cmd.delete_results()
+    else:
+        merge = _merge_sources(logger, sources, workers)
+        user_rows, group_rows, references = _iter_merged_records(logger, merge, drop_dangling)
+        _write_rows(posix_user_output, posix_group_output, user_rows, group_rows, manifest)
+        merge.write_conflict_report(logger)
+        if merge.summary:
+            logger.info('\n* * * * Merge Summary * * * *\n' + '\n'.join(f'{k}:  {merge.summary[k]}' for k in merge.summary))
+
+    write_dangling_references_report(logger, references, drop_dangling)
+    logger.info(f"manifest written to {manifest.output.full_path}")
+    if manifest.is_delta:
+        manifest.write_removed_reports(logger)
+        logger.info('\n* * * * Summary * * * *\n' + '\n'.join(f'{k}:  {manifest.summary[k]}' for k in manifest.summary))
@@ -0,0 +1,76 @@
+
+""" Fakes for the loader tests: the sends a loader submits to a real
+    OperationWindow run against a FakeConnection, and the rows the
+    loader commits are recorded by a RecordingJournal.
+"""
+
+from types import SimpleNamespace
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+from unittest.mock import MagicMock
+
+from ldap3.core.results import (
+    RESULT_ENTRY_ALREADY_EXISTS,
+    RESULT_INSUFFICIENT_ACCESS_RIGHTS,
+)
+
+from common.error_policy import CONTINUE
+from common.import_journal import NullJournal
+from common.ldap_pipeline import OperationWindow
+
+
+SUCCESS = {'result': 0, 'description': 'success'}
+ENTRY_ALREADY_EXISTS = {'result': RESULT_ENTRY_ALREADY_EXISTS, 'description': 'entryAlreadyExists'}
+INSUFFICIENT_ACCESS = {'result': RESULT_INSUFFICIENT_ACCESS_RIGHTS, 'description': 'insufficientAccessRights'}
+
+
+class FakeConnection:
+    """ Synchronous connection which records the adds and modifies sent to it.
+        results maps (operation, cn) to the LDAP result of that write,
+        writes which are not listed succeed.
+    """
+
+    strategy = SimpleNamespace(sync=True)
+
+    def __init__(self, results: Optional[Dict[Tuple[str, str], Dict]] = None):
+        self.results = results if results else {}
+        # (operation, cn, attributes or changes) of every write, in the order they were sent.
+        self.writes: List[Tuple[str, str, Dict]] = []
+        self.result = None
+
+    def add(self, dn: str, _object_class: List[str], attrs: Dict) -> bool:
+        return self._write('add', dn, attrs)
+
+    def modify(self, dn: str, changes: Dict) -> bool:
+        return self._write('modify', dn, changes)
+
+    def _write(self, operation: str, dn: str, values: Dict) -> bool:
+        cn = dn.split(',', 1)[0].split('=', 1)[1]
+        self.writes.append((operation, cn, values))
+        self.result = self.results.get((operation, cn), SUCCESS)
+        return self.result is SUCCESS
+
+
+class RecordingJournal(NullJournal):
+
+    def __init__(self):
+        self.committed_rows: List[int] = []
+
+    def commit(self, row_number: int) -> None:
+        self.committed_rows.append(row_number)
+
+
+def new_window(results: Optional[Dict[Tuple[str, str], Dict]] = None) -> OperationWindow:
+    """ Window of 1 over a FakeConnection, see window.conn.writes.
+    """
+    return OperationWindow(FakeConnection(results), 1)
+
+
+def new_error_policy(action: str = CONTINUE) -> MagicMock:
+    """ Error policy which answers action for every failed row.
+    """
+    return MagicMock(on_error=MagicMock(return_value=action))
@@ -0,0 +1,100 @@
+from collections import Counter
+import csv
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from common.file_wrapper import TMPFileWrapper
+from scripts import add_users
+
+
+class TestAddUsers(TestCase):
+
+    def test_roster_users_get_reserved_ids_passwords_and_private_groups(self):
+        # Arrange
+        existing_users = {'taken': {}}
+        existing_groups = {'staff': {}}
+        roster = [
+            ['jdoe', 'Jane Doe'],
+            ['taken', 'Already There'],
+            ['Bad Name', 'Invalid'],
+            ['rroe', 'Rick Roe', '/bin/zsh'],
+            ['jdoe', 'Jane Doe'],
+        ]
+        loaded = {}
+
+        def load_tsv(logger, user_rows, group_rows, on_user_added, **kwargs):
+            loaded['users'] = list(user_rows)
+            for user in loaded['users']:
+                on_user_added(user[0])
+            loaded['groups'] = list(group_rows)
+
+        notices = TMPFileWrapper()
+        # Act
+        with (
+            patch.object(add_users, 'read_snapshot', return_value=(existing_users, existing_groups)),
+            patch.object(add_users, '_reserve_ids', return_value=([1001, 1002], [1002, 1003])),
+            patch.object(add_users, 'load_tsv', side_effect=load_tsv),
+            patch.object(add_users, 'OutputFileWrapper', return_value=notices),
+        ):
+            add_users.main(MagicMock(), iter(roster), provision_homes=False)
+        with open(*notices.read_args) as f:
+            notice_rows = list(csv.reader(f, delimiter='\t'))
+        notices.remove()
+        # Assert
+        self.assertEqual([user[:3] for user in loaded['users']], [
+            ['jdoe', '1001', '1002'],
+            ['rroe', '1002', '1003'],
+        ])
+        self.assertTrue(all(user[3].startswith('{crypt}$6$') for user in loaded['users']))
+        self.assertEqual(loaded['users'][1][5:], ['/home/rroe', '/bin/zsh'])
+        self.assertEqual(loaded['groups'], [['jdoe', '1002', 'jdoe'], ['rroe', '1003', 'rroe']])
+        self.assertEqual([row[0] for row in notice_rows], ['jdoe', 'rroe'])
+        self.assertEqual(len(notice_rows[0][3]), 10)
+
+    def test_used_ids_are_taken_from_the_snapshot(self):
+        used_uids, used_gids = add_users._used_ids(
+            {'jdoe': {'uidNumber': 1001, 'gidNumber': 1001}, 'rroe': {'uidNumber': '1002', 'gidNumber': 100}},
+            {'staff': {'gidNumber': 1005}, 'empty': {}},
+        )
+        self.assertEqual(used_uids, {1001, 1002})
+        self.assertEqual(used_gids, {100, 1001, 1005})
+
+    def test_rejected_users_get_no_notice_group_or_home(self):
+        # Arrange
+        roster = [['jdoe', 'Jane Doe'], ['rroe', 'Rick Roe']]
+        loaded = {}
+
+        def load_tsv(logger, user_rows, group_rows, on_user_added, **kwargs):
+            # rroe is rejected by the directory
+            for user in user_rows:
+                if user[0] == 'jdoe':
+                    on_user_added(user[0])
+            loaded['groups'] = list(group_rows)
+
+        notices = TMPFileWrapper()
+        provisioner = MagicMock()
+        provisioner.provision_many.side_effect = lambda users, workers: [
+            [user[0], user[5], 'provisioned', '', ''] for user in users
+        ]
+        # Act
+        with (
+            patch.object(add_users, 'read_snapshot', return_value=({}, {})),
+            patch.object(add_users, '_reserve_ids', return_value=([1001, 1002], [1001, 1002])),
+            patch.object(add_users, 'load_tsv', side_effect=load_tsv),
+            patch.object(add_users, 'OutputFileWrapper', return_value=notices),
+            patch.object(add_users, 'HomeProvisioner', return_value=provisioner),
+            patch.object(add_users, 'write_provisioning_report', side_effect=lambda logger, results: Counter(
+                f'home_directories_{user}' for user, *_ in results
+            )) as write_provisioning_report,
+        ):
+            add_users.main(MagicMock(), iter(roster))
+        with open(*notices.read_args) as f:
+            notice_rows = list(csv.reader(f, delimiter='\t'))
+        notices.remove()
+        # Assert
+        self.assertEqual([row[0] for row in notice_rows], ['jdoe'])
+        self.assertEqual(loaded['groups'], [['jdoe', '1001', 'jdoe']])
+        self.assertEqual(
+            [result[0] for result in write_provisioning_report.call_args.args[1]],
+            ['jdoe'],
+        )
@@ -0,0 +1,65 @@
+
+import json
+import os
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from common import change_plan
+from common import ldap_helpers as ldap
+
+
+class TestChangePlan(TestCase):
+
+    def setUp(self):
+        self.changes = [
+            change_plan.add_posix_user('jdoe', ldap.create_posix_user_entry_dict(
+                'jdoe', '1001', 1001, 'Jane Doe', '/home/jdoe', '{CRYPT}$6$salt$hash', '/bin/bash',
+            )),
+            change_plan.sync_user_password('rroe', '{CRYPT}$6$salt$newhash'),
+            change_plan.set_posix_group_members('staff', ['jdoe', 'rroe']),
+        ]
+        self.paths = []
+
+    def tearDown(self):
+        for path in self.paths:
+            os.remove(path)
+
+    def test_plan_is_saved_as_json_and_ldif(self):
+        # Act
+        self.paths = change_plan.write_plan('test-plan', self.changes, {'posix_user_tsv': 'users.tsv'})
+        json_path, ldif_path = self.paths
+        # Assert
+        plan = change_plan.read_plan(json_path)
+        self.assertEqual(plan['changes'], self.changes)
+        self.assertEqual(plan['counts'][change_plan.ADD_POSIX_USER], 1)
+        self.assertEqual(plan['counts'][change_plan.ADD_POSIX_GROUP], 0)
+        with open(ldif_path) as f:
+            ldif = f.read()
+        self.assertIn(f'dn: {ldap._get_posix_user_dn("jdoe")}\nchangetype: add\n', ldif)
+        self.assertIn('replace: userPassword\nuserPassword: {CRYPT}$6$salt$newhash\n', ldif)
+        self.assertIn('replace: memberUid\nmemberUid: jdoe\nmemberUid: rroe\n', ldif)
+
+    def test_send_encodes_passwords(self):
+        # Arrange
+        conn = MagicMock()
+        conn.strategy.sync = True
+        # Act
+        change_plan.get_send(self.changes[0])(conn)
+        change_plan.get_send(self.changes[1])(conn)
+        # Assert
+        self.assertEqual(conn.add.call_args.args[2]['userPassword'], b'{CRYPT}$6$salt$hash')
+        self.assertEqual(self.changes[0]['attrs']['userPassword'], '{CRYPT}$6$salt$hash')
+        conn.search.assert_not_called()
+        self.assertEqual(
+            conn.modify.call_args.args[1],
+            {'userPassword': [(ldap.MODIFY_REPLACE, [b'{CRYPT}$6$salt$newhash'])]},
+        )
+
+    def test_other_files_are_not_plans(self):
+        # Arrange
+        self.paths = change_plan.write_plan('test-plan', [], {})
+        with open(self.paths[0], 'w') as f:
+            json.dump({'version': 0}, f)
+        # Act / Assert
+        with self.assertRaises(change_plan.InvalidChangePlanError):
+            change_plan.read_plan(self.paths[0])
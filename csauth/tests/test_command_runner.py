@@ -1,8 +1,15 @@
 
 import os
+import subprocess
 from unittest import TestCase
 
-from common.command_runner import CommandRunner, NonZeroExitCodeError
+from common.command_runner import (
+    CommandRunner,
+    CommandTimeoutError,
+    NonZeroExitCodeError,
+    SubprocessRunner,
+    run_many,
+)
 import settings
 
 class TestCommandRunner(TestCase):
@@ -55,3 +62,44 @@ class TestCommandRunner(TestCase):
         cmd.run_command()
         # Assert
         self.assertRaises(NonZeroExitCodeError, cmd.raise_for_exit_code)
+
+
+class TestSubprocessRunner(TestCase):
+
+    def test_subprocess_runner_captures_output_without_tmp_files(self):
+        # Arrange
+        start_file_count = len(os.listdir(settings.TMP_DIR))
+        # Act
+        cmd = SubprocessRunner("echo 'hello world'; echo 'oops' >&2")
+        # Assert
+        self.assertEqual(len(os.listdir(settings.TMP_DIR)), start_file_count)
+        self.assertEqual(cmd.read_result(), 'hello world\noops\n')
+        cmd.delete_results()
+
+    def test_subprocess_runner_can_time_out(self):
+        # Arrange
+        cmd = SubprocessRunner("sleep 5", run_now=False, timeout=0.1)
+        # Act, Assert
+        self.assertRaises(CommandTimeoutError, cmd.run_command)
+        self.assertTrue(cmd.timed_out)
+        cmd.delete_results()
+
+    def test_finished_command_is_not_killed_as_timed_out(self):
+        # Arrange
+        cmd = SubprocessRunner("true", run_now=False, get_output=False, timeout=5)
+        process = subprocess.Popen("true", shell=True, start_new_session=True)
+        process.wait()
+        # Act
+        cmd._kill(process)
+        # Assert
+        self.assertFalse(cmd.timed_out)
+
+    def test_run_many_returns_a_runner_per_command_in_order(self):
+        # Act
+        runners = run_many(["echo 1", "false", "echo 3"], max_workers=2)
+        # Assert
+        self.assertEqual([r.exit_code for r in runners], [0, 1, 0])
+        self.assertEqual(runners[2].read_result(), '3\n')
+        self.assertRaises(NonZeroExitCodeError, runners[1].raise_for_exit_code)
+        for runner in runners:
+            runner.delete_results()
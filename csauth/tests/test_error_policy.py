@@ -0,0 +1,57 @@
+
+import csv
+import logging
+import os
+from unittest import TestCase
+
+from common import error_policy as ep
+
+
+class TestErrorPolicy(TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger('test-error-policy')
+        self.failed_result = {'result': 50, 'description': 'insufficientAccessRights', 'message': ''}
+
+    def test_policies_are_parsed(self):
+        self.assertEqual(ep.parse_error_policy('continue'), (ep.CONTINUE, 0))
+        self.assertEqual(ep.parse_error_policy('abort'), (ep.ABORT, 0))
+        self.assertEqual(ep.parse_error_policy('retry:3'), (ep.RETRY, 3))
+        for invalid in ('retry', 'retry:0', 'retry:x', 'continue:1', 'skip'):
+            self.assertRaises(ep.InvalidErrorPolicyError, ep.parse_error_policy, invalid)
+
+    def test_retry_policy_retries_then_continues(self):
+        with ep.ErrorPolicy(self.logger, 'retry:2', 'test-rejects') as policy:
+            actions = [
+                policy.on_error(['row'], self.failed_result, attempts)
+                for attempts in (1, 2, 3)
+            ]
+        try:
+            self.assertEqual(actions, [ep.RETRY, ep.RETRY, ep.CONTINUE])
+        finally:
+            os.remove(policy.rejects_path)
+
+    def test_abort_policy_aborts(self):
+        with ep.ErrorPolicy(self.logger, 'abort', 'test-rejects') as policy:
+            action = policy.on_error(['row'], self.failed_result, 1)
+        try:
+            self.assertEqual(action, ep.ABORT)
+        finally:
+            os.remove(policy.rejects_path)
+
+    def test_rejected_rows_are_written_with_ldap_result(self):
+        # Act
+        with ep.ErrorPolicy(self.logger, 'continue', 'test-rejects') as policy:
+            policy.on_error(['derpy', '1001'], self.failed_result, 1)
+        # Assert
+        try:
+            with open(policy.rejects_path) as f:
+                rows = list(csv.reader(f, delimiter='\t'))
+            self.assertEqual(rows, [['derpy', '1001', '50', 'insufficientAccessRights', '']])
+        finally:
+            os.remove(policy.rejects_path)
+
+    def test_rejects_file_is_not_created_without_rejects(self):
+        with ep.ErrorPolicy(self.logger, 'continue', 'test-rejects') as policy:
+            pass
+        self.assertIsNone(policy.rejects_path)
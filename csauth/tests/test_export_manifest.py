@@ -0,0 +1,47 @@
+
+from unittest import TestCase
+
+from common.export_manifest import ExportManifest, read_manifest
+
+
+class TestExportManifest(TestCase):
+
+    def setUp(self):
+        self.manifests = []
+
+    def tearDown(self):
+        for manifest in self.manifests:
+            manifest.output.remove()
+
+    def _export(self, rows, previous_manifest_path=None):
+        manifest = ExportManifest(previous_manifest_path)
+        self.manifests.append(manifest)
+        return manifest, list(manifest.track('posixUser', rows))
+
+    def test_full_export_passes_every_row(self):
+        # Act
+        manifest, rows = self._export([['jdoe', '1001'], ['rroe', '1002']])
+        # Assert
+        self.assertEqual(rows, [['jdoe', '1001'], ['rroe', '1002']])
+        self.assertEqual(
+            set(read_manifest(manifest.output.full_path)['posixUser']),
+            {'jdoe', 'rroe'},
+        )
+        self.assertFalse(manifest.is_delta)
+
+    def test_delta_export_passes_added_and_changed_rows(self):
+        # Arrange
+        previous, _rows = self._export([['jdoe', '1001'], ['rroe', '1002'], ['gone', '1003']])
+        # Act
+        manifest, rows = self._export(
+            [['jdoe', '1001'], ['rroe', '2002'], ['new', '1004']],
+            previous.output.full_path,
+        )
+        # Assert
+        self.assertEqual(rows, [['rroe', '2002'], ['new', '1004']])
+        self.assertEqual(manifest.removed, {'posixUser': ['gone']})
+        self.assertEqual(manifest.summary['posixUser_unchanged'], 1)
+        self.assertEqual(
+            set(read_manifest(manifest.output.full_path)['posixUser']),
+            {'jdoe', 'rroe', 'new'},
+        )
@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from common.home_provisioning import (
+    EXISTS,
+    FAILED,
+    PROVISIONED,
+    HomeProvisioner,
+)
+import settings
+
+
+class TestHomeProvisioner(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(dir=settings.TMP_DIR)
+        self.skel = os.path.join(self.root, 'skel')
+        os.makedirs(self.skel)
+        with open(os.path.join(self.skel, '.bashrc'), 'w') as f:
+            f.write('# bashrc\n')
+        os.makedirs(os.path.join(self.root, 'home', 'existing'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_dry_run_provisions_users_below_the_root(self):
+        # Arrange
+        provisioner = HomeProvisioner(
+            MagicMock(),
+            skel_dir=self.skel,
+            quota=('/home', 1000, 2000),
+            dry_run_root=self.root,
+        )
+        users = [
+            ['jdoe', '1001', '100', '$6$a', 'Jane Doe', '/home/jdoe', '/bin/bash'],
+            ['existing', '1002', '100', '$6$b', 'Existing', '/home/existing', '/bin/bash'],
+            ['relative', '1003', '100', '$6$c', 'Relative', 'home/relative', '/bin/bash'],
+        ]
+        # Act
+        results = provisioner.provision_many(users, workers=2)
+        # Assert
+        self.assertEqual([status for _u, _h, status, *_ in results], [PROVISIONED, EXISTS, FAILED])
+        self.assertTrue(os.path.isfile(os.path.join(self.root, 'home', 'jdoe', '.bashrc')))
+        self.assertEqual(os.stat(os.path.join(self.root, 'home', 'jdoe')).st_mode & 0o777, 0o700)
+
+    def test_dry_run_does_not_escape_the_root(self):
+        # Arrange
+        provisioner = HomeProvisioner(MagicMock(), skel_dir=self.skel, dry_run_root=self.root)
+        user = ['evil', '1004', '100', '$6$d', 'Evil', '/../../escaped', '/bin/bash']
+        # Act
+        result = provisioner.provision(user)
+        # Assert
+        self.assertEqual(result[2:4], [FAILED, 'mkdir'])
+        self.assertFalse(os.path.exists(os.path.join(os.path.dirname(os.path.dirname(self.root)), 'escaped')))
+
+    def test_existing_home_is_completed_without_copying_skel(self):
+        # Arrange
+        existing = os.path.join(self.root, 'home', 'existing')
+        os.chmod(existing, 0o755)
+        provisioner = HomeProvisioner(MagicMock(), skel_dir=self.skel, dry_run_root=self.root)
+        user = ['existing', '1002', '100', '$6$b', 'Existing', '/home/existing', '/bin/bash']
+        # Act
+        result = provisioner.provision(user)
+        # Assert
+        self.assertEqual(result[2], EXISTS)
+        self.assertEqual(os.stat(existing).st_mode & 0o777, 0o700)
+        self.assertFalse(os.path.exists(os.path.join(existing, '.bashrc')))
+
+    def test_homes_outside_the_home_base_are_rejected(self):
+        provisioner = HomeProvisioner(MagicMock(), skel_dir=self.skel)
+        for home in ('/home/../etc/x', '/home', '/srv/jdoe'):
+            user = ['jdoe', '1001', '100', '$6$a', 'Jane Doe', home, '/bin/bash']
+            self.assertEqual(provisioner.provision(user)[2:4], [FAILED, 'mkdir'])
+
+    def test_quota_is_set_by_uid(self):
+        provisioner = HomeProvisioner(MagicMock(), skel_dir=self.skel, quota=('/home', 1000, 2000))
+        steps = {
+            step: command
+            for step, command, _dry_run in provisioner._steps('1001', '100', '/home/jdoe', True)
+        }
+        self.assertEqual(list(steps), ['chmod', 'chown', 'quota'])
+        self.assertEqual(steps['quota'], 'setquota -u 1001 1000 2000 0 0 /home')
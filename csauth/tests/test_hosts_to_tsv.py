@@ -0,0 +1,66 @@
+from collections import Counter
+import os
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+import uuid
+
+from common.row_store import RowStore
+from scripts.hosts_to_tsv import (
+    HostIndex,
+    iter_host_rows,
+    main as hosts_to_tsv,
+    parse_host_line,
+)
+import settings
+
+
+class TestHostsToTSV(TestCase):
+
+    def test_host_lines_split_on_any_whitespace(self):
+        self.assertEqual(
+            parse_host_line('10.0.0.1  web1.example.com\tweb1 www  # web server'),
+            ['10.0.0.1', 'web1.example.com', 'web1'],
+        )
+        self.assertEqual(
+            parse_host_line('2001:db8:0::1 db1.example.com db1'),
+            ['2001:db8::1', 'db1.example.com', 'db1'],
+        )
+        self.assertIsNone(parse_host_line('# 10.0.0.1 old.example.com old'))
+        self.assertIsNone(parse_host_line('127.0.0.1 localhost'))
+        self.assertIsNone(parse_host_line('not-an-ip host.example.com host'))
+
+    def test_aliases_are_deduplicated_across_files(self):
+        # Arrange
+        hosts_files = {
+            'hosts-a': ['10.0.0.1 web1.example.com web1', '10.0.0.2 db1.example.com db1'],
+            'hosts-b': ['10.0.0.1 web1.example.com web1', '10.0.0.9 db1.example.com db1'],
+        }
+        index = HostIndex()
+        summary = Counter()
+        # Act
+        with patch('scripts.hosts_to_tsv.iter_lines', side_effect=hosts_files.get):
+            rows = list(iter_host_rows(MagicMock(), hosts_files, index, summary))
+        # Assert
+        self.assertEqual(rows, [
+            ['10.0.0.1', 'web1.example.com', 'web1'],
+            ['10.0.0.2', 'db1.example.com', 'db1'],
+        ])
+        self.assertEqual(index.conflicts, [['db1', '10.0.0.2', 'hosts-a', '10.0.0.9', 'hosts-b']])
+        self.assertEqual(summary['duplicate_aliases'], 1)
+        self.assertEqual(summary['conflicting_aliases'], 1)
+
+    def test_host_row_stores_are_found_by_alias(self):
+        # Arrange
+        path = os.path.join(settings.TMP_DIR, f'{uuid.uuid4()}.sqlite')
+        hosts_files = {'hosts-a': ['10.0.0.1 web1.example.com web1', '10.0.0.2 db1.example.com db1']}
+        # Act
+        with (
+            patch('scripts.hosts_to_tsv.iter_lines', side_effect=hosts_files.get),
+            patch('scripts.hosts_to_tsv.OutputFileWrapper', return_value=MagicMock(full_path=path)),
+        ):
+            hosts_to_tsv(MagicMock(), list(hosts_files), output_format='sqlite')
+        with RowStore(path) as store:
+            row = store.get('db1')
+        os.remove(path)
+        # Assert
+        self.assertEqual(row, ['10.0.0.2', 'db1.example.com', 'db1'])
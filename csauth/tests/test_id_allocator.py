@@ -0,0 +1,62 @@
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from common.id_allocator import (
+    GID_NUMBER,
+    UID_NUMBER,
+    IdAllocator,
+    IdMap,
+    IdsExhaustedError,
+)
+
+
+class TestIdMap(TestCase):
+
+    def test_free_ids_are_found_sparse_or_contiguous(self):
+        # Arrange
+        id_map = IdMap({1000, 1001, 1003, 1006}, first_id=1000, last_id=1010)
+        # Act, Assert
+        self.assertEqual(id_map.find(3, 1000), [1002, 1004, 1005])
+        self.assertEqual(id_map.find(3, 1000, contiguous=True), [1007, 1008, 1009])
+        self.assertEqual(id_map.find(2, 1005), [1005, 1007])
+        id_map.mark([1002, 1004])
+        self.assertEqual(id_map.find(1, 1000), [1005])
+        self.assertRaises(IdsExhaustedError, id_map.find, 5, 1000, True)
+
+
+class TestIdAllocator(TestCase):
+
+    @patch('common.id_allocator.ldap')
+    def test_reservation_retries_above_the_counter_after_losing_the_race(self, ldap):
+        # Arrange
+        ldap.get_id_counter.side_effect = [
+            {UID_NUMBER: 1000, GID_NUMBER: 1000},
+            # another run reserved 1000-1004 in the meantime
+            {UID_NUMBER: 1005, GID_NUMBER: 1000},
+        ]
+        ldap.get_used_ids.return_value = ({1001}, set())
+        ldap.advance_id_counter.side_effect = [False, True]
+        allocator = IdAllocator(MagicMock())
+        # Act
+        uids = allocator.reserve(UID_NUMBER, 3)
+        # Assert
+        self.assertEqual(uids, [1005, 1006, 1007])
+        self.assertEqual(
+            [call.args[1:] for call in ldap.advance_id_counter.call_args_list],
+            [(UID_NUMBER, 1000, 1004), (UID_NUMBER, 1005, 1008)],
+        )
+        ldap.add_id_counter.assert_not_called()
+
+    @patch('common.id_allocator.ldap')
+    def test_used_ids_of_a_snapshot_are_not_read_again(self, ldap):
+        # Arrange
+        ldap.get_id_counter.return_value = {UID_NUMBER: 1000, GID_NUMBER: 1000}
+        ldap.advance_id_counter.return_value = True
+        allocator = IdAllocator(MagicMock(), used_ids=({1000, 1001}, {1000}))
+        # Act
+        uids = allocator.reserve(UID_NUMBER, 2)
+        gids = allocator.reserve(GID_NUMBER, 2)
+        # Assert
+        self.assertEqual(uids, [1002, 1003])
+        self.assertEqual(gids, [1001, 1002])
+        ldap.get_used_ids.assert_not_called()
@@ -0,0 +1,56 @@
+
+import os.path
+from unittest import TestCase
+
+from common.file_wrapper import TMPFileWrapper
+from common.import_journal import ImportJournal
+
+
+class TestImportJournal(TestCase):
+
+    def setUp(self):
+        self.tsv_file = TMPFileWrapper()
+        with self.tsv_file as f:
+            f.write(''.join(f'user{ix}\t{1000 + ix}\n' for ix in range(4)))
+
+    def tearDown(self):
+        self.tsv_file.remove()
+
+    def test_resume_skips_committed_rows(self):
+        # Arrange
+        rows = [(1, ['a']), (2, ['b']), (3, ['c']), (4, ['d'])]
+        with ImportJournal(self.tsv_file.full_path) as journal:
+            journal.commit(1)
+            journal.commit(3)
+        # Act
+        resumed = ImportJournal(self.tsv_file.full_path, resume=True)
+        try:
+            remaining = list(resumed.skip_committed(rows))
+        finally:
+            resumed.remove()
+        # Assert
+        self.assertEqual(resumed.committed, {1, 3})
+        self.assertEqual(remaining, [(2, ['b']), (4, ['d'])])
+        self.assertFalse(os.path.exists(resumed.full_path))
+
+    def test_partially_written_row_number_is_ignored(self):
+        # Arrange
+        with ImportJournal(self.tsv_file.full_path) as journal:
+            journal.commit(1)
+        with open(journal.full_path, 'a') as f:
+            f.write('2')
+        # Act
+        resumed = ImportJournal(self.tsv_file.full_path, resume=True)
+        resumed.remove()
+        # Assert
+        self.assertEqual(resumed.committed, {1})
+
+    def test_without_resume_journal_starts_empty(self):
+        # Arrange
+        with ImportJournal(self.tsv_file.full_path) as journal:
+            journal.commit(1)
+        # Act
+        restarted = ImportJournal(self.tsv_file.full_path)
+        restarted.remove()
+        # Assert
+        self.assertEqual(restarted.committed, set())
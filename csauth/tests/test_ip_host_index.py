@@ -0,0 +1,67 @@
+from datetime import datetime, timezone
+import os
+from unittest import TestCase
+import uuid
+
+from common.ip_host_index import IPHostIndex
+import settings
+
+
+class TestIPHostIndex(TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(settings.TMP_DIR, f'{uuid.uuid4()}.index.json')
+        index = IPHostIndex(self.path)
+        index.update({
+            'web1': {'ipHostNumber': '10.12.0.5', 'modifyTimestamp': '20260101000000Z'},
+            'web2': {'ipHostNumber': '10.12.7.1', 'modifyTimestamp': '20260102000000Z'},
+            'db1': {'ipHostNumber': ['10.13.0.1', '2001:db8::1'], 'modifyTimestamp': '20260101000000Z'},
+        })
+        index.save()
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_addresses_and_cidr_ranges_are_looked_up(self):
+        index = IPHostIndex(self.path)
+        self.assertEqual(index.modified_since, '20260102000000Z')
+        self.assertEqual(index.aliases_of('10.12.7.1'), ['web2'])
+        self.assertEqual(index.aliases_of('2001:db8:0::1'), ['db1'])
+        self.assertEqual(list(index.iter_network('10.12.0.0/16')), [
+            ('10.12.0.5', 'web1'), ('10.12.7.1', 'web2'),
+        ])
+        self.assertEqual(list(index.iter_network('2001:db8::/32')), [('2001:db8::1', 'db1')])
+        self.assertEqual(len(list(index.iter_network('0.0.0.0/0'))), 3)
+
+    def test_incremental_refresh_updates_and_drops_hosts(self):
+        # Arrange
+        index = IPHostIndex(self.path)
+        modified = datetime(2026, 2, 1, tzinfo=timezone.utc)
+        # Act
+        updated, removed = index.update(
+            {'web1': {'ipHostNumber': '10.14.0.5', 'modifyTimestamp': modified}},
+            {'web1', 'db1'},
+        )
+        # Assert
+        self.assertEqual((updated, removed), (1, 1))
+        self.assertEqual(index.modified_since, '20260201000000Z')
+        self.assertEqual(list(index.iter_network('10.12.0.0/16')), [])
+        self.assertEqual(index.aliases_of('10.14.0.5'), ['web1'])
+
+    def test_built_index_is_loaded_without_rebuilding(self):
+        # Arrange
+        empty_path = os.path.join(settings.TMP_DIR, f'{uuid.uuid4()}.index.json')
+        empty = IPHostIndex(empty_path)
+        empty.update({}, set())
+        empty.save()
+        # Act
+        index = IPHostIndex(self.path)
+        reloaded_empty = IPHostIndex(empty_path)
+        os.remove(empty_path)
+        # Assert
+        self.assertTrue(index.built)
+        self.assertEqual(list(index.iter_network('10.13.0.0/16')), [('10.13.0.1', 'db1')])
+        # An empty ou=hosts was refreshed, it does not need a full refresh.
+        self.assertTrue(reloaded_empty.built)
+        self.assertIsNone(reloaded_empty.modified_since)
+        self.assertFalse(IPHostIndex(empty_path).built)
@@ -1,6 +1,6 @@
 
 from unittest import TestCase
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 from common import ldap_helpers as ldap
 
@@ -36,3 +36,152 @@ class TestLDAPHelpers(TestCase):
                 'attr2': ['lorum', 'ipsum'],
                 'memberUid': ['derpy'], # single value not popped from list
         })
+
+    def test_paged_search_index_is_keyed_by_cn(self):
+        conn = MagicMock()
+        conn.extend.standard.paged_search.return_value = iter([
+            {
+                'type': 'searchResEntry',
+                'dn': 'cn=derpy,ou=people,ou=linuxlab,dc=example,dc=com',
+                'attributes': {
+                    'objectClass': ['top', 'posixAccount'],
+                    'cn': ['derpy'],
+                    'uidNumber': 1001, # single valued attribute, not a list
+                },
+            },
+            {'type': 'searchResRef', 'uri': ['ldap://elsewhere']},
+        ])
+        index = ldap.get_posix_user_index(conn)
+        self.assertEqual(index, {
+            'derpy': {
+                'objectClass': ['top', 'posixAccount'],
+                'cn': 'derpy',
+                'uidNumber': 1001,
+            },
+        })
+
+
+class TestConnectionPool(TestCase):
+
+    def test_released_connections_are_reused(self):
+        # Arrange
+        conn = MagicMock(bound=True, closed=False)
+        pool = ldap.ConnectionPool()
+        with patch.object(ldap, 'new_connection', return_value=conn) as new_connection:
+            # Act
+            with pool.checkout() as first:
+                pass
+            with pool.checkout() as second:
+                pass
+        # Assert
+        self.assertIs(first, second)
+        self.assertEqual(new_connection.call_count, 1)
+
+    def test_unhealthy_connections_are_discarded(self):
+        # Arrange
+        stale_conn = MagicMock(bound=True, closed=False)
+        fresh_conn = MagicMock(bound=True, closed=False)
+        pool = ldap.ConnectionPool()
+        with patch.object(ldap, 'new_connection', side_effect=[stale_conn, fresh_conn]):
+            with pool.checkout():
+                pass
+            stale_conn.closed = True
+            # Act
+            with pool.checkout() as conn:
+                pass
+        # Assert
+        self.assertIs(conn, fresh_conn)
+        stale_conn.unbind.assert_called_once()
+
+    def test_connections_are_discarded_when_checkout_raises(self):
+        # Arrange
+        conn = MagicMock(bound=True, closed=False)
+        pool = ldap.ConnectionPool()
+        with patch.object(ldap, 'new_connection', return_value=conn):
+            # Act
+            with self.assertRaises(RuntimeError):
+                with pool.checkout():
+                    raise RuntimeError
+        # Assert
+        conn.unbind.assert_called_once()
+        pool.close()
+        conn.unbind.assert_called_once()
+
+
+class TestValidateResponse(TestCase):
+
+    def test_success_response_does_not_raise(self):
+        ldap.validate_response_is_success({'result': 0, 'description': 'success'})
+
+    def test_entry_already_exists_raises_given_error(self):
+        with self.assertRaises(ldap.PosixUserAlreadyExistsError):
+            ldap.validate_response_is_success(
+                {'result': 68, 'description': 'entryAlreadyExists'},
+                ldap.PosixUserAlreadyExistsError,
+            )
+
+    def test_optimistic_add_does_not_check_existence(self):
+        conn = MagicMock()
+        conn.strategy.sync = True
+        ldap.add_ip_host(conn, 'lab-01', '10.0.0.1', optimistic=True)
+        conn.search.assert_not_called()
+        conn.add.assert_called_once()
+
+
+class TestIdCounter(TestCase):
+
+    def test_counter_is_advanced_with_a_test_and_set_modify(self):
+        # Arrange
+        conn = MagicMock(result={'result': 0, 'description': 'success'})
+        # Act
+        advanced = ldap.advance_id_counter(conn, 'uidNumber', 1000, 1004)
+        # Assert
+        self.assertTrue(advanced)
+        conn.modify.assert_called_once_with(ldap._get_id_counter_dn(), {
+            'uidNumber': [
+                (ldap.MODIFY_DELETE, ['1000']),
+                (ldap.MODIFY_ADD, ['1004']),
+            ],
+        })
+
+    def test_counter_moved_by_another_run_is_not_advanced(self):
+        conn = MagicMock(result={'result': 16, 'description': 'noSuchAttribute'})
+        self.assertFalse(ldap.advance_id_counter(conn, 'uidNumber', 1000, 1004))
+
+
+class TestCachedTls(TestCase):
+
+    def test_ssl_context_keeps_tls_settings(self):
+        # Arrange
+        tls = ldap._CachedTls(
+            validate=ldap.ssl.CERT_NONE,
+            ssl_options=[ldap.ssl.OP_NO_TICKET],
+            ciphers='ECDHE-RSA-AES128-GCM-SHA256',
+            sni='ldap.example.com',
+        )
+        connection = MagicMock()
+        raw_socket = connection.socket
+        # Act
+        with patch.object(ldap.ssl.SSLContext, 'wrap_socket') as wrap_socket:
+            tls.wrap_socket(connection)
+        ssl_context = tls._get_ssl_context()
+        # Assert
+        self.assertTrue(ssl_context.options & ldap.ssl.OP_NO_TICKET)
+        self.assertIn('ECDHE-RSA-AES128-GCM-SHA256', [c['name'] for c in ssl_context.get_ciphers()])
+        self.assertEqual(wrap_socket.call_args.args, (raw_socket,))
+        self.assertEqual(wrap_socket.call_args.kwargs['server_hostname'], 'ldap.example.com')
+
+
+class TestConnectionHealth(TestCase):
+
+    def test_idle_async_connections_are_pinged(self):
+        # Arrange
+        conn = MagicMock(bound=True, closed=False)
+        conn.strategy.sync = False
+        conn.extended.return_value = 7
+        conn.get_response.return_value = ([], {'result': 0, 'description': 'success'})
+        # Act, Assert
+        self.assertTrue(ldap._connection_is_healthy(conn, ldap.POOL_PING_AFTER_SECONDS + 1))
+        conn.get_response.assert_called_once_with(7, timeout=ldap.POOL_PING_TIMEOUT_SECONDS)
+        conn.get_response.side_effect = ldap.LDAPException
+        self.assertFalse(ldap._connection_is_healthy(conn, ldap.POOL_PING_AFTER_SECONDS + 1))
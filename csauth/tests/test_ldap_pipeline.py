@@ -0,0 +1,182 @@
+
+from collections import Counter
+from logging import Logger
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from common import ldap_helpers as ldap
+from common.error_policy import ABORT, CONTINUE, RETRY
+from common.file_wrapper import TMPFileWrapper
+from common.ldap_pipeline import OperationWindow, import_rows, run_in_workers
+
+
+def _new_async_conn() -> MagicMock:
+    conn = MagicMock()
+    conn.strategy.sync = False
+    conn.get_response.side_effect = lambda message_id: (
+        [], {'description': 'success', 'message_id': message_id},
+    )
+    return conn
+
+def _new_sync_conn(**_kwargs) -> MagicMock:
+    conn = MagicMock(bound=True, closed=False)
+    conn.strategy.sync = True
+    return conn
+
+def _send(message_id):
+    return lambda conn: message_id
+
+
+class TestOperationWindow(TestCase):
+
+    def test_window_keeps_operations_in_flight_until_full(self):
+        # Arrange
+        conn = _new_async_conn()
+        results = []
+        window = OperationWindow(conn, 3)
+        # Act
+        window.submit(_send(1), lambda r: results.append(r['message_id']) or CONTINUE)
+        window.submit(_send(2), lambda r: results.append(r['message_id']) or CONTINUE)
+        # Assert
+        self.assertEqual(results, [])
+        window.submit(_send(3), lambda r: results.append(r['message_id']) or CONTINUE)
+        self.assertEqual(results, [1])
+
+    def test_window_collects_results_by_message_id_in_order_when_drained(self):
+        # Arrange
+        conn = _new_async_conn()
+        results = []
+        # Act
+        with OperationWindow(conn, 10) as window:
+            for message_id in (5, 6, 7):
+                window.submit(
+                    _send(message_id),
+                    lambda r: results.append(r['message_id']) or CONTINUE,
+                )
+        # Assert
+        self.assertEqual(results, [5, 6, 7])
+        self.assertEqual(
+            [c.args[0] for c in conn.get_response.call_args_list], [5, 6, 7])
+
+    def test_window_handles_results_immediately_for_sync_connections(self):
+        # Arrange
+        conn = _new_sync_conn()
+        results = []
+        window = OperationWindow(conn, 10)
+        # Act
+        window.submit(
+            lambda conn: {'description': 'success'},
+            lambda r: results.append(r) or CONTINUE,
+        )
+        # Assert
+        self.assertEqual(results, [{'description': 'success'}])
+        conn.get_response.assert_not_called()
+
+    def test_window_is_stopped_when_callback_aborts(self):
+        # Arrange
+        conn = _new_async_conn()
+        window = OperationWindow(conn, 1)
+        # Act
+        window.submit(_send(1), lambda r: ABORT)
+        # Assert
+        self.assertTrue(window.stopped)
+
+    def test_window_resends_operation_when_callback_retries(self):
+        # Arrange
+        conn = _new_sync_conn()
+        send = MagicMock(return_value={'description': 'busy'})
+        actions = iter([RETRY, RETRY, CONTINUE])
+        # Act
+        with OperationWindow(conn, 1) as window:
+            window.submit(send, lambda r: next(actions))
+        # Assert
+        self.assertEqual(send.call_count, 3)
+        self.assertFalse(window.stopped)
+
+
+class TestRunInWorkers(TestCase):
+
+    def test_worker_summaries_are_merged(self):
+        # Arrange
+        def _load_rows(window, rows, summary):
+            summary['rows'] += len(rows)
+            summary['sum'] += sum(rows)
+        # Act
+        with (
+            patch.dict(ldap._connection_pools, clear=True),
+            patch.object(ldap, 'new_connection', side_effect=_new_sync_conn),
+        ):
+            summary = run_in_workers(
+                [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]], 3, 1, _load_rows)
+        # Assert
+        self.assertEqual(summary, Counter({'rows': 10, 'sum': 45}))
+
+    def test_workers_without_rows_do_not_connect(self):
+        with (
+            patch.dict(ldap._connection_pools, clear=True),
+            patch.object(ldap, 'new_connection', side_effect=_new_sync_conn) as new_connection,
+        ):
+            summary = run_in_workers([[1]], 4, 1, lambda w, rows, s: None)
+        self.assertEqual(summary, Counter())
+        self.assertEqual(new_connection.call_count, 1)
+
+    def test_remaining_chunks_are_skipped_once_stopped(self):
+        # Arrange
+        def _load_rows(window, rows, summary):
+            summary['rows'] += len(rows)
+            window.submit(lambda conn: {}, lambda r: ABORT)
+        # Act
+        with (
+            patch.dict(ldap._connection_pools, clear=True),
+            patch.object(ldap, 'new_connection', side_effect=_new_sync_conn),
+        ):
+            summary = run_in_workers(([ix] for ix in range(100)), 1, 1, _load_rows)
+        # Assert
+        self.assertLess(summary['rows'], 100)
+
+    def test_worker_errors_are_raised(self):
+        def _load_rows(window, rows, summary):
+            raise RuntimeError
+        with (
+            patch.dict(ldap._connection_pools, clear=True),
+            patch.object(ldap, 'new_connection', side_effect=_new_sync_conn),
+        ):
+            with self.assertRaises(RuntimeError):
+                run_in_workers(([ix] for ix in range(100)), 2, 1, _load_rows)
+
+
+class TestImportRows(TestCase):
+
+    def test_stopped_import_resumes_after_committed_rows(self):
+        # Arrange
+        tsv_file = TMPFileWrapper()
+        with tsv_file as f:
+            f.write(''.join(f'host{ix}\n' for ix in range(6)))
+        loaded = []
+        abort_at = ['host3']
+        def _load_rows(error_policy, journal, window, rows, summary):
+            for row_number, row in rows:
+                if row == abort_at:
+                    window.submit(lambda conn: {}, lambda r: ABORT)
+                    return
+                loaded.append(row[0])
+                journal.commit(row_number)
+        run_import = lambda resume: import_rows(
+            MagicMock(spec=Logger), Counter(), tsv_file.full_path, 'rows_read',
+            'test-rejects', _load_rows, 1, 1, CONTINUE, resume,
+        )
+        # Act
+        try:
+            with (
+                patch.dict(ldap._connection_pools, clear=True),
+                patch.object(ldap, 'new_connection', side_effect=_new_sync_conn),
+            ):
+                first_run_completed = run_import(False)
+                abort_at.clear()
+                second_run_completed = run_import(True)
+        finally:
+            tsv_file.remove()
+        # Assert
+        self.assertFalse(first_run_completed)
+        self.assertTrue(second_run_completed)
+        self.assertEqual(loaded, [f'host{ix}' for ix in range(6)])
@@ -0,0 +1,25 @@
+
+from unittest import TestCase
+
+from common.file_wrapper import TMPFileWrapper
+from common.line_reader import iter_lines
+
+
+class TestLineReader(TestCase):
+
+    def test_lines_are_read_without_line_endings(self):
+        # Arrange
+        source_file = TMPFileWrapper()
+        with source_file as f:
+            f.write('root:x:0:0:root:/root:/bin/bash\n\njdoe:x:1001:1001::/home/jdoe:/bin/sh')
+        # Act
+        try:
+            lines = list(iter_lines(source_file.full_path, buffer_size=8))
+        finally:
+            source_file.remove()
+        # Assert
+        self.assertEqual(lines, [
+            'root:x:0:0:root:/root:/bin/bash',
+            '',
+            'jdoe:x:1001:1001::/home/jdoe:/bin/sh',
+        ])
@@ -0,0 +1,97 @@
+from collections import Counter
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from scripts.load_hosts_tsv import (
+    _index_aliases_by_ip,
+    _load_hosts,
+)
+from tests.ldap_fakes import (
+    ENTRY_ALREADY_EXISTS,
+    INSUFFICIENT_ACCESS,
+    RecordingJournal,
+    new_error_policy,
+    new_window,
+)
+
+
+class TestLoadHostsTSV(TestCase):
+
+    def test_reconcile_only_sends_adds_and_changed_addresses(self):
+        # Arrange
+        existing_hosts = {
+            'web1': {'cn': 'web1', 'ipHostNumber': '10.0.0.1'},
+            'db1': {'cn': 'db1', 'ipHostNumber': '10.0.0.2'},
+            'v6': {'cn': 'v6', 'ipHostNumber': '2001:db8:0:0::1'},
+        }
+        rows = [
+            (1, ['10.0.0.1', 'web1.example.com', 'web1']),
+            (2, ['10.0.0.9', 'db1.example.com', 'db1']),
+            (3, ['10.0.0.1', 'www.example.com', 'www']),
+            (4, ['2001:db8::1', 'v6.example.com', 'v6']),
+        ]
+        window = new_window()
+        journal = RecordingJournal()
+        summary = Counter()
+        collisions = []
+        # Act
+        _load_hosts(
+            MagicMock(),
+            existing_hosts,
+            _index_aliases_by_ip(existing_hosts),
+            collisions,
+            new_error_policy(),
+            journal,
+            window,
+            rows,
+            summary,
+        )
+        # Assert
+        self.assertEqual(window.conn.writes, [
+            ('modify', 'db1', {'ipHostNumber': [('MODIFY_REPLACE', ['10.0.0.9'])]}),
+            ('add', 'www', {'cn': 'www', 'ipHostNumber': '10.0.0.1'}),
+        ])
+        self.assertEqual(summary, Counter({
+            'skipping_host_already_added': 2,
+            'hosts_with_ip_collision': 1,
+            'hosts_address_updated': 1,
+            'hosts_added': 1,
+        }))
+        self.assertEqual(collisions, [['www', '10.0.0.1', 'web1', 'add']])
+        self.assertEqual(journal.committed_rows, [1, 2, 3, 4])
+
+    def test_adds_without_a_snapshot_skip_existing_hosts(self):
+        # Arrange
+        rows = [
+            (1, ['10.0.0.1', 'web1.example.com', 'web1']),
+            (2, ['10.0.0.2', 'db1.example.com', 'db1']),
+            (3, ['10.0.0.3', 'www.example.com', 'www']),
+        ]
+        window = new_window({
+            ('add', 'web1'): ENTRY_ALREADY_EXISTS,
+            ('add', 'db1'): INSUFFICIENT_ACCESS,
+        })
+        journal = RecordingJournal()
+        summary = Counter()
+        # Act
+        _load_hosts(
+            MagicMock(),
+            None,
+            None,
+            [],
+            new_error_policy(),
+            journal,
+            window,
+            rows,
+            summary,
+        )
+        # Assert
+        self.assertEqual([(operation, cn) for operation, cn, _values in window.conn.writes], [
+            ('add', 'web1'), ('add', 'db1'), ('add', 'www'),
+        ])
+        self.assertEqual(summary, Counter({
+            'skipping_host_already_added': 1,
+            'add_host_errors': 1,
+            'hosts_added': 1,
+        }))
+        self.assertEqual(journal.committed_rows, [1, 3])
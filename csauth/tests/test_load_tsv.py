@@ -0,0 +1,130 @@
+
+from collections import Counter
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from scripts.load_tsv import (
+    _load_groups,
+    _load_users,
+)
+from tests.ldap_fakes import (
+    ENTRY_ALREADY_EXISTS,
+    INSUFFICIENT_ACCESS,
+    RecordingJournal,
+    new_error_policy,
+    new_window,
+)
+
+
+class TestLoadTSV(TestCase):
+
+    def _load_users(self, existing_users, rows, window, on_user_added=None):
+        journal = RecordingJournal()
+        summary = Counter()
+        _load_users(
+            MagicMock(),
+            existing_users,
+            None,
+            None,
+            on_user_added,
+            new_error_policy(),
+            journal,
+            window,
+            rows,
+            summary,
+        )
+        return journal, summary
+
+    def test_users_are_diffed_against_the_snapshot(self):
+        # Arrange
+        existing_users = {
+            'same': {'cn': 'same', 'userPassword': b'{crypt}$6$same'},
+            'changed': {'cn': 'changed', 'userPassword': b'{crypt}$6$old'},
+        }
+        rows = [
+            (1, ['same', '1001', '1001', '{crypt}$6$same', 'Same', '/home/same', '/bin/bash']),
+            (2, ['changed', '1002', '1002', '{crypt}$6$new', 'Changed', '/home/changed', '/bin/bash']),
+            (3, ['new', '1003', '1003', '{crypt}$6$new', 'New', '/home/new', '/bin/bash']),
+        ]
+        window = new_window()
+        added = []
+        # Act
+        journal, summary = self._load_users(existing_users, rows, window, added.append)
+        # Assert
+        writes = window.conn.writes
+        self.assertEqual([(operation, cn) for operation, cn, _values in writes], [
+            ('modify', 'changed'), ('add', 'new'),
+        ])
+        self.assertEqual(writes[0][2]['userPassword'][0][1], [b'{crypt}$6$new'])
+        self.assertEqual(writes[1][2]['userPassword'], b'{crypt}$6$new')
+        self.assertEqual(summary, Counter({
+            'skipped_user_add <already exists>': 2,
+            'users_password_updated': 1,
+            'users_added': 1,
+        }))
+        self.assertEqual(journal.committed_rows, [1, 2, 3])
+        self.assertEqual(added, ['new'])
+
+    def test_failed_and_raced_adds(self):
+        # Arrange
+        rows = [
+            (1, ['raced', '1001', '1001', '{crypt}$6$a', 'Raced', '/home/raced', '/bin/bash']),
+            (2, ['denied', '1002', '1002', '{crypt}$6$b', 'Denied', '/home/denied', '/bin/bash']),
+        ]
+        window = new_window({
+            ('add', 'raced'): ENTRY_ALREADY_EXISTS,
+            ('add', 'denied'): INSUFFICIENT_ACCESS,
+        })
+        added = []
+        # Act
+        journal, summary = self._load_users({}, rows, window, added.append)
+        # Assert
+        # A user added since the snapshot gets its password synced instead.
+        self.assertEqual([(operation, cn) for operation, cn, _values in window.conn.writes], [
+            ('add', 'raced'), ('modify', 'raced'), ('add', 'denied'),
+        ])
+        self.assertEqual(summary, Counter({
+            'skipped_user_add <already exists>': 1,
+            'users_password_updated': 1,
+            'user_errors': 1,
+        }))
+        self.assertEqual(journal.committed_rows, [1])
+        self.assertEqual(added, [])
+
+    def test_groups_are_diffed_against_the_snapshot(self):
+        # Arrange
+        existing_groups = {
+            'same': {'cn': 'same', 'gidNumber': 2001, 'memberUid': ['a', 'b']},
+            'changed': {'cn': 'changed', 'gidNumber': 2002, 'memberUid': ['a']},
+        }
+        rows = [
+            (1, ['same', '2001', 'b,a']),
+            (2, ['changed', '2002', 'a,c']),
+            (3, ['new', '2003', 'a']),
+        ]
+        window = new_window()
+        journal = RecordingJournal()
+        summary = Counter()
+        # Act
+        _load_groups(
+            MagicMock(),
+            existing_groups,
+            new_error_policy(),
+            journal,
+            window,
+            rows,
+            summary,
+        )
+        # Assert
+        writes = window.conn.writes
+        self.assertEqual([(operation, cn) for operation, cn, _values in writes], [
+            ('modify', 'changed'), ('add', 'new'),
+        ])
+        self.assertEqual(sorted(writes[0][2]['memberUid'][0][1]), ['a', 'c'])
+        self.assertEqual(summary, Counter({
+            'skipped_group_add <already exists>': 2,
+            'skipped_group_modify <already up to date>': 1,
+            'group_modified': 1,
+            'groups_added': 1,
+        }))
+        self.assertEqual(journal.committed_rows, [1, 2, 3])
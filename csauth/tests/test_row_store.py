@@ -0,0 +1,56 @@
+
+import os
+from unittest import TestCase
+import uuid
+
+from common import row_store
+from common.row_store import RowStore
+from common import tsv_stream
+import settings
+
+
+class TestRowStore(TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(settings.TMP_DIR, f'{uuid.uuid4()}.sqlite')
+        with RowStore(self.path, writable=True) as store:
+            store.writerows([f'user{ix}', str(1000 + ix)] for ix in range(10))
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_rows_are_counted_and_found_by_name(self):
+        with RowStore(self.path) as store:
+            self.assertEqual(store.count(), 10)
+            self.assertEqual(store.get('user7'), ['user7', '1007'])
+            self.assertIsNone(store.get('nobody'))
+
+    def test_ranges_split_rows_for_loaders(self):
+        # Arrange
+        with RowStore(self.path) as store:
+            ranges = store.ranges(3)
+        # Act
+        sources = [f'{self.path}:{start}-{stop}' for start, stop in ranges]
+        chunks = [list(tsv_stream.iter_rows(source)) for source in sources]
+        # Assert
+        self.assertEqual(ranges, [(1, 4), (5, 8), (9, 10)])
+        self.assertEqual(sum(chunks, []), list(tsv_stream.iter_rows(self.path)))
+        self.assertEqual(chunks[1][0], ['user4', '1004'])
+
+    def test_missing_or_non_row_store_files_are_not_read(self):
+        # Arrange
+        missing_path = os.path.join(settings.TMP_DIR, f'{uuid.uuid4()}.sqlite')
+        empty_path = os.path.join(settings.TMP_DIR, f'{uuid.uuid4()}.sqlite')
+        open(empty_path, 'w').close()
+        # Act, Assert
+        with self.assertRaises(row_store.RowStoreError):
+            list(tsv_stream.iter_rows(missing_path))
+        self.assertFalse(os.path.exists(missing_path))
+        with self.assertRaises(row_store.RowStoreError):
+            list(tsv_stream.iter_rows(empty_path))
+        self.assertEqual(os.path.getsize(empty_path), 0)
+        os.remove(empty_path)
+
+    def test_invalid_range_is_rejected(self):
+        with self.assertRaises(row_store.RowStoreError):
+            row_store.parse_source(f'{self.path}:5-2')
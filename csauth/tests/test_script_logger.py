@@ -1,5 +1,6 @@
 
 from logging import Logger, DEBUG, INFO
+from logging.handlers import QueueHandler
 from unittest import TestCase
 
 from common import script_logger as sl
@@ -24,3 +25,48 @@ class TestScriptLogger(TestCase):
         self.assertEqual(logger.handlers[0].level, DEBUG)
         self.assertEqual(logger.handlers[1].level, INFO)
         self.assertEqual(logger.handlers[2].level, INFO)
+
+    def test_task_logger_handlers_are_only_set_up_once(self):
+        # Act.
+        logger = sl.get_task_logger('test-task-logger-twice')
+        logger = sl.get_task_logger('test-task-logger-twice')
+        # Assert.
+        self.assertEqual(len(logger.handlers), 3)
+
+    def test_queued_task_logger_has_1_queue_handler(self):
+        # Act.
+        logger = sl.get_task_logger('test-queued-task-logger', queued=True)
+        # Assert.
+        self.assertEqual(len(logger.handlers), 1)
+        self.assertIsInstance(logger.handlers[0], QueueHandler)
+
+    def test_quiet_rows_counts_row_messages_by_template(self):
+        # Arrange.
+        logger = sl.get_task_logger('test-quiet-rows-logger', quiet_rows=True)
+        # Act.
+        for name in ('a', 'b', 'c'):
+            logger.info('%s has been added', name, extra=sl.ROW)
+        logger.warning('%s failed', 'd', extra=sl.ROW)
+        # Assert.
+        self.assertEqual(dict(logger.filters[0].counts), {'%s has been added': 3})
+
+    def test_task_logger_options_must_match_the_1st_call(self):
+        # Arrange.
+        sl.get_task_logger('test-task-logger-options', quiet_rows=True)
+        # Act & Assert.
+        sl.get_task_logger('test-task-logger-options', quiet_rows=True)
+        with self.assertRaises(ValueError):
+            sl.get_task_logger('test-task-logger-options', queued=True, quiet_rows=True)
+
+    def test_row_totals_are_written_and_reset_before_the_summary(self):
+        # Arrange.
+        logger = sl.get_task_logger('test-row-totals-logger', quiet_rows=True)
+        logger.info('%s has been added', 'a', extra=sl.ROW)
+        # Act.
+        with self.assertLogs(logger, INFO) as logs:
+            sl.log_row_totals(logger)
+            logger.info('summary')
+        # Assert.
+        self.assertIn('1x  %s has been added', logs.output[0])
+        self.assertEqual(logs.output[1], 'INFO:test-row-totals-logger:summary')
+        self.assertEqual(logger.filters[0].counts, {})
@@ -0,0 +1,28 @@
+
+from concurrent.futures import ThreadPoolExecutor
+import crypt
+from unittest import TestCase
+
+from common import security_helpers
+
+
+class TestSecurityHelpers(TestCase):
+
+    def test_hash_passwords_yields_hashes_in_input_order(self):
+        # Arrange
+        plaintext_passwords = ['first', 'second', 'third']
+        # Act
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            hashes = list(security_helpers.hash_passwords(plaintext_passwords, executor))
+        # Assert
+        self.assertEqual(len(hashes), 3)
+        for plaintext_password, hashed_password in zip(plaintext_passwords, hashes):
+            self.assertTrue(hashed_password.startswith('{crypt}$6$'))
+            crypted = hashed_password[len('{crypt}'):]
+            self.assertEqual(crypt.crypt(plaintext_password, crypted), crypted)
+
+    def test_hash_passwords_uses_a_process_pool_by_default(self):
+        hashes = list(security_helpers.hash_passwords(['pw', 'pw']))
+        self.assertEqual(len(hashes), 2)
+        # Each hash has its own salt.
+        self.assertNotEqual(hashes[0], hashes[1])
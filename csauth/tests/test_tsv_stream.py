@@ -0,0 +1,50 @@
+
+from collections import Counter
+from unittest import TestCase
+
+from common.constants import SKIP_FLAG
+from common.file_wrapper import TMPFileWrapper
+from common import tsv_stream
+
+
+class TestTSVStream(TestCase):
+
+    def test_rows_are_read_lazily_in_chunks(self):
+        # Arrange
+        tsv_file = TMPFileWrapper()
+        with tsv_file as f:
+            f.write(''.join(f'user{ix}\t{1000 + ix}\n' for ix in range(5)))
+        summary = Counter()
+        # Act
+        try:
+            chunks = list(tsv_stream.iter_chunks(
+                tsv_stream.count_rows(
+                    tsv_stream.iter_tsv_rows(tsv_file.full_path),
+                    summary,
+                    'rows_read',
+                ),
+                chunk_size=2,
+            ))
+        finally:
+            tsv_file.remove()
+        # Assert
+        self.assertEqual([len(c) for c in chunks], [2, 2, 1])
+        self.assertEqual(chunks[0][0], ['user0', '1000'])
+        self.assertEqual(summary['rows_read'], 5)
+
+    def test_skip_flag_yields_no_rows(self):
+        self.assertEqual(list(tsv_stream.iter_tsv_rows(SKIP_FLAG)), [])
+
+    def test_tee_writes_a_copy_of_passing_rows(self):
+        # Arrange
+        tee_file = TMPFileWrapper()
+        rows = [['user0', '1000'], ['user1', '1001']]
+        # Act
+        try:
+            passed = list(tsv_stream.tee_rows(iter(rows), tee_file))
+            copied = list(tsv_stream.iter_rows(tee_file.full_path))
+        finally:
+            tee_file.remove()
+        # Assert
+        self.assertEqual(passed, rows)
+        self.assertEqual(copied, rows)
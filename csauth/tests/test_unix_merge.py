@@ -0,0 +1,59 @@
+import logging
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from common.unix_merge import MergeIndex
+from scripts.unix_to_tsv import _merge_sources, find_sources
+import settings
+
+
+class TestMergeIndex(TestCase):
+
+    def test_rows_are_deduplicated_and_conflicts_recorded(self):
+        # Arrange
+        merge = MergeIndex()
+        # Act
+        merge.add_user(['jdoe', '1001', '100', '$6$a', 'Jane', '/home/jdoe', '/bin/bash'], 'host-a')
+        merge.add_user(['jdoe', '1001', '100', '$6$b', 'Jane', '/home/jdoe', '/bin/bash'], 'host-b')
+        merge.add_user(['jdoe', '1005', '100', '$6$c', 'Jane', '/home/jdoe', '/bin/bash'], 'host-b')
+        merge.add_user(['rroe', '1001', '100', '$6$d', 'Rick', '/home/rroe', '/bin/bash'], 'host-b')
+        merge.add_group(['staff', '100', 'jdoe'], 'host-a')
+        merge.add_group(['staff', '100', 'rroe,jdoe'], 'host-b')
+        merge.add_group(['admins', '100', 'jdoe'], 'host-b')
+        # Assert
+        self.assertEqual([row[3] for row in merge.iter_user_rows()], ['$6$a'])
+        self.assertEqual(list(merge.iter_group_rows()), [['staff', '100', 'jdoe,rroe']])
+        self.assertEqual(merge.conflicts, [
+            ['username', 'jdoe', '1001', 'host-a', '1005', 'host-b'],
+            ['uidNumber', '1001', 'jdoe', 'host-a', 'rroe', 'host-b'],
+            ['gidNumber', '100', 'staff', 'host-a', 'admins', 'host-b'],
+        ])
+        self.assertEqual(merge.summary['duplicate_users'], 1)
+        self.assertEqual(merge.summary['merged_groups'], 1)
+
+
+class TestMergeSources(TestCase):
+
+    def test_group_conflicts_name_the_group_file(self):
+        # Arrange
+        hosts_dir = tempfile.mkdtemp(dir=settings.TMP_DIR)
+        for host, gid in (('host-a', '100'), ('host-b', '200')):
+            os.makedirs(os.path.join(hosts_dir, host))
+            for name, line in (
+                ('passwd', 'jdoe:x:1001:100:Jane:/home/jdoe:/bin/bash'),
+                ('shadow', 'jdoe:$6$a:19000:0:99999:7:::'),
+                ('group', f'staff:x:{gid}:jdoe'),
+            ):
+                with open(os.path.join(hosts_dir, host, name), 'w') as f:
+                    f.write(line + '\n')
+        # Act
+        merge = _merge_sources(logging.getLogger(__name__), find_sources(hosts_dir), workers=1)
+        shutil.rmtree(hosts_dir)
+        # Assert
+        self.assertEqual(merge.conflicts, [[
+            'groupName', 'staff',
+            '100', os.path.join(hosts_dir, 'host-a', 'group'),
+            '200', os.path.join(hosts_dir, 'host-b', 'group'),
+        ]])
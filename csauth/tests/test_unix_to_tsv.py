@@ -0,0 +1,90 @@
+
+import csv
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from common.file_wrapper import TMPFileWrapper
+from scripts.unix_to_tsv import _build_output
+
+
+def _read_tsv(output: TMPFileWrapper):
+    with open(*output.read_args) as f:
+        return list(csv.reader(f, delimiter='\t'))
+
+
+class TestUnixToTSV(TestCase):
+
+    def setUp(self):
+        self.outputs = (TMPFileWrapper(), TMPFileWrapper())
+
+    def tearDown(self):
+        for output in self.outputs:
+            output.remove()
+
+    def test_passwd_lines_are_joined_with_shadow_hashes(self):
+        # Arrange
+        passwd_lines = [
+            'root:x:0:0:root:/root:/bin/bash',
+            'jdoe:x:1001:1001:Jane Doe:/home/jdoe:/bin/bash',
+            'nohash:x:1002:1002::/home/nohash:/bin/sh',
+        ]
+        shadow_lines = [
+            'root:$6$r$root:19000:0:99999:7:::',
+            'jdoe:$6$s$jdoe:19000:0:99999:7:::',
+            'nohash:!:19000:0:99999:7:::',
+        ]
+        group_lines = [
+            'wheel:x:10:jdoe',
+            'staff:x:100:jdoe,root',
+            'empty:x:101:',
+        ]
+        # Act
+        _build_output(
+            MagicMock(), *self.outputs, iter(passwd_lines), iter(shadow_lines), iter(group_lines),
+        )
+        user_rows, group_rows = (_read_tsv(output) for output in self.outputs)
+        # Assert
+        self.assertEqual(user_rows, [
+            ['jdoe', '1001', '1001', '$6$s$jdoe', 'Jane Doe', '/home/jdoe', '/bin/bash'],
+        ])
+        self.assertEqual(group_rows, [['staff', '100', 'jdoe,root']])
+
+    def test_dangling_references_are_indexed_and_members_can_be_dropped(self):
+        # Arrange
+        passwd_lines = [
+            'root:x:0:0:root:/root:/bin/bash',
+            'jdoe:x:1001:100:Jane Doe:/home/jdoe:/bin/bash',
+            'rroe:x:1002:5000:Rick Roe:/home/rroe:/bin/bash',
+            'solo:x:1003:1003:Solo:/home/solo:/bin/bash',
+        ]
+        shadow_lines = [
+            'root:$6$r$root:19000:0:99999:7:::',
+            'jdoe:$6$s$jdoe:19000:0:99999:7:::',
+            'rroe:$6$s$rroe:19000:0:99999:7:::',
+            'solo:$6$s$solo:19000:0:99999:7:::',
+        ]
+        group_lines = [
+            'staff:x:100:jdoe,root,ghost',
+            'admins:x:101:root',
+            # user-private group without members, it is not exported
+            'solo:x:1003:',
+        ]
+        # Act
+        references = _build_output(
+            MagicMock(),
+            *self.outputs,
+            iter(passwd_lines),
+            iter(shadow_lines),
+            iter(group_lines),
+            drop_dangling=True,
+        )
+        group_rows = _read_tsv(self.outputs[1])
+        # Assert
+        self.assertEqual(group_rows, [['staff', '100', 'jdoe']])
+        self.assertEqual(references.dangling_members, [
+            ['staff', 'root'], ['staff', 'ghost'], ['admins', 'root'],
+        ])
+        self.assertEqual(
+            list(references.iter_dangling_primary_gids()),
+            [['rroe', '5000'], ['solo', '1003']],
+        )